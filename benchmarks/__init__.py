@@ -0,0 +1,13 @@
+'''
+Benchmarks of bet_game. Run from the repository root:
+
+    python -m benchmarks                      # run everything, print a table
+    python -m benchmarks --quick              # fewer repeats, no 10k-player turns
+    python -m benchmarks --save               # write benchmarks/baseline.json
+    python -m benchmarks --compare            # compare with benchmarks/baseline.json
+    python -m benchmarks -k turn_64           # only scenarios containing 'turn_64'
+
+Load generator with per-phase latency percentiles, see benchmarks/load.py:
+
+    python -m benchmarks.load --clients 200 --think 0.005 --target host
+'''
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from .scenarios import scenarios
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def measure(scenario):
+    times = []
+    for _ in range(scenario.repeats):
+        state = scenario.setup()
+        start = time.perf_counter()
+        for _ in range(scenario.number):
+            scenario.run(state)
+        times.append((time.perf_counter() - start) / scenario.number)
+    median = statistics.median(times)
+    return {
+        'median': median,
+        'min': min(times),
+        'ops_per_s': 1 / median if median else None,
+        'number': scenario.number,
+        'repeats': scenario.repeats,
+    }
+
+
+def _git(*args):
+    try:
+        return subprocess.run(
+            ['git', *args], capture_output=True, text=True, cwd=os.path.dirname(BASELINE)
+        ).stdout.strip()
+    except OSError:
+        return ''
+
+
+def _revision():
+    'Checked out commit, and whether uncommitted changes were measured on top of it'
+    revision = _git('rev-parse', '--short', 'HEAD') or None
+    dirty = bool(_git('status', '--porcelain', '--untracked-files=no')) if revision else None
+    return revision, dirty
+
+
+def _format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:8.2f} {unit}'
+    return f'{seconds / 1e-9:8.2f} ns'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='bet_game benchmarks')
+    parser.add_argument('-k', dest='filter', default='', help='only scenarios whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='one repeat less, skip the 10k-player turns')
+    parser.add_argument('--save', nargs='?', const=BASELINE, help='write the results as a baseline (default benchmarks/baseline.json)')
+    parser.add_argument('--compare', nargs='?', const=BASELINE, help='compare with a baseline (default benchmarks/baseline.json)')
+    parser.add_argument('--threshold', type=float, default=1.25, help='fastest repeat slower than baseline median * threshold is a regression')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        # one or two repeats are too noisy to flag regressions
+        if args.quick:
+            parser.error('--compare needs full runs, drop --quick')
+        with open(args.compare, encoding='utf8') as f:
+            data = json.load(f)
+        if data['meta'].get('quick'):
+            parser.error(f'{args.compare} was saved with --quick, it cannot be compared with')
+        baseline = data['results']
+
+    results = {}
+    regressions = []
+    for scenario in scenarios():
+        if args.filter not in scenario.name or (args.quick and not scenario.quick):
+            continue
+        if args.quick:
+            scenario.repeats = max(1, scenario.repeats - 2)
+        result = results[scenario.name] = measure(scenario)
+        line = f'{scenario.name:48} {_format_time(result["median"])}  (min {_format_time(result["min"]).strip()})'
+        if baseline and scenario.name in baseline:
+            reference = baseline[scenario.name]['median']
+            ratio = result['median'] / reference
+            line += f'  x{ratio:.2f}'
+            # every repeat has to be slower, a single noisy median is not a regression
+            if result['min'] > reference * args.threshold:
+                line += '  REGRESSION'
+                regressions.append(scenario.name)
+        print(line, flush=True)
+
+    if args.save:
+        revision, dirty = _revision()
+        data = {
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'revision': revision,
+                'dirty': dirty,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'quick': args.quick,
+            },
+            'results': results,
+        }
+        with open(args.save, 'w', encoding='utf8') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if regressions:
+        print(f'{len(regressions)} regression(s): ' + ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+'''
+Synthetic load: N clients, each driving full games on its own table.
+
+    python -m benchmarks.load --clients 200 --players 8 --turns 5 --think 0.005
+    python -m benchmarks.load --target host --card-rate 0.3 --error-rate 0.01
+    python -m benchmarks.load --target router --workers 4 --clients 1000
+
+Every turn a client draws the event and quest, then each player bets on
+somebody (--bet-rate), takes no bet or buys a random card (--card-rate),
+shows the card if one was bought, plays and evaluates. Players think for
+an exponentially distributed time (mean --think seconds) before acting.
+'''
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from bet_game import Game, GameHost, Router, quiet_logger
+from bet_game.utils import GameplayError
+
+# phase of every command, latencies are reported per phase and per command
+PHASES = {
+    'enable_all': 'setup', 'add_quest': 'setup', 'enroll': 'setup', 'reset_round': 'setup', 'start': 'setup',
+    'draw_event': 'draw', 'draw_quest': 'draw',
+    'bet': 'bet', 'draw_card': 'bet',
+    'show_card': 'play', 'decide_card': 'play', 'play': 'play',
+    'evaluate_score': 'evaluate', 'evaluate_bet': 'evaluate',
+}
+QUEST_ARGS = ['9', 1.0, '9+', 1.0, '10', 1.0]
+
+
+class GameTarget:
+    'Calls the Game API directly on the event loop'
+    name = 'game'
+
+    def __init__(self):
+        self.tables = {}
+
+    async def open(self, table_id, **kwargs):
+        self.tables[table_id] = Game(**kwargs)
+
+    async def call(self, table_id, command, *args):
+        return getattr(self.tables[table_id], command)(*args)
+
+    async def close(self):
+        self.tables.clear()
+
+
+class HostTarget:
+    'Sends the commands through the queues of an in-process GameHost'
+    name = 'host'
+
+    def __init__(self, **host_kwargs):
+        self.host = GameHost(**host_kwargs)
+
+    async def open(self, table_id, **kwargs):
+        self.host.open_table(table_id, **kwargs)
+
+    async def call(self, table_id, command, *args):
+        return await self.host.submit(table_id, command, *args)
+
+    async def close(self):
+        await self.host.close()
+
+
+class RouterTarget:
+    'Forwards the commands to tables spread over worker processes'
+    name = 'router'
+
+    def __init__(self, workers=None):
+        self.router = Router(workers=workers)
+
+    async def start(self):
+        # worker processes start before the clock does
+        await self.router.start()
+
+    async def open(self, table_id, **kwargs):
+        kwargs.pop('logger', None) # workers are quiet, the logger stays here
+        await self.router.open_table(table_id, **kwargs)
+
+    async def call(self, table_id, command, *args):
+        return await self.router.submit(table_id, command, *args)
+
+    async def close(self):
+        await self.router.close()
+
+
+TARGETS = {'game': GameTarget, 'host': HostTarget, 'router': RouterTarget}
+
+
+class CardPolicy:
+    'Uses a shown card with probability p, seeded; a class so router workers can unpickle it'
+    def __init__(self, seed, p=0.5):
+        self.rng = random.Random(seed)
+        self.p = p
+
+    def __call__(self, card):
+        return self.rng.random() < self.p
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {} # command -> [seconds]
+        self.errors = {} # command -> count
+        self.turns = 0
+        self.games = 0
+
+    async def call(self, target, table_id, command, *args, expect_error=False):
+        start = time.perf_counter()
+        try:
+            result = await target.call(table_id, command, *args)
+        except GameplayError:
+            if not expect_error:
+                raise
+            self.errors[command] = self.errors.get(command, 0) + 1
+            result = None
+        self.latencies.setdefault(command, []).append(time.perf_counter() - start)
+        return result
+
+
+def percentile(ordered, q):
+    'Nearest-rank percentile of a sorted list'
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+
+
+def _summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1],
+    }
+
+
+async def _think(rng, mean):
+    await asyncio.sleep(rng.expovariate(1 / mean) if mean > 0 else 0)
+
+
+async def client(index, target, recorder:Recorder, args):
+    rng = random.Random(args.seed * 1000003 + index)
+    table_id = f'load{index}'
+    ids = [f'c{index}p{i}' for i in range(args.players)]
+    call = recorder.call
+    for game_index in range(args.games):
+        if game_index == 0:
+            await target.open(
+                table_id, game_type='arcaea', turns=args.turns, seed=args.seed + index,
+                random_card=args.card_rate > 0, card_policy=CardPolicy(f'card-{args.seed}-{index}'),
+                logger=quiet_logger(), record_plays=False
+            )
+            await call(target, table_id, 'enable_all')
+            await call(target, table_id, 'add_quest', QUEST_ARGS)
+            for id in ids:
+                await call(target, table_id, 'enroll', id)
+        else:
+            await call(target, table_id, 'reset_round', args.turns)
+        await call(target, table_id, 'start')
+        for _ in range(args.turns):
+            await call(target, table_id, 'draw_event')
+            await call(target, table_id, 'draw_quest')
+            bought = False
+            for id in ids:
+                await _think(rng, args.think)
+                if rng.random() < args.error_rate:
+                    # betting oneself is always refused
+                    await call(target, table_id, 'bet', id, id, 1, expect_error=True)
+                if rng.random() < args.card_rate:
+                    await call(target, table_id, 'draw_card', id)
+                    bought = True
+                elif rng.random() < args.bet_rate:
+                    other = ids[(ids.index(id) + rng.randrange(1, len(ids))) % len(ids)]
+                    await call(target, table_id, 'bet', id, other, rng.randint(1, 3))
+                else:
+                    await call(target, table_id, 'bet', id, None)
+            if bought:
+                await call(target, table_id, 'show_card')
+            for id in ids:
+                await _think(rng, args.think)
+                await call(target, table_id, 'play', id, rng.randint(8000000, 10000000))
+            await call(target, table_id, 'evaluate_score')
+            await call(target, table_id, 'evaluate_bet')
+            recorder.turns += 1
+        recorder.games += 1
+
+
+async def run(args):
+    target = RouterTarget(args.workers) if args.target == 'router' else TARGETS[args.target]()
+    recorder = Recorder()
+    if hasattr(target, 'start'):
+        await target.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(client(index, target, recorder, args) for index in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    await target.close()
+
+    phases = {}
+    for command, latencies in recorder.latencies.items():
+        phases.setdefault(PHASES.get(command, command), []).extend(latencies)
+    commands = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {
+        'config': vars(args),
+        'elapsed': elapsed,
+        'commands': commands,
+        'errors': recorder.errors,
+        'throughput': {
+            'commands_per_s': commands / elapsed,
+            'turns_per_s': recorder.turns / elapsed,
+            'games_per_s': recorder.games / elapsed,
+        },
+        'phases': {phase: _summary(latencies) for phase, latencies in phases.items()},
+        'commands_latency': {command: _summary(latencies) for command, latencies in recorder.latencies.items()},
+    }
+
+
+def _ms(seconds):
+    return f'{seconds * 1e3:9.3f}'
+
+
+def report(result):
+    throughput = result['throughput']
+    lines = [
+        f'{result["config"]["clients"]} clients, {result["commands"]} commands in {result["elapsed"]:.2f} s: '
+        f'{throughput["commands_per_s"]:.0f} commands/s, {throughput["turns_per_s"]:.1f} turns/s, '
+        f'{throughput["games_per_s"]:.2f} games/s',
+        f'{"phase":16} {"count":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}',
+    ]
+    for name, row in list(result['phases'].items()) + [('', None)] + list(result['commands_latency'].items()):
+        if row is None:
+            lines.append(f'{"command":16}')
+            continue
+        lines.append(f'{name:16} {row["count"]:8} {_ms(row["p50"])} {_ms(row["p95"])} {_ms(row["p99"])} {_ms(row["max"])}')
+    if result['errors']:
+        lines.append('refused: ' + ', '.join(f'{command} x{count}' for command, count in result['errors'].items()))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description='bet_game load generator')
+    parser.add_argument('--clients', type=int, default=100, help='concurrent clients, one table each')
+    parser.add_argument('--players', type=int, default=6, help='players per table')
+    parser.add_argument('--turns', type=int, default=5, help='turns per game')
+    parser.add_argument('--games', type=int, default=1, help='games per client')
+    parser.add_argument('--think', type=float, default=0.0, help='mean think time in seconds before a bet or play')
+    parser.add_argument('--bet-rate', type=float, default=0.7, help='chance a player bets on somebody')
+    parser.add_argument('--card-rate', type=float, default=0.1, help='chance a player buys a random card instead')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance a player first sends a refused bet')
+    parser.add_argument('--target', choices=sorted(TARGETS), default='game')
+    parser.add_argument('--workers', type=int, help='router worker processes (default: one per core)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+    if args.players < 2:
+        # bets need somebody else to bet on
+        parser.error('--players must be at least 2')
+
+    result = asyncio.run(run(args))
+    print(report(result))
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import random
+from bet_game import Game, quiet_logger
+from bet_game.card import RandomCard
+from bet_game.parser import get_arcaea_info, get_phigros_info
+from bet_game.quest import QuestPool
+from bet_game.rng import CounterRNG, PURPOSE_QUEST
+from bet_game.rules import RuleSet
+from bet_game.song import ArcaeaSongPackageManager, PhigrosSongPackageManager, clear_quest_cache
+
+class Scenario:
+    '''
+    setup() builds the state outside the timed region, run(state) is one
+    operation. Every repeat gets a fresh state and times number operations.
+    '''
+    def __init__(self, name, setup, run, number=1, repeats=5, quick=True):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.number = number
+        self.repeats = repeats
+        self.quick = quick # part of --quick runs
+
+
+# catalogue
+def _catalogue(loader):
+    # bypass the process-wide lru_cache, every call parses the song list again
+    return Scenario(f'catalogue_load_{loader.__name__[4:-5]}', lambda: None, lambda _: loader.__wrapped__(), number=5)
+
+
+# quest lists
+ARCAEA_DEMO_ARGS = [
+    '7', 1.0, '8', 2.0, '9', 3.0, '9+', 3.0, '10', 2.0, '10+', 1.0, '11', 0.0, '12', 0.0,
+    'ban', 'dropdead', 'ban', 'fallensquare', 'ban', 'altale', 'ban', 'ifi',
+]
+QUEST_FILTERS = (
+    # name, manager, packages (None = all), difficulties (None = all), add_quest args
+    ('arcaea_all', ArcaeaSongPackageManager, None, None, ['9', 1.0, '9+', 1.0, '10', 1.0]),
+    ('arcaea_demo', ArcaeaSongPackageManager, ['core', 'rei', 'yugamu', 'prelude', 'vs'], ['ftr'], ARCAEA_DEMO_ARGS),
+    ('arcaea_one_pack', ArcaeaSongPackageManager, ['core'], ['ftr', 'byd'], ['8', 1.0, '9', 1.0]),
+    ('phigros_all', PhigrosSongPackageManager, None, None, ['13', 1.0, '14', 1.0, '15', 1.0]),
+)
+
+def _quest_manager(manager_class, packages, difficulties):
+    manager = manager_class()
+    if packages is None:
+        manager.enable_all_packages()
+    else:
+        for package in packages:
+            manager.enable(package)
+    if difficulties is None:
+        manager.enable_all_difficulties()
+    else:
+        for difficulty in difficulties:
+            manager.enable(difficulty)
+    return manager
+
+def _quest_list(name, manager_class, packages, difficulties, args, cached):
+    def setup():
+        clear_quest_cache()
+        manager = _quest_manager(manager_class, packages, difficulties)
+        if cached:
+            manager.build_quest_list(manager.available_packages, manager.available_difficulties, [tuple(args)])
+        return manager
+    def run(manager):
+        if not cached:
+            clear_quest_cache()
+        manager.build_quest_list(manager.available_packages, manager.available_difficulties, [tuple(args)])
+    return Scenario(f'add_quest_{name}_{"cached" if cached else "cold"}', setup, run, number=20)
+
+
+# quest draws
+DRAWS = 10000
+
+def _draw_quest(counter_rng):
+    def setup():
+        manager = _quest_manager(ArcaeaSongPackageManager, None, None)
+        pool = QuestPool(manager.build_quest_list(manager.available_packages, manager.available_difficulties, [('9', 1.0, '10', 2.0, '11', 1.0)]))
+        rng = CounterRNG(1).stream(0, PURPOSE_QUEST) if counter_rng else random.Random(1)
+        return pool, rng
+    def run(state):
+        pool, rng = state
+        for _ in range(DRAWS):
+            pool.draw_quest(rng=rng)
+    return Scenario(f'draw_quest_x{DRAWS}_{"counter_rng" if counter_rng else "random"}', setup, run, number=3)
+
+
+# full turns
+PLAYER_COUNTS = (4, 64, 1000, 10000)
+CARDS = tuple(card_func.__name__ for card_func in RandomCard(random_card=True).cards)
+_free_cards = RuleSet('free_cards', card_cost=lambda player_num: 0) # the card is bought every turn
+
+def _turn(players, card, number, repeats, quick):
+    ids = [f'p{i:05d}' for i in range(players)]
+    def setup():
+        game = Game(
+            'arcaea', turns=number + 1, random_p=0.5, seed=players,
+            random_card=[card] if card else False, card_policy=lambda card: True,
+            logger=quiet_logger(), rules=_free_cards, record_plays=False
+        )
+        game.enable_all()
+        game.add_quest(['9', 1.0, '10', 1.0])
+        for id in ids:
+            game.enroll(id)
+        game.start()
+        return game
+    def run(game):
+        game.draw_event()
+        game.draw_quest()
+        if card:
+            game.draw_card(game.standings.players[0].id)
+        for i, id in enumerate(ids):
+            game.bet(id, ids[(i + 1) % players] if i % 3 else None, 1 + i % 3)
+        if card:
+            game.show_card()
+        for i, id in enumerate(ids):
+            game.play(id, 9000000 + (i * 7919) % 1000000)
+        game.evaluate_score()
+        game.evaluate_bet()
+    return Scenario(f'turn_{players}_{card if card else "no_card"}', setup, run, number=number, repeats=repeats, quick=quick)
+
+
+def scenarios():
+    yield _catalogue(get_arcaea_info)
+    yield _catalogue(get_phigros_info)
+    for filters in QUEST_FILTERS:
+        yield _quest_list(*filters, cached=False)
+        yield _quest_list(*filters, cached=True)
+    yield _draw_quest(counter_rng=True)
+    yield _draw_quest(counter_rng=False)
+    for players in PLAYER_COUNTS:
+        number = max(1, min(50, 20000 // players))
+        repeats = 5 if players <= 1000 else 3
+        for card in (None,) + CARDS:
+            yield _turn(players, card, number, repeats, quick=players <= 1000)
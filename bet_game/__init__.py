@@ -1 +1,8 @@
 from .game import Game
+from .host import GameHost
+from .logger import Logger, quiet_logger
+from .store import ResultStore
+from .rating import Leaderboard
+from .stats import StatsAggregator
+from .timing import PhaseTimings, process_timings
+from .router import Router
@@ -1,5 +1,6 @@
 from .player import Player
-from .utils import GameplayError, log
+from .utils import GameplayError
+from .logger import default_logger, KIND_CARD
 import random
 from math import floor, ceil
 from functools import cmp_to_key
@@ -25,11 +26,16 @@ def search_player(id, player_list):
         if player.id == id:
             return player
 
+def index_players(player_list):
+    'id -> Player, for the hooks that look up every bet target'
+    return {player.id: player for player in player_list}
+
 class CardInstance:
     def __init__(
         self,
         description='',
         user='',
+        name='',
         playing_score_preprocess=0,
         score_rank_cmp=0,
         target_rearrange=0,
@@ -41,6 +47,7 @@ class CardInstance:
         ):
         self.description = description
         self.user = user
+        self.name = name # RandomCard method that made the card, rebuilds it from a snapshot
         self.user_deduct_list = []
         self.playing_score_preprocess = playing_score_preprocess if playing_score_preprocess else self.default_playing_score_preprocess
         self.score_rank_cmp = score_rank_cmp if score_rank_cmp else self.default_score_ranking_cmp
@@ -72,9 +79,10 @@ class CardInstance:
 
     def default_bet_deduct(self, player_list):
         deduct_list = player_list
+        players = index_players(deduct_list)
         for player in deduct_list:
             if player.bet_id:
-                bet_player = search_player(player.bet_id, deduct_list)
+                bet_player = players.get(player.bet_id)
                 bet_player.score -= 1
                 if bet_player.betted is None:
                     bet_player.betted = 1
@@ -94,9 +102,10 @@ class CardInstance:
         max_score = evaluate_list[0].score
         score_list = [0 for _ in range(len(evaluate_list))]
 
+        players = index_players(evaluate_list)
         for i, player in enumerate(evaluate_list):
             if player.bet_id:
-                bet_player = search_player(player.bet_id, evaluate_list)
+                bet_player = players.get(player.bet_id)
                 if bet_player.score == max_score:
                     score_list[i] = player.stake
                 else:
@@ -126,9 +135,14 @@ class RandomCard:
     def __init__(
         self,
         game_type='arcaea',
-        random_card=False
+        random_card=False,
+        logger=None,
+        card_cost=None
     ):
         self.game_type = game_type
+        # card_cost(player_num) -> points, RuleSet.card_cost
+        self.card_cost = card_cost if card_cost else (lambda player_num: floor(player_num/2))
+        self.logger = logger if logger else default_logger
         if random_card:
             self.__status = self.STATUS_110_CARD_AVAILABLE
         else:
@@ -136,6 +150,7 @@ class RandomCard:
 
         self.player_rank_list = []
         self.card_pending_list = []
+        self.__effect_rng = random
 
         # card效果只在一个turn内生效
         self.cards = [
@@ -148,6 +163,13 @@ class RandomCard:
             self.force_max_score,
             self.fake_card
         ]
+        if isinstance(random_card, (list, tuple)):
+            # random_card may name the cards to draw from instead of True
+            names = [card_func.__name__ for card_func in self.cards]
+            for name in random_card:
+                if name not in names:
+                    raise GameplayError(f'Unknown card {name}')
+            self.cards = [card_func for card_func in self.cards if card_func.__name__ in random_card]
 
     def reset_turn(self):
         self.__status = self.STATUS_110_CARD_AVAILABLE
@@ -167,45 +189,96 @@ class RandomCard:
          key=cmp_to_key(score_cmp))
         self.card_pending_list = []
 
+    @property
+    def called(self):
+        'Somebody tried to buy a card that has not been shown yet'
+        return self.__status == self.STATUS_111_CARD_CALL
+
     def add_pending_queue(self, player:Player):
         if self.__status == self.STATUS_000_CARD_UNAVAILABLE:
             raise GameplayError('Invalid operation. Random card is not activated in the current game.')
         else:
             self.__status = self.STATUS_111_CARD_CALL
-            if player.score >= floor(len(self.player_rank_list)/2):
+            cost = self.card_cost(len(self.player_rank_list))
+            if player.score >= cost:
                 self.card_pending_list.append(player)
-                log(f'Player {player.id} uses {floor(len(self.player_rank_list)/2)} points trying to buy a random card.')
+                self.logger.info(KIND_CARD, 'Player {} uses {} points trying to buy a random card.',
+                    player.id, cost)
             else:
-                log(f'Player {player.id} doesn\'t have enough points to buy a random card!')
+                self.logger.info(KIND_CARD, 'Player {} doesn\'t have enough points to buy a random card!', player.id)
     
-    def print_card(self) -> CardInstance:
+    def print_card(self, rng=random, effect_rng=random) -> CardInstance:
         if self.__status == self.STATUS_000_CARD_UNAVAILABLE:
             raise GameplayError('Invalid operation. Random card is not activated in the current game.')
         elif not len(self.card_pending_list):
-            log(f'No user ordered card.')
+            self.logger.info(KIND_CARD, 'No user ordered card.')
+            if self.__status == self.STATUS_111_CARD_CALL:
+                # buyers who could not pay, the call is answered
+                self.__status = self.STATUS_110_CARD_AVAILABLE
             return self.default_card()
         else:
             self.card_pending_list = sorted(self.card_pending_list,
              reverse=True, key=cmp_to_key(score_cmp))
-            card_int = random.randint(0, 7)
+            self.__effect_rng = effect_rng
+            card_int = rng.randint(0, len(self.cards) - 1)
             card_func = self.cards[card_int]
             self.__card = card_func(user=self.card_pending_list[0])
+            self.__card.name = card_func.__name__
             self.__card.user_deduct_list = self.card_pending_list
             self.__status = self.STATUS_112_CARD_DETERMINED
             return self.__card
     
+    # snapshot
+    def card_state(self, card:CardInstance):
+        'A card as data: [name, user id, deduct player ids], None for the default card'
+        if not card.valid:
+            return None
+        return [card.name, card.user.id, [player.id for player in card.user_deduct_list]]
+
+    def make_card(self, state, players:dict) -> CardInstance:
+        'Rebuild a card from card_state(), players maps id -> Player'
+        if state is None:
+            return self.default_card()
+        name, user_id, deduct_ids = state
+        if name not in [card_func.__name__ for card_func in self.cards]:
+            raise GameplayError(f'Unknown card {name}')
+        card = getattr(self, name)(user=players[user_id])
+        card.name = name
+        card.user_deduct_list = [players[id] for id in deduct_ids]
+        return card
+
+    def state(self):
+        return {
+            'status': self.__status,
+            'rank_list': [player.id for player in self.player_rank_list],
+            'pending': [player.id for player in self.card_pending_list]
+        }
+
+    def call_state(self):
+        'Status and buyers of the turn, what add_pending_queue() changes'
+        return self.__status, list(self.card_pending_list)
+
+    def load_call_state(self, state):
+        self.__status, pending = state
+        self.card_pending_list = list(pending)
+
+    def load_state(self, state, players:dict, effect_rng=random):
+        self.__status = state['status']
+        self.player_rank_list = [players[id] for id in state['rank_list']]
+        self.card_pending_list = [players[id] for id in state['pending']]
+        self.__effect_rng = effect_rng
+
     # Card details
     def target_shift(self, user) -> CardInstance:
         _desc = "所有对他人下注的目标按上轮总分位次将目标后移一个人"
         _user = user
         def _target_rearrange(player_list):
             rearrange_list = player_list
+            rank = {_player.id: i for i, _player in reversed(list(enumerate(self.player_rank_list)))}
             for player in rearrange_list:
-                if player.bet_id:
-                    for i, _player in enumerate(self.player_rank_list):
-                        if _player.id == player.bet_id:
-                            player.bet_id = self.player_rank_list[(i+1)%len(self.player_rank_list)].id
-                            break
+                if player.bet_id and player.bet_id in rank:
+                    i = rank[player.bet_id]
+                    player.bet_id = self.player_rank_list[(i+1)%len(self.player_rank_list)].id
             return rearrange_list
 
         card = CardInstance(
@@ -235,9 +308,10 @@ class RandomCard:
             score_list = [0 for _ in range(len(score_evaluate_list))]
             score_pool = 0
 
+            players = index_players(score_evaluate_list)
             for i, player in enumerate(score_evaluate_list):
                 if player.bet_id:
-                    bet_player = search_player(player.bet_id, score_evaluate_list)
+                    bet_player = players.get(player.bet_id)
                     if bet_player.score == max_score:
                         score_list[i] = player.stake
                     else:
@@ -246,12 +320,12 @@ class RandomCard:
                             score_pool += player.stake
 
             score_reward = score_pool // len(score_reward_list)
+            reward_ids = {player.id for player in score_reward_list}
             for i, player in enumerate(score_evaluate_list):
                 player.bet_reward = score_list[i]
                 player.score += score_list[i]
-                for _player in score_reward_list:
-                    if player.id == _player.id:
-                        player.card_reward = score_reward
+                if player.id in reward_ids:
+                    player.card_reward = score_reward
             return score_evaluate_list
         
         card = CardInstance(
@@ -287,9 +361,10 @@ class RandomCard:
             max_score = evaluate_list[0].score
             score_list = [0 for _ in range(len(evaluate_list))]
 
+            players = index_players(evaluate_list)
             for i, player in enumerate(evaluate_list):
                 if player.bet_id:
-                    bet_player = search_player(player.bet_id, evaluate_list)
+                    bet_player = players.get(player.bet_id)
                     if bet_player.score == max_score:
                         score_list[i] = player.stake
 
@@ -342,7 +417,7 @@ class RandomCard:
             for player in preprocess_list:
                 if player.playing_score < min_score:
                     min_score = player.playing_score
-            rand_score = random.randint(min_score, max_score)
+            rand_score = self.__effect_rng.randint(min_score, max_score)
             for player in preprocess_list:
                 if player.id == user.id:
                     player.playing_score = rand_score
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+from contextlib import closing
+import numpy as _np
+from .result import TurnResult
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+NULL = -2**31 # missing ints, missing dictionary codes are -1 and missing floats NaN
+
+# one row per player and turn
+COLUMNS = (
+    ('game_id', 'dict'),
+    ('round', '<i4'),
+    ('turn', '<i4'),
+    ('time', '<f8'),
+    ('quest', 'dict'),
+    ('song_id', 'dict'),
+    ('difficulty', 'dict'),
+    ('level', '<f4'),
+    ('player', 'dict'),
+    ('playing_score', '<i4'),
+    ('rank', '<i4'),
+    ('cur_pt', '<i4'),
+    ('bet_id', 'dict'),
+    ('stake', '<i4'),
+    ('bet_reward', '<i4'),
+    ('card_reward', '<i4'),
+    ('score', '<i4'),
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+_DICT_DTYPE = '<i4'
+
+
+def _chunk_file(path, chunk, name):
+    return os.path.join(path, f'{chunk:05d}.{name}.npy')
+
+
+class ColumnarWriter:
+    '''
+    Writes turn results into a directory of .npy column chunks.
+    Every chunk_rows rows one file per column is written, strings are
+    dictionary encoded into int32 codes. The manifest (dictionaries and
+    chunk sizes) is rewritten atomically after each chunk, so a dataset
+    is always readable and an existing one is appended to.
+    '''
+    def __init__(self, path, chunk_rows=65536):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+        self.__chunks = []
+        self.__dictionaries = {name: [] for name, dtype in COLUMNS if dtype == 'dict'}
+        manifest = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf8') as f:
+                data = json.load(f)
+            if data['version'] != FORMAT_VERSION or [column['name'] for column in data['columns']] != list(COLUMN_NAMES):
+                raise ValueError(f'{path} holds an incompatible columnar dataset')
+            self.__chunks = data['chunks']
+            self.__dictionaries = data['dictionaries']
+        self.__codes = {name: {value: code for code, value in enumerate(values)} for name, values in self.__dictionaries.items()}
+        self.__buffers = {name: [] for name in COLUMN_NAMES}
+        self.__lock = threading.Lock()
+
+    @property
+    def rows(self):
+        return sum(self.__chunks) + len(self.__buffers['turn'])
+
+    def __code(self, name, value):
+        if value is None:
+            return -1
+        codes = self.__codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.__dictionaries[name].append(value)
+        return code
+
+    def __append(self, row):
+        for (name, dtype), value in zip(COLUMNS, row):
+            if dtype == 'dict':
+                value = self.__code(name, value)
+            elif value is None:
+                value = NULL if dtype == '<i4' else float('nan')
+            self.__buffers[name].append(value)
+        if len(self.__buffers['turn']) >= self.chunk_rows:
+            self.__flush()
+
+    def on_turn(self, result:TurnResult):
+        'Turn listener, see Game.add_turn_listener'
+        with self.__lock:
+            for player in result.players:
+                self.__append((
+                    result.game_id, result.round, result.turn, result.time,
+                    result.quest, result.song_id, result.difficulty, result.level,
+                    player.id, player.playing_score, player.rank, player.cur_pt,
+                    player.bet_id, player.stake, player.bet_reward, player.card_reward, player.score
+                ))
+
+    def attach(self, game):
+        game.add_turn_listener(self.on_turn)
+        return game
+
+    def export_store(self, store, since=None):
+        'Append every turn of a ResultStore, oldest first. Returns the number of rows'
+        sql = (
+            'SELECT t.game_id, t.round, t.turn, t.time, t.quest, t.song_id, t.difficulty, t.level, '
+            'p.player, p.playing_score, p.rank, p.cur_pt, p.bet_id, p.stake, p.bet_reward, p.card_reward, p.score '
+            'FROM turns t JOIN turn_players p USING (game_id, round, turn) '
+            'WHERE t.time >= ? ORDER BY t.time, t.game_id, t.round, t.turn'
+        )
+        rows = 0
+        with self.__lock, closing(store.connect()) as db:
+            for row in db.execute(sql, (since if since else 0,)):
+                self.__append(row)
+                rows += 1
+        return rows
+
+    def __flush(self):
+        count = len(self.__buffers['turn'])
+        if not count:
+            return
+        chunk = len(self.__chunks)
+        for name, dtype in COLUMNS:
+            array = _np.asarray(self.__buffers[name], dtype=_DICT_DTYPE if dtype == 'dict' else dtype)
+            _np.save(_chunk_file(self.path, chunk, name), array)
+            self.__buffers[name] = []
+        self.__chunks.append(count)
+        self.__write_manifest()
+
+    def __write_manifest(self):
+        data = {
+            'version': FORMAT_VERSION,
+            'columns': [
+                {'name': name, 'dtype': _DICT_DTYPE if dtype == 'dict' else dtype, 'dictionary': dtype == 'dict'}
+                for name, dtype in COLUMNS
+            ],
+            'null': NULL,
+            'chunks': self.__chunks,
+            'dictionaries': self.__dictionaries
+        }
+        temp = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(temp, 'w', encoding='utf8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp, os.path.join(self.path, MANIFEST))
+
+    def flush(self):
+        'Write the buffered rows as a (possibly short) chunk'
+        with self.__lock:
+            self.__flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarReader:
+    '''
+    Columns of a dataset written by ColumnarWriter. Chunks are memory-mapped,
+    column() concatenates them (no copy for a single chunk). Dictionary
+    columns are int32 codes, compare them with code() and turn them back
+    into strings with decode().
+    '''
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, MANIFEST), encoding='utf8') as f:
+            data = json.load(f)
+        if data['version'] != FORMAT_VERSION:
+            raise ValueError(f'Unsupported columnar format version {data["version"]}')
+        self.columns = tuple(column['name'] for column in data['columns'])
+        self.chunk_rows = tuple(data['chunks'])
+        self.null = data['null']
+        self.__dictionaries = data['dictionaries']
+        self.__codes = {}
+
+    def __len__(self):
+        return sum(self.chunk_rows)
+
+    def chunk(self, index, name):
+        return _np.load(_chunk_file(self.path, index, name), mmap_mode=self.mmap_mode)
+
+    def chunks(self, name):
+        for index in range(len(self.chunk_rows)):
+            yield self.chunk(index, name)
+
+    def column(self, name):
+        if name not in self.columns:
+            raise KeyError(name)
+        if len(self.chunk_rows) == 1:
+            return self.chunk(0, name)
+        if not self.chunk_rows:
+            return _np.empty(0, dtype=_DICT_DTYPE if name in self.__dictionaries else dict(COLUMNS)[name])
+        return _np.concatenate(list(self.chunks(name)))
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def dictionary(self, name):
+        return self.__dictionaries[name]
+
+    def code(self, name, value):
+        '''
+        Code of a dictionary value, -1 for None (the missing rows).
+        KeyError if the value never occurs: -1 would select the missing rows.
+        '''
+        if value is None:
+            return -1
+        codes = self.__codes.get(name)
+        if codes is None:
+            codes = self.__codes[name] = {value: code for code, value in enumerate(self.__dictionaries[name])}
+        code = codes.get(value)
+        if code is None:
+            raise KeyError(f'{value!r} never occurs in {name}')
+        return code
+
+    def decode(self, name, codes):
+        'Strings of dictionary codes, None for missing values'
+        values = _np.array(self.__dictionaries[name] + [None], dtype=object)
+        return values[_np.asarray(codes)]
+
+    def valid(self, name):
+        'Mask of the rows where name is not missing'
+        column = self.column(name)
+        if name in self.__dictionaries:
+            return column >= 0
+        if column.dtype.kind == 'f':
+            return ~_np.isnan(column)
+        return column != self.null
@@ -0,0 +1,143 @@
+import heapq
+import threading
+
+class _Node:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = {} # key -> (-weight, key) of the keys ending here
+        self.top = () # best k (-weight, key) of the subtree, best first
+
+
+class Autocomplete:
+    '''
+    Prefix completion ranked by weight (score, popularity...).
+    Every trie node keeps the best k entries of its subtree, so complete()
+    only walks the prefix and slices that list. set() and remove() refresh
+    the lists on the path of the key, O(len(key) * k) when a weight grows
+    and O(len(key) * branching * k) when it drops.
+    Keys are matched on normalize(key), e.g. str.casefold for titles.
+    '''
+    def __init__(self, k=8, normalize=None):
+        self.k = k
+        self.normalize = normalize
+        self.__root = _Node()
+        self.__weights = {}
+        self.__pending = {} # add() increments not in the lists yet
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__weights.keys() | self.__pending.keys())
+
+    def __contains__(self, key):
+        return key in self.__weights or key in self.__pending
+
+    def weight(self, key):
+        if key in self.__pending:
+            return self.__weights.get(key, 0) + self.__pending[key]
+        return self.__weights.get(key)
+
+    def __path(self, key, create):
+        node = self.__root
+        path = [node]
+        for char in (self.normalize(key) if self.normalize else key):
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _Node()
+            node = child
+            path.append(node)
+        return path
+
+    def __refresh(self, node:_Node):
+        candidates = list(node.entries.values())
+        for child in node.children.values():
+            candidates.extend(child.top)
+        node.top = tuple(heapq.nsmallest(self.k, candidates))
+
+    def __set(self, key, weight):
+        path = self.__path(key, True)
+        old = path[-1].entries.get(key)
+        entry = path[-1].entries[key] = (-weight, key)
+        self.__weights[key] = weight
+        for node in reversed(path):
+            top = node.top
+            if old is not None and old in top:
+                if entry <= old:
+                    node.top = tuple(sorted(entry if item == old else item for item in top))
+                else:
+                    # a lower weight may let another key of the subtree in
+                    self.__refresh(node)
+            elif len(top) < self.k or entry < top[-1]:
+                node.top = tuple(sorted(top + (entry,))[:self.k])
+            else:
+                # not among the best k here, so neither in any node above
+                break
+
+    def set(self, key, weight):
+        with self.__lock:
+            self.__apply_pending()
+            self.__set(key, weight)
+
+    def add(self, key, delta=1):
+        '''
+        Raise the weight of key by delta, a new key starts at 0.
+        Increments are only counted here and applied by the next query.
+        '''
+        with self.__lock:
+            self.__pending[key] = self.__pending.get(key, 0) + delta
+
+    def __apply_pending(self):
+        if self.__pending:
+            pending = self.__pending
+            self.__pending = {}
+            for key, delta in pending.items():
+                self.__set(key, self.__weights.get(key, 0) + delta)
+
+    def remove(self, key):
+        with self.__lock:
+            self.__apply_pending()
+            path = self.__path(key, False)
+            if path is None or key not in path[-1].entries:
+                raise KeyError(key)
+            del path[-1].entries[key]
+            del self.__weights[key]
+            # unlink the nodes left empty, then refresh the rest of the path
+            chars = self.normalize(key) if self.normalize else key
+            while len(path) > 1 and not path[-1].entries and not path[-1].children:
+                path.pop()
+                del path[-1].children[chars[len(path) - 1]]
+            for node in reversed(path):
+                self.__refresh(node)
+
+    def update(self, items):
+        'Set many (key, weight) at once, the lists are rebuilt in one pass'
+        with self.__lock:
+            self.__apply_pending()
+            for key, weight in items:
+                self.__path(key, True)[-1].entries[key] = (-weight, key)
+                self.__weights[key] = weight
+            # children before parents
+            order = [self.__root]
+            for node in order:
+                order.extend(node.children.values())
+            for node in reversed(order):
+                self.__refresh(node)
+
+    def __top(self, prefix):
+        if self.__pending:
+            with self.__lock:
+                self.__apply_pending()
+        path = self.__path(prefix, False)
+        return path[-1].top if path else ()
+
+    def complete(self, prefix, k=None):
+        'Keys starting with prefix, best first, at most k (at most self.k)'
+        top = self.__top(prefix)
+        return [key for _, key in (top[:k] if k else top)]
+
+    def complete_weighted(self, prefix, k=None):
+        top = self.__top(prefix)
+        return [(key, -weight) for weight, key in (top[:k] if k else top)]
@@ -0,0 +1,146 @@
+import threading
+from collections import deque
+from .game import Game, PHASES
+from .player import Player
+
+# commands that only change the player named by their first argument
+PLAYER_COMMANDS = frozenset(('enroll', 'bet', 'draw_card', 'play'))
+# Player.STATE_FIELDS sent to spectators, by index
+FIELDS = tuple((index, field) for index, field in enumerate(Player.STATE_FIELDS) if field != 'card_reward_merged')
+
+
+class StateDelta:
+    '''
+    Changes of one command: table fields (round, turn, turns, status,
+    quest, event, card, card_user) and player fields that differ from the
+    previous version, new players in full and removed player ids.
+    '''
+    __slots__ = ('version', 'command', 'table', 'players', 'removed')
+
+    def __init__(self, version, command, table, players, removed):
+        self.version = version
+        self.command = command
+        self.table = table # field -> value
+        self.players = players # id -> {field: value}
+        self.removed = removed # ids
+
+    def to_dict(self):
+        'Compact plain data, empty parts left out'
+        data = {'v': self.version, 'cmd': self.command}
+        if self.table:
+            data['table'] = self.table
+            if 'status' in self.table:
+                data['table'] = {**self.table, 'phase': PHASES.get(self.table['status'])}
+        if self.players:
+            data['players'] = self.players
+        if self.removed:
+            data['removed'] = list(self.removed)
+        return data
+
+    def __repr__(self):
+        return f'StateDelta({self.to_dict()})'
+
+
+class DeltaStream:
+    '''
+    Versioned state diffs of one table for spectators and frontends.
+    After every command the players it can have touched are compared with
+    their last sent state (only the named player for enroll/bet/draw_card/play),
+    so a delta costs what changed, not the table size; a load_snapshot()
+    is compared over the whole table. Versions increase by
+    one per non-empty delta; a subscriber that fell behind catches up from
+    the recent history or starts over from snapshot().
+    '''
+    def __init__(self, game:Game, history=1024):
+        self.game = game
+        self.version = 0
+        self.__players = game.player_states()
+        self.__table = game.table_state()
+        self.__history = deque(maxlen=history)
+        self.__subscribers = []
+        self.__lock = threading.RLock()
+        game.add_command_listener(self.__on_command)
+
+    def close(self):
+        self.game.remove_listener(self.__on_command)
+
+    def snapshot(self):
+        'Current version and full state, {"v", "table", "players": {id: {field: value}}}'
+        with self.__lock:
+            return {
+                'v': self.version,
+                'table': {**self.__table._asdict(), 'phase': PHASES.get(self.__table.status)},
+                'players': {id: self.__fields(state) for id, state in self.__players.items()}
+            }
+
+    @staticmethod
+    def __fields(state):
+        return {field: state[index] for index, field in FIELDS}
+
+    def __on_command(self, name, args, kwargs):
+        game = self.game
+        table_state = game.table_state()
+        table = {}
+        if table_state != self.__table:
+            table = {field: value for field, value, old in zip(table_state._fields, table_state, self.__table) if value != old}
+        changed = {}
+        removed = ()
+        if name in PLAYER_COMMANDS and args:
+            candidates = game.player_states((args[0],))
+        else:
+            candidates = game.player_states()
+            removed = tuple(id for id in self.__players if id not in candidates)
+        for id, state in candidates.items():
+            old = self.__players.get(id)
+            if old is None:
+                changed[id] = self.__fields(state)
+            elif old != state:
+                changed[id] = {field: state[index] for index, field in FIELDS if old[index] != state[index]}
+                if not changed[id]:
+                    del changed[id]
+        if not (table or changed or removed):
+            return
+        with self.__lock:
+            self.__table = table_state
+            for id in changed:
+                self.__players[id] = candidates[id]
+            for id in removed:
+                del self.__players[id]
+            self.version += 1
+            delta = StateDelta(self.version, name, table, changed, removed)
+            self.__history.append(delta)
+            subscribers = list(self.__subscribers)
+        for subscriber in subscribers:
+            subscriber(delta)
+
+    def since(self, version):
+        'Deltas after version, oldest first, or None when they left the history'
+        with self.__lock:
+            if version >= self.version:
+                return []
+            if not self.__history or self.__history[0].version > version + 1:
+                return None
+            return [delta for delta in self.__history if delta.version > version]
+
+    def subscribe(self, callback, since=None):
+        '''
+        callback(StateDelta) for every new delta. With since, the missed
+        deltas are replayed first; returns False if they are gone and the
+        subscriber has to start from snapshot().
+        '''
+        with self.__lock:
+            missed = []
+            if since is not None and since < self.version:
+                if not self.__history or self.__history[0].version > since + 1:
+                    return False
+                missed = [delta for delta in self.__history if delta.version > since]
+            # still locked, so no newer delta overtakes the missed ones
+            for delta in missed:
+                callback(delta)
+            self.__subscribers.append(callback)
+        return True
+
+    def unsubscribe(self, callback):
+        with self.__lock:
+            if callback in self.__subscribers:
+                self.__subscribers.remove(callback)
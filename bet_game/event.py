@@ -1,6 +1,7 @@
 from .player import PlayerManager
 from .quest import QuestPool
 from .utils import GameplayError
+from .logger import default_logger, KIND_EVENT
 import random
 
 class RandomEvent:
@@ -8,9 +9,11 @@ class RandomEvent:
         self,
         pm:PlayerManager,
         game_type='arcaea',
-        random_p=0.5
+        random_p=0.5,
+        logger=None
     ):
         self.pm = pm
+        self.logger = logger if logger else default_logger
         self.event = [
             # 若无特殊说明，event效果只在一个turn内生效
             self.absolute_advantage,
@@ -44,6 +47,8 @@ class RandomEvent:
         ]
 
         self.random_p = random_p
+        self.current_event = None # name of this turn's event
+        self.timings = None # PhaseTimings of the table, set by Game
 
         if game_type == 'arcaea':
             self.event.extend(self.arc_event)
@@ -52,66 +57,74 @@ class RandomEvent:
         else:
             raise GameplayError("Currently Only Support arcaea and phigros")
 
-    def draw_event(self):
-        if random.random() < self.random_p:
-            event = random.choice(self.event)
-            event()
+    def draw_event(self, rng=random):
+        if rng.random() < self.random_p:
+            event = rng.choice(self.event)
+            self.current_event = event.__name__
+            if self.timings is None:
+                event()
+            else:
+                self.timings.call('event.' + event.__name__, event)
         else:
-            print("No event in this turn")
+            self.current_event = None
+            self.logger.info(KIND_EVENT, "No event in this turn")
 
     def absolute_advantage(self):
-        print("Event: \'absolute\' advantage")
-        print("Every Player's score will immediately get the absolute value")
+        self.logger.info(KIND_EVENT, "Event: \'absolute\' advantage")
+        self.logger.info(KIND_EVENT, "Every Player's score will immediately get the absolute value")
         for player in self.pm.player_list:
             player.score = abs(player.score)
 
     def bonus_time(self):
-        print("Event: bonus time")
-        print("Player who bet successfully will get double reward (1 turn)")
+        self.logger.info(KIND_EVENT, "Event: bonus time")
+        self.logger.info(KIND_EVENT, "Player who bet successfully will get double reward (1 turn)")
         self.pm.double_reward = True
 
     def risk_aversion(self):
-        print("Event: risk aversion")
-        print("Player who fails the bet will not get score decresed (1 turn)")
+        self.logger.info(KIND_EVENT, "Event: risk aversion")
+        self.logger.info(KIND_EVENT, "Player who fails the bet will not get score decresed (1 turn)")
         self.pm.bet_failed_decrease = False
 
     def winner_takes_all(self):
-        print("Event: winner takes all")
-        print("Only the top 1 player in game will get upper(n+1)/2 score")
-        def winner_takes_all_rank_to_score(member):
-            pt = (len(member)+1)//2
+        self.logger.info(KIND_EVENT, "Event: winner takes all")
+        self.logger.info(KIND_EVENT, "Only the top 1 player in game will get upper(n+1)/2 score")
+        self.pm.rank_to_score = self.winner_takes_all_rank_to_score
+
+    # rank_to_score effects are methods instead of closures, so snapshots can store them by name
+    def winner_takes_all_rank_to_score(self, member):
+        pt = (len(member)+1)//2
+        for i, player in enumerate(member):
+            player.rank = i
+            player.cur_pt = pt
+            player.score += pt
+            if pt > 0:
+                pt = 0
+
+    def normal_distribution(self):
+        self.logger.info(KIND_EVENT, "Event: normal distribution")
+        self.logger.info(KIND_EVENT, "Player at the middle will get the highest score")
+        self.pm.rank_to_score = self.normal_distribution_rank_to_score
+
+    def normal_distribution_rank_to_score(self, member):
+        n = self.pm.player_num
+        if n % 2 == 0:
+            max_posi = [n//2, n//2-1]
             for i, player in enumerate(member):
+                pt = n//2 - min(abs(i-max_posi[0]), abs(i-max_posi[1]))
+                player.rank = i
+                player.cur_pt = pt
+                player.score += pt
+        else:
+            max_posi = n // 2
+            for i, player in enumerate(member):
+                pt = n//2 - abs(i-max_posi)
                 player.rank = i
                 player.cur_pt = pt
                 player.score += pt
-                if pt > 0:
-                    pt = 0
-        self.pm.rank_to_score = winner_takes_all_rank_to_score
-
-    def normal_distribution(self):
-        print("Event: normal distribution")
-        print("Player at the middle will get the highest score")
-        def normal_distribution_rank_to_score(member):
-            n = self.pm.player_num
-            if n % 2 == 0:
-                max_posi = [n//2, n//2-1]
-                for i, player in enumerate(member):
-                    pt = n//2 - min(abs(i-max_posi[0]), abs(i-max_posi[1]))
-                    player.rank = i
-                    player.cur_pt = pt
-                    player.score += pt
-            else:
-                max_posi = n // 2
-                for i, player in enumerate(member):
-                    pt = n//2 - abs(i-max_posi)
-                    player.rank = i
-                    player.cur_pt = pt
-                    player.score += pt
-        self.pm.rank_to_score = normal_distribution_rank_to_score
 
     def poverty_relief(self):
-        print("Event: poverty relief")
-        print("Player who gets the least score will get bonus n score")
+        self.logger.info(KIND_EVENT, "Event: poverty relief")
+        self.logger.info(KIND_EVENT, "Player who gets the least score will get bonus n score")
         min_score = None
         for player in self.pm.player_list:
             if min_score is None or player.score < min_score:
@@ -121,22 +134,45 @@ class RandomEvent:
                 player.score += self.pm.player_num
 
     def no_need_to_hesitate(self):
-        print("Event: no need to hesitate")
-        print("Player who got bet will not decrease the score")
+        self.logger.info(KIND_EVENT, "Event: no need to hesitate")
+        self.logger.info(KIND_EVENT, "Player who got bet will not decrease the score")
         self.pm.betted_decrease = False
 
     def sing_along(self):
-        print("Event: sing along")
-        print("Player should sing to the song while playing the game")
+        self.logger.info(KIND_EVENT, "Event: sing along")
+        self.logger.info(KIND_EVENT, "Player should sing to the song while playing the game")
 
     def the_slower_the_simpler(self):
-        print("Event: the slower, the simpler")
-        print("Players should play game in speed restriction less than 2")
+        self.logger.info(KIND_EVENT, "Event: the slower, the simpler")
+        self.logger.info(KIND_EVENT, "Players should play game in speed restriction less than 2")
 
     def rush_hour(self):
-        print("Event: rush hour")
-        print("Players should play game in max speed")
+        self.logger.info(KIND_EVENT, "Event: rush hour")
+        self.logger.info(KIND_EVENT, "Players should play game in max speed")
 
     def upside_down(self):
-        print("Event: upside down")
-        print("Player should playe the game while the device is upside down")
+        self.logger.info(KIND_EVENT, "Event: upside down")
+        self.logger.info(KIND_EVENT, "Player should playe the game while the device is upside down")
+
+    # snapshot
+    def state(self):
+        return {
+            'event': self.current_event,
+            'rank_to_score': self.pm.rank_to_score.__name__,
+            'betted_decrease': self.pm.betted_decrease,
+            'bet_failed_decrease': self.pm.bet_failed_decrease,
+            'double_reward': self.pm.double_reward
+        }
+
+    def load_state(self, state):
+        self.current_event = state['event']
+        name = state['rank_to_score']
+        if name == self.pm.default_rank_to_score.__name__:
+            self.pm.rank_to_score = self.pm.default_rank_to_score
+        elif name.endswith('_rank_to_score') and hasattr(self, name):
+            self.pm.rank_to_score = getattr(self, name)
+        else:
+            raise GameplayError(f'Unknown rank_to_score effect {name}')
+        self.pm.betted_decrease = state['betted_decrease']
+        self.pm.bet_failed_decrease = state['bet_failed_decrease']
+        self.pm.double_reward = state['double_reward']
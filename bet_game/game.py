@@ -1,10 +1,111 @@
-from .player import PlayerManager
+from .player import Player, PlayerManager
 from .song  import *
 from .quest import QuestPool
 from .event import RandomEvent
 from .card import RandomCard
-from .utils import GameplayError, log, divideline
-from functools import cmp_to_key
+from .utils import GameplayError
+from .logger import default_logger, KIND_MESSAGE, KIND_TABLE, KIND_QUEST, KIND_BET, KIND_CARD, KIND_PLAY
+from .snapshot import dumps
+from .rules import RuleSet
+from .result import PlayerTurnResult, TurnResult, GameResult
+from .timing import PhaseTimings, process_timings
+from .memory import measure, process_roots
+from .rng import CounterRNG, PURPOSE_EVENT, PURPOSE_QUEST, PURPOSE_CARD, PURPOSE_CARD_EFFECT
+from functools import cmp_to_key, wraps
+from operator import attrgetter
+from collections import namedtuple
+from contextlib import nullcontext
+import threading
+import asyncio
+import uuid
+import re
+
+SNAPSHOT_VERSION = 1
+_player_state = attrgetter(*Player.STATE_FIELDS)
+
+Standing = namedtuple('Standing', ['id', 'score'])
+StandingsSnapshot = namedtuple('StandingsSnapshot', ['version', 'status', 'turns', 'turn', 'players'])
+TableState = namedtuple('TableState', ['round', 'turn', 'turns', 'status', 'quest', 'event', 'card', 'card_user'])
+PlayerRow = namedtuple('PlayerRow', ['id', 'score', 'text', 'note'])
+TableView = namedtuple('TableView', ['kind', 'status', 'turns', 'head', 'rows', 'text'])
+
+VIEWS = ('players', 'standings', 'bets', 'results')
+# what every field a view shows is read from, compared when the table version moved
+_view_key = attrgetter('id', *Player.RENDER_FIELDS, 'bet_id', 'stake', 'playing_score')
+
+
+def synchronized(publish=False, batch=False):
+    '''
+    Run a Game method under the table lock (a no-op unless thread_safe).
+    Successful outermost calls are written to the journal, nested calls
+    (e.g. the bets of expire_bet) are replayed by their outer command.
+    The standings snapshot is republished when the method changes the status,
+    or always with publish=True for methods that change scores.
+    With batch=True the first argument is read into a list (a dict stays
+    as it is) first, so the journal gets the entries that were applied.
+    '''
+    def decorator(method):
+        name = method.__name__
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if batch and args and not isinstance(args[0], (list, dict)):
+                args = (list(args[0]),) + args[1:]
+            with self._lock:
+                status = self.status
+                self._depth += 1
+                try:
+                    if self._timings is None:
+                        result = method(self, *args, **kwargs)
+                    else:
+                        result = self._timings.call(name, method, self, *args, **kwargs)
+                finally:
+                    self._depth -= 1
+                    self._version += 1
+                if not self._depth and self.journal is not None:
+                    self._journal_command(name, args, kwargs)
+                    if self._snapshot_due:
+                        self._snapshot_due = False
+                        self.journal.write_snapshot(dumps(self.snapshot()))
+                if not self._depth and self._command_listeners:
+                    self._notify_command(name, args, kwargs)
+                if publish or status != self.status:
+                    self._publish_standings()
+                return result
+        return wrapper
+    return decorator
+
+
+# commands apply_commands() takes, bets and plays are merged into their batch command
+BATCH_COMMANDS = frozenset(('enroll', 'remove', 'bet', 'draw_card', 'play', 'bet_many', 'play_many', 'expire_bet', 'expire_play'))
+_BATCHED = {'bet': 'bet_many', 'play': 'play_many'}
+# they reach every player, apply_commands() rolls them back from a snapshot
+_TABLE_COMMANDS = frozenset(('enroll', 'remove', 'expire_bet', 'expire_play'))
+
+
+class _Joined:
+    'Batch entries of one log record, only joined when the record is formatted'
+    __slots__ = ('text', 'items')
+
+    def __init__(self, text, items):
+        self.text = text
+        self.items = items
+
+    def __format__(self, spec):
+        return ', '.join(map(self.text, self.items))
+
+def _bet_text(item):
+    player, bet_id, bet_id_actual, stake, capped = item
+    return f'{player.id} {stake} on {bet_id}' if bet_id else f'{player.id} no bet'
+
+def _play_text(item):
+    player, score = item
+    return f'{player.id} "{score}"'
+
+
+def _resolve_waiter(waiter, result):
+    if not waiter.done():
+        waiter.set_result(result)
+
 
 class Game:
     STATUS_000_UNAVAILABLE = 0
@@ -12,26 +113,203 @@ class Game:
     STATUS_101_DRAW_QUEST = 101
     STATUS_102_BET = 102
     STATUS_103_PLAY = 103
-    STATUS_1031_CARD_DECIDE = 1031 # only for __str__ printing
+    STATUS_1031_CARD_DECIDE = 1031 # waiting for decide_card()
     STATUS_104_EVALUATE_SCORE = 104
     STATUS_105_BET_DEDUCT = 105
     STATUS_106_EVALUATE_BET = 106
     STATUS_107_EVALUATE_CARD = 107
     STATUS_200_FINISHED = 200
 
-    def __init__(self, game_type='arcaea', turns=5, random_p=0.5, random_card=False):
+    def __init__(self, game_type='arcaea', turns=5, random_p=0.5, random_card=False, seed=None, card_policy=None, thread_safe=False, logger=None, journal=None, snapshot_every=None, rules=None, game_id=None, timings=None, record_plays=True):
         if game_type == "arcaea":
             self.song_manager = ArcaeaSongPackageManager()
         elif game_type == "phigros":
             self.song_manager = PhigrosSongPackageManager()
         else:
             raise GameplayError("Currently Only Support arcaea and phigros")
+        # quiet_logger() skips every record, including the player table renders
+        self.__logger = logger if logger else default_logger
+        self.rules = rules if rules else RuleSet()
+        self.game_id = game_id if game_id else uuid.uuid4().hex
+        self.__turn_listeners = []
+        self.__finish_listeners = []
+        self.__standings_listeners = []
+        self.__turn_start_scores = {}
         self.__play_manager = PlayerManager()
         self.__quest_pool = QuestPool()
+        self.__quest_source = None # song manager state of the last add_quest
+        self.__removed_quests = [] # redrawn quests
+        self.__game_type = game_type
+        self.__random_p = random_p
+        self.__random_card_enabled = random_card
         self.__turns = turns
-        self.__random_event = RandomEvent(self.__play_manager, game_type=game_type, random_p=random_p)
-        self.__random_card = RandomCard(game_type=game_type, random_card=random_card)
+        self.__random_event = RandomEvent(self.__play_manager, game_type=game_type, random_p=random_p, logger=self.__logger)
+        self.__random_card = RandomCard(game_type=game_type, random_card=random_card, logger=self.__logger,
+            card_cost=lambda player_num: self.rules.card_cost(player_num))
+        self.__rng = CounterRNG(seed)
+        self._timings = None
+        self.timings = timings
+        self.__round = -1
+        # card_policy(card) -> bool decides the random card without waiting for decide_card()
+        self.card_policy = card_policy
+        # played quests rank the process-wide song completions, off for replays and synthetic load
+        self.record_plays = record_plays
+        self.__pending_card = None
+        self.__card_return_status = None
+        self.__card_waiters = []
+        # with thread_safe every state change holds the table lock,
+        # standings readers only see the published immutable snapshot
+        self._lock = threading.RLock() if thread_safe else nullcontext()
+        self.__thread_safe = thread_safe
+        self.__standings = None
+        self.__standings_version = 0
+        self.__completions_version = -1 # standings version the id completions were ranked at
+        self.__status = self.STATUS_000_UNAVAILABLE
+        self._depth = 0
+        self._version = 0 # moves on every command, cached views compare it first
+        self.__views = {} # kind -> (version, fingerprint, TableView) of the current status
+        self.__views_status = None
+        self._command_listeners = []
+        self.journal = None
+        self.__journal_followups = []
+        # with a journal, write a snapshot every snapshot_every finished turns to bound replay time
+        self.snapshot_every = snapshot_every
+        self._snapshot_due = False
         self.reset_round(turns)
+        if journal is not None:
+            self.journal = journal
+            journal.append('create', (), {
+                'game_type': game_type,
+                'turns': turns,
+                'random_p': random_p,
+                'random_card': random_card,
+                'seed': self.seed,
+                'game_id': self.game_id,
+                'rules': self.rules.name
+            })
+
+    @property
+    def seed(self):
+        return self.__rng.seed
+
+    @property
+    def turn(self):
+        'Index of the current turn in the current round, starting from 0'
+        return self.__turn
+
+    @property
+    def status(self):
+        return self.__status
+
+    def _journal_command(self, name, args, kwargs):
+        self.journal.append(name, args, kwargs)
+        followups, self.__journal_followups = self.__journal_followups, []
+        for followup in followups:
+            self.journal.append(*followup)
+
+    @property
+    def standings(self) -> StandingsSnapshot:
+        'Lock-free read of the last published standings'
+        standings = self.__standings
+        if standings is None:
+            # single-threaded tables build the snapshot on first read
+            standings = self.__build_standings()
+            self.__standings = standings
+        return standings
+
+    def table_state(self) -> TableState:
+        'Round, turn counters, status, quest description, event and card in play'
+        with self._lock:
+            card = self.__current_card
+            return TableState(
+                self.__round, self.__turn, self.__turns, self.__status,
+                self.__current_quest.description if self.__current_quest else None,
+                self.__random_event.current_event,
+                card.name if card.valid else None,
+                card.user.id if card.valid else None
+            )
+
+    def player_states(self, ids=None) -> dict:
+        '{id: (Player.STATE_FIELDS values)} of every player, or of the players in ids'
+        with self._lock:
+            if ids is None:
+                players = self.__play_manager.player_list
+            else:
+                players = [self.__play_manager.find_player(id) for id in ids]
+            state = _player_state
+            return {player.id: state(player) for player in players}
+
+    def _publish_standings(self):
+        self.__standings_version += 1
+        if self.__thread_safe or self.__standings_listeners:
+            self.__standings = self.__build_standings()
+            self.__notify(self.__standings_listeners, self.__standings)
+        else:
+            self.__standings = None
+
+    def __build_standings(self):
+        players = sorted(self.__play_manager.player_list, key=lambda player: (-player.score, player.id))
+        return StandingsSnapshot(
+            version=self.__standings_version,
+            status=self.__status,
+            turns=self.__turns,
+            turn=self.__turn,
+            players=tuple(Standing(player.id, player.score) for player in players)
+        )
+
+    # timing
+    @property
+    def timings(self) -> PhaseTimings:
+        'Per-table PhaseTimings, None while timing is off'
+        return self._timings
+
+    @timings.setter
+    def timings(self, timings):
+        'True for new timings aggregated into timing.process_timings, or a PhaseTimings, None to stop'
+        if timings is True:
+            timings = PhaseTimings(parent=process_timings)
+        self._timings = timings if timings else None
+        self.__random_event.timings = self._timings
+
+    def __card_hook(self, hook):
+        func = getattr(self.__current_card, hook)
+        if self._timings is None:
+            return func
+        return self._timings.wrap(f'card.{self.__current_card.name or "default"}.{hook}', func)
+
+    # memory
+    def memory_usage(self):
+        '''
+        {subsystem: memory.Usage} of this table. Process-wide objects
+        (catalogues, quest list cache) count in memory.process_usage() instead.
+        '''
+        with self._lock:
+            return measure({
+                'quest_pool': (self.__quest_pool, self.__removed_quests, self.__quest_source, self.__current_quest),
+                'songs': self.song_manager,
+                'players': (self.__play_manager, self.__turn_start_scores, self.__standings),
+                'cards': (self.__random_card, self.__current_card, self.__pending_card, self.__card_waiters),
+                'events': self.__random_event,
+                'journal': (self.journal, self.__journal_followups),
+            }, exclude=list(process_roots().values()), boundary=(self, self.__logger, self.rules, self._timings))
+
+    # completion
+    def complete_player(self, prefix:str, k=5):
+        'Player ids starting with prefix, highest score first'
+        with self._lock:
+            if self.__completions_version != self.__standings_version:
+                self.__play_manager.refresh_completions()
+                self.__completions_version = self.__standings_version
+            return self.__play_manager.complete(prefix, k)
+
+    def complete_song(self, prefix:str, k=5):
+        'Song titles starting with prefix, most played first'
+        return self.song_manager.complete(prefix, k)
+
+    @property
+    def card_pending(self):
+        'The random card waiting for decide_card(), None if there is no decision to make'
+        return self.__pending_card
 
     @property
     def finished(self):
@@ -56,8 +334,11 @@ class Game:
         else:
             return ""
 
+    @synchronized(publish=True)
     def reset_round(self, turn):
         self.__turns = turn
+        self.__round += 1
+        self.__turn = 0
         self.__winner = None
         self.__current_quest = None
         self.__status = self.STATUS_000_UNAVAILABLE
@@ -70,6 +351,21 @@ class Game:
         self.__current_quest = None
         self.__bet_num = 0
         self.__gameplay_num = 0
+        self.__streams = {}
+
+    # random draws
+    def draw_stream(self, purpose, turn=None, round=None):
+        'A fresh stream of the given turn, recomputes its draws from the seed only'
+        return self.__rng.stream(
+            self.__turn if turn is None else turn,
+            purpose,
+            self.__round if round is None else round
+        )
+
+    def __stream(self, purpose):
+        if purpose not in self.__streams:
+            self.__streams[purpose] = self.draw_stream(purpose)
+        return self.__streams[purpose]
 
     # helper function
     def check_status(self, status):
@@ -77,64 +373,81 @@ class Game:
             raise GameplayError(f'Invalid operation. The current status is {self.__status}')
 
     # player and init
+    @synchronized(publish=True)
     def enroll(self, id:str):
         self.__play_manager.add_player(id)
 
+    @synchronized(publish=True)
     def remove(self, id:str):
         self.__play_manager.remove_player(id)
 
+    @synchronized()
     def add_quest(self, quest_list:list):
         cur_quest_list = self.song_manager.add_quest_list(quest_list)
         self.__quest_pool.set_quest_list(cur_quest_list)
+        self.__quest_source = self.song_manager.state()
+        self.__removed_quests = []
 
+    @synchronized()
     def enable_all(self, en_package=True, en_difficulties=True):
         if en_package:
             self.song_manager.enable_all_packages()
         if en_difficulties:
             self.song_manager.enable_all_difficulties()
 
+    @synchronized()
     def disable_all(self, dis_package=True, dis_difficulties=True):
         if dis_package:
             self.song_manager.disable_all_packages()
         if dis_difficulties:
             self.song_manager.disable_all_difficulties()
 
+    @synchronized()
     def enable(self, pac:str):
         self.song_manager.enable(pac)
 
+    @synchronized()
     def disable(self, pac:str):
         self.song_manager.disable(pac)
 
     # game play
+    @synchronized(publish=True)
     def start(self):
         self.player_num = self.__play_manager.player_num
         self.__random_card.set_player_list(self.__play_manager.player_list)
         self.__status = self.STATUS_100_DRAW_EVENT
-        log(f'Starting game with {self.__turns} turns.')
+        self.__logger.info(KIND_MESSAGE, 'Starting game with {} turns.', self.__turns)
 
+    @synchronized(publish=True)
     def draw_event(self):
         self.check_status(self.STATUS_100_DRAW_EVENT)
-        self.__random_event.draw_event()
+        if self.__turn_listeners:
+            self.__turn_start_scores = {player.id: player.score for player in self.__play_manager.player_list}
+        self.__random_event.draw_event(rng=self.__stream(PURPOSE_EVENT))
         self.__status = self.STATUS_101_DRAW_QUEST
 
+    @synchronized()
     def draw_quest(self):
         if self.__status == self.STATUS_102_BET:
             if self.__bet_num > 0:
                 raise GameplayError(f'Cannot redraw quests. Some players have already bet')
             redraw = True
             self.__quest_pool.remove_quest(self.__current_quest)
+            self.__removed_quests.append(self.__current_quest.description)
         else:
             self.check_status(self.STATUS_101_DRAW_QUEST)
             redraw = False
 
-        self.__current_quest = self.__quest_pool.draw_quest()
+        self.__current_quest = self.__quest_pool.draw_quest(rng=self.__stream(PURPOSE_QUEST))
         self.__status = self.STATUS_102_BET
 
         if redraw:
-            log(f'Redrawing quest: {self.__current_quest.description}.')
+            self.__logger.info(KIND_QUEST, 'Redrawing quest: {}.', self.__current_quest.description)
         else:
-            log(f'{self.__turns} turn{"s" if self.__turns > 1 else ""} left. Drawing quest: {self.__current_quest.description}.')
+            self.__logger.info(KIND_QUEST, '{} turn{} left. Drawing quest: {}.',
+                self.__turns, "s" if self.__turns > 1 else "", self.__current_quest.description)
 
+    @synchronized()
     def bet(self, player_id, bet_id, stake=1):
         if self.__status == self.STATUS_103_PLAY:
             if self.__gameplay_num != 0:
@@ -142,30 +455,83 @@ class Game:
         else:
             self.check_status(self.STATUS_102_BET)
             if not self.__bet_num:
-                divideline()
+                self.__logger.divideline()
     
         player = self.__play_manager.find_player(player_id)
-        bet_id_actual = ''
+        bet_id_actual = self.__bet_target(player, bet_id)
+        self.__place_bet(player, bet_id, bet_id_actual, self.rules.stake_cap(stake, self.player_num) if bet_id else None)
+        if bet_id:
+            self.__logger.info(KIND_BET, 'Player {} bets {} point{} on {}.', player.id, stake, "s" if stake > 1 else "", bet_id)
+        else:
+            self.__logger.info(KIND_BET, 'Player {} doesn\'t take bet this turn.', player.id)
+
+        if self.__bet_num == self.player_num:
+            self.__status = self.STATUS_103_PLAY
+
+    def __bet_target(self, player, bet_id, players=None):
+        'Id of the player bet on, checked before the bet changes anything'
+        if player.took_bet or not bet_id:
+            return ''
+        bet_player = self.__find_player(bet_id, players)
+        if (bet_player.id == player.id):
+            raise GameplayError(f'Cannot bet oneself: {bet_player.id}')
+        return bet_player.id
+
+    def __find_player(self, id, players=None):
+        # batches look whole ids up in players, {id: Player}, prefixes still go through the trie
+        player = players.get(id) if players is not None else None
+        return player if player is not None else self.__play_manager.find_player(id)
+
+    def __place_bet(self, player, bet_id, bet_id_actual, stake):
+        # stake is already capped, nothing here can fail
         if not player.took_bet:
-            if bet_id:
-                bet_player = self.__play_manager.find_player(bet_id)
-                if (bet_player.id == player.id):
-                    raise GameplayError(f'Cannot bet oneself: {bet_player.id}')
-                bet_id_actual = bet_player.id
             player.took_bet = True
             self.__bet_num += 1
 
         player.bet_id = bet_id
         if bet_id:
             player.bet_id = bet_id_actual
-            player.stake = max(min(stake, self.player_num), 1)
-            log(f'Player {player.id} bets {stake} point{"s" if stake > 1 else ""} on {bet_id}.')
+            player.stake = stake
+
+    @synchronized(batch=True)
+    def bet_many(self, bets):
+        '''
+        Several bets as one command, bets are (player_id, bet_id) or
+        (player_id, bet_id, stake) with a falsy bet_id for no bet. The whole
+        batch is checked before any bet counts and logged as one record.
+        '''
+        if self.__status == self.STATUS_103_PLAY:
+            if self.__gameplay_num != 0:
+                raise GameplayError(f'Cannot re-bet. Some players have already played')
         else:
-            log(f'Player {player.id} doesn\'t take bet this turn.')
+            self.check_status(self.STATUS_102_BET)
+        players = {player.id: player for player in self.__play_manager.player_list}
+        batch = []
+        seen = set()
+        for entry in bets:
+            if not 2 <= len(entry) <= 3:
+                raise GameplayError(f'Invalid bet {entry!r}, expected (player_id, bet_id[, stake])')
+            player_id, bet_id = entry[0], entry[1]
+            stake = entry[2] if len(entry) == 3 else 1
+            player = self.__find_player(player_id, players)
+            if player.id in seen:
+                raise GameplayError(f'Player {player.id} bets twice in one batch')
+            seen.add(player.id)
+            bet_id_actual = self.__bet_target(player, bet_id, players)
+            capped = self.rules.stake_cap(stake, self.player_num) if bet_id else None
+            batch.append((player, bet_id, bet_id_actual, stake, capped))
+        if not batch:
+            return
+        if self.__status == self.STATUS_102_BET and not self.__bet_num:
+            self.__logger.divideline()
+        for player, bet_id, bet_id_actual, stake, capped in batch:
+            self.__place_bet(player, bet_id, bet_id_actual, capped)
+        self.__logger.info(KIND_BET, '{} player{} bet: {}.', len(batch), "s" if len(batch) > 1 else "", _Joined(_bet_text, batch))
 
         if self.__bet_num == self.player_num:
             self.__status = self.STATUS_103_PLAY
         
+    @synchronized()
     def draw_card(self, player_id):
         if self.__status == self.STATUS_103_PLAY:
             if self.__gameplay_num != 0:
@@ -173,33 +539,90 @@ class Game:
         else:
             self.check_status(self.STATUS_102_BET)
             if not self.__bet_num:
-                divideline()
+                self.__logger.divideline()
         player = self.__play_manager.find_player(player_id)
         self.__random_card.add_pending_queue(player)
+        player.bought_card = True
         self.__bet_num += 1
         if self.__bet_num == self.player_num:
             self.__status = self.STATUS_103_PLAY
 
+    @synchronized(publish=True)
     def show_card(self):
+        self.__show_card(self.card_policy)
+
+    def __show_card(self, card_policy):
         if (self.__status != self.STATUS_104_EVALUATE_SCORE):
             self.check_status(self.STATUS_103_PLAY)
-        divideline()
+        self.__logger.divideline()
+        temp_card = self.__random_card.print_card(
+            rng=self.__stream(PURPOSE_CARD),
+            effect_rng=self.__stream(PURPOSE_CARD_EFFECT)
+        )
+        # only once the card is drawn, a refused show_card leaves the status alone
+        self.__card_return_status = self.__status
         self.__status = self.STATUS_1031_CARD_DECIDE
-        temp_card = self.__random_card.print_card()
-        self.__play_manager.card_bought_deduct(temp_card.user_deduct_list)
-        log(f'Player {temp_card.user} get card {temp_card.description}.')
-        if input('Use card? [Y/N] ').lower() == 'y':
-            self.__current_card = temp_card
-        divideline()
-        log(str(self))
-        self.__status = self.STATUS_103_PLAY
-        
+        self.__play_manager.card_bought_deduct(temp_card.user_deduct_list,
+            self.rules.card_cost(self.__play_manager.player_num))
+        if not temp_card.valid:
+            # nobody bought a card, nothing to decide
+            self.__finish_card_decision()
+            return
+        self.__logger.info(KIND_CARD, 'Player {} get card {}.', temp_card.user, temp_card.description)
+        self.__pending_card = temp_card
+        if card_policy:
+            use = bool(card_policy(temp_card))
+            self.decide_card(use)
+            if self.journal is not None:
+                # a replayed game has no policy, the decision has to be journaled
+                self.__journal_followups.append(('decide_card', (use,)))
+
+    @synchronized(publish=True)
+    def decide_card(self, use:bool):
+        self.check_status(self.STATUS_1031_CARD_DECIDE)
+        if use:
+            self.__current_card = self.__pending_card
+        self.__pending_card = None
+        self.__finish_card_decision()
+        waiters, self.__card_waiters = self.__card_waiters, []
+        for waiter in waiters:
+            # decide_card may come from another thread than the waiting loop
+            waiter.get_loop().call_soon_threadsafe(_resolve_waiter, waiter, bool(use))
+
+    def __finish_card_decision(self):
+        self.__logger.divideline()
+        self.__logger.info(KIND_TABLE, '{}', self)
+        self.__status = self.__card_return_status
+
+    async def wait_card_decision(self):
+        'Wait until someone calls decide_card(), returns whether the card is used'
+        with self._lock:
+            self.check_status(self.STATUS_1031_CARD_DECIDE)
+            waiter = asyncio.get_running_loop().create_future()
+            self.__card_waiters.append(waiter)
+        return await waiter
 
+    async def show_card_async(self, decide=None):
+        '''
+        Awaitable show_card(). decide(card) is an async callable answering the decision,
+        without it the card waits for decide_card() from elsewhere.
+        '''
+        self.show_card()
+        card = self.__pending_card
+        if card is None:
+            return False
+        if decide is None:
+            return await self.wait_card_decision()
+        use = bool(await decide(card))
+        self.decide_card(use)
+        return use
+
+    @synchronized()
     def play(self, player_id, score):
         if (self.__status != self.STATUS_104_EVALUATE_SCORE):
             self.check_status(self.STATUS_103_PLAY)
             if not self.__gameplay_num:
-                divideline()
+                self.__logger.divideline()
         player = self.__play_manager.find_player(player_id)
         self.__play_manager.set_score(player, score)
         
@@ -209,91 +632,436 @@ class Game:
         
         if self.__gameplay_num == self.player_num:
             self.__status = self.STATUS_104_EVALUATE_SCORE
-        log(f'Player {player.id} plays the quest with score "{score}".')
+        self.__logger.info(KIND_PLAY, 'Player {} plays the quest with score "{}".', player.id, score)
+
+    @synchronized(batch=True)
+    def play_many(self, scores):
+        '''
+        Several scores as one command, scores is {player_id: score} or
+        (player_id, score) pairs. Nothing counts unless every score is
+        accepted; the batch is logged as one record.
+        '''
+        if (self.__status != self.STATUS_104_EVALUATE_SCORE):
+            self.check_status(self.STATUS_103_PLAY)
+        if isinstance(scores, dict):
+            scores = scores.items()
+        players = {player.id: player for player in self.__play_manager.player_list}
+        batch = []
+        seen = set()
+        for player_id, score in scores:
+            player = self.__find_player(player_id, players)
+            if player.id in seen:
+                raise GameplayError(f'Player {player.id} plays twice in one batch')
+            seen.add(player.id)
+            batch.append((player, score))
+        if not batch:
+            return
+        previous = []
+        try:
+            for player, score in batch:
+                previous.append((player, player.playing_score))
+                self.__play_manager.set_score(player, score)
+        except Exception:
+            for player, playing_score in previous:
+                player.playing_score = playing_score
+            raise
+
+        if self.__status == self.STATUS_103_PLAY and not self.__gameplay_num:
+            self.__logger.divideline()
+        for player, score in batch:
+            if not player.played:
+                player.played = True
+                self.__gameplay_num += 1
+        if self.__gameplay_num == self.player_num:
+            self.__status = self.STATUS_104_EVALUATE_SCORE
+        self.__logger.info(KIND_PLAY, '{} player{} play the quest: {}.', len(batch), "s" if len(batch) > 1 else "", _Joined(_play_text, batch))
 
+    @synchronized(publish=True, batch=True)
+    def apply_commands(self, commands):
+        '''
+        Bet and play phase commands (BATCH_COMMANDS) as one command, each a
+        (name, args) or (name, args, kwargs). Either all of them apply or the
+        table is put back as it was. Runs of bet and play commands go
+        through bet_many() and play_many(), a player betting or playing
+        again starts a new run, as the commands one by one would.
+        '''
+        entries = []
+        for entry in commands:
+            if not 2 <= len(entry) <= 3:
+                raise GameplayError(f'Invalid command {entry!r}, expected (name, args[, kwargs])')
+            name, args = entry[0], tuple(entry[1])
+            kwargs = entry[2] if len(entry) == 3 else {}
+            if name not in BATCH_COMMANDS:
+                raise GameplayError(f'Command {name} cannot be batched')
+            entries.append((name, args, kwargs))
+        if not entries:
+            return
+        if any(name in _TABLE_COMMANDS for name, _, _ in entries):
+            state = self.snapshot()
+            touched = None
+        else:
+            # bets, plays and card calls only change the players they name
+            state = (self.__status, self.__bet_num, self.__gameplay_num, self.__random_card.call_state())
+            touched = {}
+        try:
+            run = None # [batch command, entries, players]
+            for name, args, kwargs in entries:
+                player = self.__batch_player(args)
+                if touched is not None and player is not None and player not in touched:
+                    touched[player] = _player_state(player)
+                many = _BATCHED.get(name) if not kwargs else None
+                if run is not None and run[0] == many and player is not None and player not in run[2]:
+                    run[1].append(args)
+                    run[2].add(player)
+                    continue
+                if run is not None:
+                    getattr(self, run[0])(run[1])
+                    run = None
+                if many is not None:
+                    run = [many, [args], {player}]
+                else:
+                    getattr(self, name)(*args, **kwargs)
+            if run is not None:
+                getattr(self, run[0])(run[1])
+        except Exception:
+            if touched is None:
+                self.load_snapshot(state)
+            else:
+                self.__status, self.__bet_num, self.__gameplay_num, call_state = state
+                self.__random_card.load_call_state(call_state)
+                for player, values in touched.items():
+                    for field, value in zip(Player.STATE_FIELDS, values):
+                        setattr(player, field, value)
+                # republishes the standings the nested commands have already sent
+                self._publish_standings()
+            raise
+
+    def __batch_player(self, args):
+        # the player a batched command names, None if the command is going to refuse it
+        try:
+            return self.__play_manager.find_player(args[0])
+        except (GameplayError, IndexError, TypeError):
+            return None
+
+    # deadline auto-actions
+    @synchronized()
+    def expire_bet(self):
+        'Bet phase deadline: everyone who has not acted yet takes no bet, a bought card is shown'
+        self.check_status(self.STATUS_102_BET)
+        for player in list(self.__play_manager.player_list):
+            if not player.took_bet and not player.bought_card:
+                self.bet(player.id, None)
+        if self.__status == self.STATUS_103_PLAY and self.__random_card.called:
+            self.show_card()
+
+    @synchronized()
+    def expire_play(self):
+        'Play phase deadline: a card not shown yet or undecided is discarded, missing scores count as 0'
+        if self.__status == self.STATUS_103_PLAY and self.__random_card.called:
+            # without the card policy, a replay has to reach the same decision
+            self.__show_card(None)
+        if self.__status == self.STATUS_1031_CARD_DECIDE:
+            self.decide_card(False)
+        self.check_status(self.STATUS_103_PLAY)
+        for player in list(self.__play_manager.player_list):
+            if not player.played:
+                self.play(player.id, 0)
+
+    @synchronized(publish=True)
     def evaluate_score(self):
         self.check_status(self.STATUS_104_EVALUATE_SCORE)
-        divideline()
-        self.__play_manager.preprocess_playing_score(self.__current_card.playing_score_preprocess)
-        self.__play_manager.evaluate_playing_score(self.__current_card.score_rank_cmp)
-        log(str(self))
-        divideline()
+        self.__logger.divideline()
+        self.__play_manager.preprocess_playing_score(self.__card_hook('playing_score_preprocess'))
+        self.__play_manager.evaluate_playing_score(self.__card_hook('score_rank_cmp'))
+        self.__logger.info(KIND_TABLE, '{}', self)
+        self.__logger.divideline()
         self.__status = self.STATUS_105_BET_DEDUCT    
 
+    @synchronized(publish=True)
     def evaluate_bet(self):
         self.check_status(self.STATUS_105_BET_DEDUCT)
-        self.__play_manager.preprocess_bet_target(self.__current_card.target_rearrange)
-        self.__play_manager.evaluate_bet_deduct(self.__current_card.bet_deduct)
-        log(str(self))
-        divideline()
+        self.__play_manager.preprocess_bet_target(self.__card_hook('target_rearrange'))
+        self.__play_manager.evaluate_bet_deduct(self.__card_hook('bet_deduct'))
+        self.__logger.info(KIND_TABLE, '{}', self)
+        self.__logger.divideline()
 
         self.__status = self.STATUS_106_EVALUATE_BET
-        self.__play_manager.preprocess_bet_score(self.__current_card.bet_score_preprocess)
-        self.__play_manager.evaluate_bet_score(self.__current_card.bet_score_evaluate)
-        log(str(self))
-        divideline()
+        self.__play_manager.preprocess_bet_score(self.__card_hook('bet_score_preprocess'))
+        self.__play_manager.evaluate_bet_score(self.__card_hook('bet_score_evaluate'))
+        self.__logger.info(KIND_TABLE, '{}', self)
+        self.__logger.divideline()
 
         self.__status = self.STATUS_107_EVALUATE_CARD
-        self.__play_manager.postprocess_bet_score(self.__current_card.bet_score_postprocess)
-        log(str(self))
-        divideline()
-        divideline()
+        self.__play_manager.postprocess_bet_score(self.__card_hook('bet_score_postprocess'))
+        self.__logger.info(KIND_TABLE, '{}', self)
+        self.__logger.divideline()
+        self.__logger.divideline()
+        # built now, the listeners only hear about the turn once the table has moved on
+        turn_result = self.__turn_result() if self.__turn_listeners else None
+        if self.record_plays:
+            self.song_manager.record_play(self.__current_quest)
 
         self.__turns -= 1
+        self.__turn += 1
+        if self.snapshot_every and not self.__turn % self.snapshot_every:
+            self._snapshot_due = True
         self.__random_card.set_player_list(self.__play_manager.player_list)
         self.reset_turn()
         if self.__turns <= 0:
             self.__status = self.STATUS_200_FINISHED
         else:
             self.__status = self.STATUS_100_DRAW_EVENT
+        if turn_result is not None:
+            self.__notify(self.__turn_listeners, turn_result)
+        if self.__turns <= 0 and self.__finish_listeners:
+            self.__notify(self.__finish_listeners, GameResult(
+                self.game_id, self.__round, self.__turn, self.winner,
+                tuple((player.id, player.score) for player in self.standings.players)
+            ))
 
-    def __str__(self):
-        turn = f'{self.__turns} turn{"s" if self.__turns > 1 else ""} left.\n'
+    # results
+    def add_turn_listener(self, listener):
+        'listener(TurnResult) after every settled turn'
+        self.__turn_listeners.append(listener)
+
+    def add_finish_listener(self, listener):
+        'listener(GameResult) when the game is finished'
+        self.__finish_listeners.append(listener)
+
+    def add_command_listener(self, listener):
+        'listener(name, args, kwargs) after every successful outermost command, once it is journaled, and after load_snapshot(); exceptions are logged'
+        self._command_listeners.append(listener)
+
+    def _notify_command(self, name, args, kwargs):
+        # the command has been applied and journaled, a failing listener must not undo that for the caller
+        for listener in list(self._command_listeners):
+            try:
+                listener(name, args, kwargs)
+            except Exception as e:
+                self.__logger.warning(KIND_MESSAGE, 'Command listener {} failed after {}: {!r}', listener, name, e)
+
+    def add_standings_listener(self, listener):
+        'listener(StandingsSnapshot) whenever the standings are republished'
+        self.__standings_listeners.append(listener)
 
+    def remove_listener(self, listener):
+        for listeners in (self.__turn_listeners, self.__finish_listeners, self.__standings_listeners, self._command_listeners):
+            if listener in listeners:
+                listeners.remove(listener)
+
+    def __notify(self, listeners, result):
+        # the state change is done, a failing listener must not leave the table half way
+        for listener in list(listeners):
+            try:
+                listener(result)
+            except Exception as e:
+                self.__logger.warning(KIND_MESSAGE, 'Listener {} failed on {}: {!r}', listener, type(result).__name__, e)
+
+    def __turn_result(self) -> TurnResult:
+        card = self.__current_card
+        start_scores = self.__turn_start_scores
+        return TurnResult(
+            self.game_id, self.__round, self.__turn,
+            self.__current_quest,
+            self.__random_event.current_event,
+            card.name if card.valid else None,
+            card.user.id if card.valid else None,
+            [PlayerTurnResult(player, start_scores.get(player.id)) for player in self.__play_manager.player_list]
+        )
+
+    # snapshot
+    def snapshot(self) -> dict:
+        'Full game state as plain data (json compatible), see restore()'
+        with self._lock:
+            random_card = self.__random_card
+            return {
+                'version': SNAPSHOT_VERSION,
+                'config': {
+                    'game_type': self.__game_type,
+                    'turns': self.__turns,
+                    'random_p': self.__random_p,
+                    'random_card': self.__random_card_enabled,
+                    'seed': self.seed,
+                    'game_id': self.game_id
+                },
+                'round': self.__round,
+                'turn': self.__turn,
+                'turns': self.__turns,
+                'status': self.__status,
+                'card_return_status': self.__card_return_status,
+                'player_num': getattr(self, 'player_num', None),
+                'bet_num': self.__bet_num,
+                'gameplay_num': self.__gameplay_num,
+                'songs': self.song_manager.state(),
+                'quest_source': self.__quest_source,
+                'removed_quests': list(self.__removed_quests),
+                'quest': self.__current_quest.description if self.__current_quest else None,
+                'players': self.__play_manager.state(),
+                'event': self.__random_event.state(),
+                'card': random_card.state(),
+                'current_card': random_card.card_state(self.__current_card),
+                'pending_card': random_card.card_state(self.__pending_card) if self.__pending_card else None,
+                'streams': {purpose: stream.state() for purpose, stream in self.__streams.items()}
+            }
+
+    @classmethod
+    def restore(cls, snapshot:dict, **kwargs):
+        'New Game from snapshot(), kwargs are the runtime options (logger, card_policy, thread_safe...)'
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise GameplayError(f'Unsupported snapshot version {snapshot.get("version")}')
+        game = cls(**{**snapshot['config'], **kwargs})
+        game.load_snapshot(snapshot)
+        return game
+
+    def load_snapshot(self, snapshot:dict):
+        with self._lock:
+            self.__load_snapshot(snapshot)
+            self._version += 1
+            self._publish_standings()
+            if not self._depth and self._command_listeners:
+                # the whole table may have changed, e.g. a DeltaStream diffs every player
+                self._notify_command('load_snapshot', (), {})
+
+    def __load_snapshot(self, snapshot:dict):
+        self.__round = snapshot['round']
+        self.__turn = snapshot['turn']
+        self.__turns = snapshot['turns']
+        self.__status = snapshot['status']
+        self.__card_return_status = snapshot['card_return_status']
+        if snapshot['player_num'] is not None:
+            self.player_num = snapshot['player_num']
+        self.__bet_num = snapshot['bet_num']
+        self.__gameplay_num = snapshot['gameplay_num']
+        self.__winner = None
+
+        self.__quest_source = snapshot['quest_source']
+        self.__removed_quests = list(snapshot['removed_quests'])
+        quests = []
+        if self.__quest_source:
+            quests = self.song_manager.build_quest_list(*self.__quest_source)
+            removed = set(self.__removed_quests)
+            quests = [quest for quest in quests if quest.description not in removed]
+        self.__quest_pool.set_quest_list(quests)
+        self.song_manager.load_state(snapshot['songs'])
+        self.__current_quest = None
+        if snapshot['quest'] is not None:
+            for quest in quests:
+                if quest.description == snapshot['quest']:
+                    self.__current_quest = quest
+                    break
+            else:
+                raise GameplayError(f'Quest {snapshot["quest"]} is not in the restored quest pool')
+
+        self.__play_manager.load_state(snapshot['players'])
+        players = {player.id: player for player in self.__play_manager.player_list}
+        self.__random_event.load_state(snapshot['event'])
+
+        self.__streams = {}
+        for purpose, state in snapshot['streams'].items():
+            self.__stream(purpose).load_state(state)
+        self.__random_card.load_state(snapshot['card'], players, effect_rng=self.__stream(PURPOSE_CARD_EFFECT))
+        self.__current_card = self.__random_card.make_card(snapshot['current_card'], players)
+        self.__pending_card = None
+        if snapshot['pending_card']:
+            self.__pending_card = self.__random_card.make_card(snapshot['pending_card'], players)
+
+    # views
+    def view(self, kind=None) -> TableView:
+        '''
+        The player table as rows and text. kind is one of VIEWS, by default
+        the table of the current phase (what str(game) shows). Views are
+        cached per kind and phase; a cached view is reused until a command
+        changes one of the fields it shows.
+        '''
+        with self._lock:
+            status = self.__status
+            if kind is None:
+                kind = self.__default_view(status)
+            elif kind not in VIEWS:
+                raise GameplayError(f'Unknown view {kind}, expected one of {", ".join(VIEWS)}')
+            if status != self.__views_status:
+                # views of the previous phase never come back unchanged
+                self.__views = {}
+                self.__views_status = status
+            cached = self.__views.get(kind)
+            # the version only moves after a command, renders inside one compare the fields
+            if cached is not None and cached[0] == self._version and not self._depth:
+                return cached[2]
+            players = self.__play_manager.player_list
+            fingerprint = (self.__turns, self.__current_quest, tuple(map(_view_key, players)))
+            if cached is not None and cached[1] == fingerprint:
+                view = cached[2]
+            elif self._timings is not None:
+                view = self._timings.call('render.' + kind, self.__build_view, kind, status, players)
+            else:
+                view = self.__build_view(kind, status, players)
+            self.__views[kind] = (self._version, fingerprint, view)
+            return view
+
+    def render(self, kind=None) -> str:
+        'Text of view(kind)'
+        return self.view(kind).text
+
+    def __default_view(self, status):
+        if status == self.STATUS_1031_CARD_DECIDE or status == self.STATUS_105_BET_DEDUCT or status == self.STATUS_106_EVALUATE_BET:
+            return 'bets'
+        if status == self.STATUS_104_EVALUATE_SCORE:
+            return 'results'
+        return 'players'
+
+    def __build_view(self, kind, status, players):
+        if kind == 'standings' or kind == 'bets':
+            players = sorted(players, reverse=True, key=cmp_to_key(self.__play_manager.score_cmp))
+        elif kind == 'results':
+            players = sorted(players, reverse=True, key=cmp_to_key(self.__play_manager.playscore_cmp))
+        rows = []
+        for player in players:
+            note = None
+            if kind == 'results':
+                note = f'(result: {player.playing_score})'
+            elif kind == 'bets':
+                if player.bet_id:
+                    note = f'bets {player.stake} point(s) on {player.bet_id}'
+                elif player.card_spent and status == self.STATUS_1031_CARD_DECIDE:
+                    note = 'spends ' + str(player.card_spent) + ' point(s) on random card.'
+                else:
+                    note = 'not betting'
+            rows.append(PlayerRow(player.id, player.score, str(player), note))
+        head = self.__head(status)
+        lines = '\n'.join(row.text if row.note is None else f'{row.text} {row.note}' for row in rows)
+        return TableView(kind, status, self.__turns, head, tuple(rows), f'{head}{lines}')
+
+    def __head(self, status):
+        turn = f'{self.__turns} turn{"s" if self.__turns > 1 else ""} left.\n'
         head = ''
-        if self.__status == self.STATUS_100_DRAW_EVENT:
+        if status == self.STATUS_100_DRAW_EVENT:
             head = f'Drawing the next event.\n'
-        if self.__status == self.STATUS_101_DRAW_QUEST:
+        if status == self.STATUS_101_DRAW_QUEST:
             head = f'Drawing the next quest.\n'
-        elif self.__status == self.STATUS_102_BET:
+        elif status == self.STATUS_102_BET:
             head = f'The quest is {self.__current_quest.description}. Players are betting.\n'
-        elif self.__status == self.STATUS_1031_CARD_DECIDE:
+        elif status == self.STATUS_1031_CARD_DECIDE:
             head = f'Final bet & card results are:\n'
-        elif self.__status == self.STATUS_103_PLAY:
+        elif status == self.STATUS_103_PLAY:
             head = f'Playing {self.__current_quest.description}.\n'
-        elif self.__status == self.STATUS_104_EVALUATE_SCORE:
+        elif status == self.STATUS_104_EVALUATE_SCORE:
             head = f'Evaluating scores of {self.__current_quest.description}.\n'
-        elif self.__status == self.STATUS_105_BET_DEDUCT:
+        elif status == self.STATUS_105_BET_DEDUCT:
             head = f'Evaluating bet target deducts.\n'
-        elif self.__status == self.STATUS_106_EVALUATE_BET:
+        elif status == self.STATUS_106_EVALUATE_BET:
             head = f'Evaluating bet results.\n'
-        elif self.__status == self.STATUS_107_EVALUATE_CARD:
+        elif status == self.STATUS_107_EVALUATE_CARD:
             head = f'Evaluating random card effects.\n'
+        return turn + head
 
-        if self.__status == self.STATUS_1031_CARD_DECIDE:
-            player_infos = []
-            for player in sorted(self.__play_manager.player_list, reverse=True,
-                    key=cmp_to_key(self.__play_manager.score_cmp)):
-                if player.bet_id:
-                    player_infos.append(f'{player} {"bets " + str(player.stake) + " point(s) on " + player.bet_id}')
-                elif player.card_spent:
-                    player_infos.append(f'{player} {"spends " + str(player.card_spent) + " point(s) on random card."}')
-                else:
-                    player_infos.append(f'{player} {"not betting"}')
-        elif self.__status == self.STATUS_104_EVALUATE_SCORE:
-            player_infos = [
-                f'{player} (result: {player.playing_score})'
-                for player in sorted(self.__play_manager.player_list, reverse=True,
-                    key=cmp_to_key(self.__play_manager.playscore_cmp))
-            ]
-        elif self.__status == self.STATUS_105_BET_DEDUCT or \
-            self.__status == self.STATUS_106_EVALUATE_BET:
-            player_infos = [
-                f'{player} {"bets " + str(player.stake) + " point(s) on " + player.bet_id if player.bet_id else "not betting"}'
-                for player in sorted(self.__play_manager.player_list, reverse=True,
-                    key=cmp_to_key(self.__play_manager.score_cmp))
-            ]
-        else:
-            player_infos = [f'{player}' for player in self.__play_manager.player_list]
-        player_infos_str = '\n'.join(player_infos)
-        return f'{turn}{head}{player_infos_str}'
+    def __str__(self):
+        if self._timings is not None:
+            return self._timings.call('render', self.render)
+        return self.render()
+
+
+# 'bet' for Game.STATUS_102_BET...
+PHASES = {
+    value: re.sub(r'^STATUS_\d+_', '', name).lower()
+    for name, value in vars(Game).items() if name.startswith('STATUS_')
+}
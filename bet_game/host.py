@@ -0,0 +1,245 @@
+import asyncio
+import time
+from .game import Game
+from .memory import Usage, process_usage
+from .metrics import HostMetrics, Registry
+from .delta import DeltaStream
+from .logger import default_logger, KIND_MESSAGE
+from .timer import TimerWheel
+from .utils import GameplayError
+
+class TableCommand:
+    __slots__ = ('name', 'args', 'kwargs', 'future')
+
+    def __init__(self, name, args, kwargs, future):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+
+class Table:
+    def __init__(self, table_id, game:Game, queue_size):
+        self.id = table_id
+        self.game = game
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.processed = 0
+        self.phase = None
+        self.deadline = None # TimerHandle of the current phase
+        self.phase_started = None # perf_counter() when the current phase began
+        self.players = 0 # enrolled players counted in the metrics
+        self.deltas = None # DeltaStream, created by the first spectator
+
+
+class GameHost:
+    '''
+    Runs many Game tables in one event loop.
+    Every table owns a bounded command queue and a worker task, so a table
+    only blocks its own queue and a full queue pushes back on the sender.
+    Bet and play phase deadlines of all tables share one timer wheel.
+    '''
+    # Game methods reachable through commands
+    COMMANDS = frozenset((
+        'enroll', 'remove', 'add_quest',
+        'enable', 'disable', 'enable_all', 'disable_all',
+        'start', 'reset_round',
+        'draw_event', 'draw_quest', 'bet', 'draw_card',
+        'show_card', 'decide_card', 'play',
+        'evaluate_score', 'evaluate_bet',
+        'expire_bet', 'expire_play',
+        'bet_many', 'play_many', 'apply_commands'
+    ))
+
+    # phases with deadlines, the card decision belongs to the play phase
+    PHASES = {
+        Game.STATUS_102_BET: 'bet',
+        Game.STATUS_103_PLAY: 'play',
+        Game.STATUS_1031_CARD_DECIDE: 'play'
+    }
+
+    def __init__(self, queue_size=256, game_factory=Game, bet_deadline=None, play_deadline=None, timer_wheel=None, metrics=None, scoreboard=None):
+        self.queue_size = queue_size
+        # metrics: True for the process-wide metrics.registry, a Registry or a HostMetrics
+        if metrics is True:
+            metrics = HostMetrics()
+        elif isinstance(metrics, Registry):
+            metrics = HostMetrics(metrics)
+        self.metrics = metrics
+        self.scoreboard = scoreboard # ScoreboardWriter the standings of every table are published to
+        self.game_factory = game_factory
+        self.deadlines = {'bet': bet_deadline, 'play': play_deadline}
+        self.timer_wheel = timer_wheel if timer_wheel else TimerWheel()
+        self.__timer_task = None
+        self.__tables = {}
+
+    @property
+    def tables(self):
+        return self.__tables
+
+    def table(self, table_id) -> Table:
+        if table_id not in self.__tables:
+            raise GameplayError(f'Invalid table id: {table_id}')
+        return self.__tables[table_id]
+
+    def open_table(self, table_id, *args, **kwargs) -> Game:
+        'Create a table, must be called while the event loop is running'
+        if table_id in self.__tables:
+            raise GameplayError(f'Duplicate table id: {table_id}')
+        table = Table(table_id, self.game_factory(*args, **kwargs), self.queue_size)
+        # the only step that can fail, before anything is counted or registered
+        if self.scoreboard is not None:
+            self.scoreboard.attach(table.game, table_id)
+        if self.metrics is not None:
+            table.game.add_turn_listener(self.metrics.on_turn)
+            table.game.add_finish_listener(self.metrics.on_finish)
+            self.metrics.tables.inc()
+            self.__count_players(table)
+        loop = asyncio.get_running_loop()
+        table.task = loop.create_task(self.__run_table(table))
+        self.__tables[table_id] = table
+        if self.__timer_task is None and any(self.deadlines.values()):
+            self.__timer_task = loop.create_task(self.__run_timer())
+        return table.game
+
+    def delta_stream(self, table_id) -> DeltaStream:
+        'Versioned state diffs of a table for spectators, see DeltaStream'
+        table = self.table(table_id)
+        if table.deltas is None:
+            table.deltas = DeltaStream(table.game)
+        return table.deltas
+
+    async def close_table(self, table_id):
+        'Process the commands already queued, then drop the table'
+        table = self.table(table_id)
+        await table.queue.join()
+        table.task.cancel()
+        if table.deadline:
+            self.timer_wheel.cancel(table.deadline)
+        del self.__tables[table_id]
+        if self.scoreboard is not None:
+            self.scoreboard.remove(table_id)
+        if self.metrics is not None:
+            self.metrics.tables.dec()
+            self.metrics.players.dec(table.players)
+
+    async def close(self):
+        for table_id in list(self.__tables.keys()):
+            await self.close_table(table_id)
+        if self.__timer_task:
+            self.__timer_task.cancel()
+            self.__timer_task = None
+
+    # diagnostics
+    def memory_usage(self):
+        '''
+        {subsystem: memory.Usage} summed over the tables, plus the
+        process-wide catalogue, quest cache and song completion.
+        '''
+        result = process_usage()
+        for table in self.__tables.values():
+            for name, usage in table.game.memory_usage().items():
+                previous = result.get(name, Usage(0, 0))
+                result[name] = Usage(previous.objects + usage.objects, previous.bytes + usage.bytes)
+        return result
+
+    def __count_players(self, table:Table):
+        players = len(table.game.standings.players)
+        self.metrics.players.inc(players - table.players)
+        table.players = players
+
+    # deadlines
+    async def __run_timer(self):
+        wheel = self.timer_wheel
+        while True:
+            await asyncio.sleep(wheel.tick)
+            wheel.advance()
+
+    def __check_phase(self, table:Table):
+        phase = self.PHASES.get(table.game.status)
+        if phase == table.phase:
+            return
+        previous = table.phase
+        table.phase = phase
+        if self.metrics is not None:
+            now = time.perf_counter()
+            if table.phase_started is not None:
+                self.metrics.phase_seconds.labels(previous).observe(now - table.phase_started)
+            table.phase_started = now if phase else None
+        if table.deadline:
+            self.timer_wheel.cancel(table.deadline)
+            table.deadline = None
+        if phase and self.deadlines[phase]:
+            table.deadline = self.timer_wheel.schedule(self.deadlines[phase], self.__expire, table, phase)
+
+    def __expire(self, table:Table, phase):
+        if table.phase != phase or self.__tables.get(table.id) is not table:
+            return
+        table.deadline = None
+        try:
+            if phase == 'bet':
+                table.game.expire_bet()
+            else:
+                table.game.expire_play()
+        except GameplayError:
+            pass
+        except Exception as e:
+            # the timer serves every table, one failing deadline must not stop it
+            default_logger.warning(KIND_MESSAGE, 'Table {} {} deadline failed: {!r}', table.id, phase, e)
+        self.__check_phase(table)
+
+    # commands
+    def __command(self, command, args, kwargs):
+        if command not in self.COMMANDS:
+            raise GameplayError(f'Invalid command: {command}')
+        return TableCommand(command, args, kwargs, asyncio.get_running_loop().create_future())
+
+    async def submit(self, table_id, command, *args, **kwargs):
+        'Queue a command, waiting for room in the table queue, and return its result'
+        table = self.table(table_id)
+        cmd = self.__command(command, args, kwargs)
+        await table.queue.put(cmd)
+        return await cmd.future
+
+    def submit_nowait(self, table_id, command, *args, **kwargs):
+        'Queue a command and return its future. Raises asyncio.QueueFull when the table is busy'
+        table = self.table(table_id)
+        cmd = self.__command(command, args, kwargs)
+        table.queue.put_nowait(cmd)
+        return cmd.future
+
+    async def dispatch(self, message:dict):
+        'message: {"table": id, "command": name, "args": [...], "kwargs": {...}}'
+        return await self.submit(
+            message['table'],
+            message['command'],
+            *message.get('args', ()),
+            **message.get('kwargs', {})
+        )
+
+    async def __run_table(self, table:Table):
+        queue = table.queue
+        game = table.game
+        while True:
+            cmd = await queue.get()
+            start = time.perf_counter()
+            try:
+                result = getattr(game, cmd.name)(*cmd.args, **cmd.kwargs)
+            except Exception as e:
+                if self.metrics is not None:
+                    self.metrics.command(cmd.name, time.perf_counter() - start, ok=False)
+                if not cmd.future.done():
+                    cmd.future.set_exception(e)
+            else:
+                if self.metrics is not None:
+                    self.metrics.command(cmd.name, time.perf_counter() - start)
+                    if cmd.name in ('enroll', 'remove'):
+                        self.__count_players(table)
+                if not cmd.future.done():
+                    cmd.future.set_result(result)
+            table.processed += 1
+            queue.task_done()
+            self.__check_phase(table)
+            if not table.processed % 32:
+                # a long queue must not starve the other tables
+                await asyncio.sleep(0)
@@ -0,0 +1,284 @@
+import os
+import struct
+import threading
+import zlib
+from .rules import RuleSet
+from .utils import GameplayError
+
+MAGIC = b'BETJ\x01'
+
+# opcodes, append new ones at the end to keep old journals readable
+OPS = (
+    'create', 'snapshot',
+    'enroll', 'remove', 'add_quest',
+    'enable', 'disable', 'enable_all', 'disable_all',
+    'start', 'reset_round',
+    'draw_event', 'draw_quest', 'bet', 'draw_card',
+    'show_card', 'decide_card', 'play',
+    'expire_bet', 'expire_play',
+    'evaluate_score', 'evaluate_bet',
+    'bet_many', 'play_many', 'apply_commands'
+)
+OP_CODES = {name: code for code, name in enumerate(OPS)}
+
+_HEADER = struct.Struct('<II') # payload length, crc32
+_FLOAT = struct.Struct('<d')
+
+
+# compact value encoding: one tag byte, varints for sizes and ints
+def _write_varint(out:bytearray, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+def encode_value(out:bytearray, value):
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        out += b'i'
+        _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif isinstance(value, float):
+        out += b'f'
+        out += _FLOAT.pack(value)
+    elif isinstance(value, str):
+        raw = value.encode('utf8')
+        out += b's'
+        _write_varint(out, len(raw))
+        out += raw
+    elif isinstance(value, bytes):
+        out += b'b'
+        _write_varint(out, len(value))
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out += b'l'
+        _write_varint(out, len(value))
+        for item in value:
+            encode_value(out, item)
+    elif isinstance(value, dict):
+        out += b'd'
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            encode_value(out, key)
+            encode_value(out, item)
+    else:
+        raise GameplayError(f'Cannot journal value {value!r}')
+
+def decode_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == 0x4E: # N
+        return None, pos
+    if tag == 0x54: # T
+        return True, pos
+    if tag == 0x46: # F
+        return False, pos
+    if tag == 0x69: # i
+        n, pos = _read_varint(data, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    if tag == 0x66: # f
+        return _FLOAT.unpack_from(data, pos)[0], pos + 8
+    if tag == 0x73 or tag == 0x62: # s, b
+        n, pos = _read_varint(data, pos)
+        raw = bytes(data[pos:pos+n])
+        return (raw.decode('utf8') if tag == 0x73 else raw), pos + n
+    if tag == 0x6C: # l
+        n, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(n):
+            item, pos = decode_value(data, pos)
+            items.append(item)
+        return items, pos
+    if tag == 0x64: # d
+        n, pos = _read_varint(data, pos)
+        items = {}
+        for _ in range(n):
+            key, pos = decode_value(data, pos)
+            items[key], pos = decode_value(data, pos)
+        return items, pos
+    raise GameplayError(f'Corrupted journal value tag {tag}')
+
+
+def encode_record(op, args=(), kwargs=None) -> bytes:
+    payload = bytearray((OP_CODES[op],))
+    encode_value(payload, list(args))
+    encode_value(payload, kwargs if kwargs else {})
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def decode_record(payload):
+    op = OPS[payload[0]]
+    args, pos = decode_value(payload, 1)
+    kwargs, pos = decode_value(payload, pos)
+    return op, args, kwargs
+
+
+class Journal:
+    '''
+    Append-only command journal of one table.
+    Records are buffered and written with one fsync per group: when
+    sync_every records are pending, on commit(), or every sync_interval
+    seconds by a background flusher when background=True.
+    '''
+    def __init__(self, path, sync_every=64, sync_interval=0.05, background=False, fsync=True):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.fsync = fsync
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.__file = open(path, 'ab')
+        if new_file:
+            self.__file.write(MAGIC)
+        self.__pending = []
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        self.records = 0
+        self.syncs = 0
+        self.__flusher = None
+        if background:
+            self.__flusher = threading.Thread(target=self.__run_flusher, daemon=True)
+            self.__flusher.start()
+
+    def append(self, op, args=(), kwargs=None):
+        record = encode_record(op, args, kwargs)
+        with self.__lock:
+            self.__pending.append(record)
+            self.records += 1
+            if len(self.__pending) >= self.sync_every:
+                self.__commit()
+
+    def write_snapshot(self, payload:bytes):
+        'A snapshot record, replay only needs the records after the last one'
+        self.append('snapshot', (payload,))
+        self.commit()
+
+    def commit(self):
+        with self.__lock:
+            self.__commit()
+
+    def __commit(self):
+        if self.__pending:
+            self.__file.write(b''.join(self.__pending))
+            self.__pending = []
+            self.__file.flush()
+            if self.fsync:
+                os.fsync(self.__file.fileno())
+            self.syncs += 1
+
+    def __run_flusher(self):
+        while not self.__closed.wait(self.sync_interval):
+            self.commit()
+
+    def close(self):
+        self.__closed.set()
+        if self.__flusher:
+            self.__flusher.join()
+        with self.__lock:
+            if not self.__file.closed:
+                self.__commit()
+                self.__file.close()
+
+
+def _scan(data):
+    'Yields (payload, end) of every complete record, stops at a torn or corrupted tail'
+    if data[:len(MAGIC)] != MAGIC:
+        raise GameplayError('Not a game journal')
+    pos = len(MAGIC)
+    view = memoryview(data)
+    while pos + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, pos)
+        start = pos + _HEADER.size
+        payload = view[start:start+length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        pos = start + length
+        yield payload, pos
+
+def read_journal(path):
+    'Yields (op, args, kwargs) of every complete record'
+    with open(path, 'rb') as f:
+        data = f.read()
+    for payload, _ in _scan(data):
+        yield decode_record(payload)
+
+
+def replay_journal(path, game_factory=None, restore=None, use_snapshots=True, **overrides):
+    '''
+    Rebuild a game from its journal. Replay starts from the last snapshot
+    record, restored with restore(payload, **overrides) (snapshot.restore by default).
+    Extra keyword arguments override the recorded Game constructor arguments;
+    a rules override has to be the RuleSet the journal was recorded with.
+    Replayed plays stay out of the song popularity unless record_plays=True.
+    '''
+    if game_factory is None:
+        from .game import Game
+        game_factory = Game
+    if not use_snapshots:
+        restore = None
+    elif restore is None:
+        from .snapshot import restore
+    overrides = {'record_plays': False, **overrides}
+    records = list(read_journal(path))
+    _check_rules(path, records, overrides.get('rules'))
+    start = 0
+    game = None
+    if restore is not None:
+        for i in range(len(records) - 1, -1, -1):
+            if records[i][0] == 'snapshot':
+                game = restore(records[i][1][0], **overrides)
+                start = i + 1
+                break
+    for op, args, kwargs in records[start:]:
+        if op == 'create':
+            kwargs = {key: value for key, value in kwargs.items() if key != 'rules'}
+            game = game_factory(*args, **{**kwargs, **overrides})
+        elif op == 'snapshot':
+            continue
+        elif game is None:
+            raise GameplayError(f'Journal {path} has no create record')
+        else:
+            getattr(game, op)(*args, **kwargs)
+    return game
+
+
+def _check_rules(path, records, rules):
+    # the journal holds the outcomes under its rules, other rules would replay another game (see ReplayEngine)
+    name = rules.name if rules else RuleSet().name
+    for op, _, kwargs in records:
+        if op == 'create':
+            recorded = kwargs.get('rules', name)
+            if recorded != name:
+                raise GameplayError(f'Journal {path} was recorded with rules {recorded}, not {name}')
+            return
+
+
+def recover(path, game_factory=None, restore=None, use_snapshots=True, **overrides):
+    'Rebuild a table after a crash and keep journaling into the same file'
+    game = replay_journal(path, game_factory=game_factory, restore=restore, use_snapshots=use_snapshots, **overrides)
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = len(MAGIC)
+    for _, end in _scan(data):
+        pass
+    if end < len(data):
+        # drop the torn tail, otherwise new records would be unreachable
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+    game.journal = Journal(path)
+    # the plays from now on are new ones
+    game.record_plays = overrides.get('record_plays', True)
+    return game
@@ -0,0 +1,157 @@
+import sys
+import time
+import threading
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+QUIET = 100 # above every level, nothing is recorded
+
+# record kinds
+KIND_MESSAGE = 'message'
+KIND_DIVIDER = 'divider'
+KIND_TABLE = 'table'
+KIND_EVENT = 'event'
+KIND_QUEST = 'quest'
+KIND_BET = 'bet'
+KIND_CARD = 'card'
+KIND_PLAY = 'play'
+
+DIVIDER = '============================='
+
+
+class LogRecord:
+    '''
+    msg is a str.format template, args are only formatted in format(),
+    so a record nobody formats never renders e.g. the whole Game table.
+    '''
+    __slots__ = ('level', 'kind', 'msg', 'args', 'time')
+
+    def __init__(self, level, kind, msg, args):
+        self.level = level
+        self.kind = kind
+        self.msg = msg
+        self.args = args
+        self.time = time.time()
+
+    def format(self):
+        if self.args:
+            return self.msg.format(*self.args)
+        return self.msg
+
+    def __str__(self):
+        return self.format()
+
+
+class StreamSink:
+    'Writes every record right away, by default to the current sys.stdout like print()'
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, record:LogRecord):
+        stream = self.stream if self.stream else sys.stdout
+        stream.write(record.format() + '\n')
+
+    def flush(self):
+        stream = self.stream if self.stream else sys.stdout
+        stream.flush()
+
+
+class BufferedSink:
+    '''
+    Formats records when they arrive (they show the state at logging time)
+    but writes them in batches of capacity lines.
+    '''
+    def __init__(self, stream=None, capacity=256):
+        self.stream = stream
+        self.capacity = capacity
+        self.__buffer = []
+        self.__lock = threading.Lock()
+
+    def emit(self, record:LogRecord):
+        with self.__lock:
+            self.__buffer.append(record.format())
+            if len(self.__buffer) >= self.capacity:
+                self.__write()
+
+    def __write(self):
+        if self.__buffer:
+            stream = self.stream if self.stream else sys.stdout
+            stream.write('\n'.join(self.__buffer) + '\n')
+            self.__buffer = []
+
+    def flush(self):
+        with self.__lock:
+            self.__write()
+        stream = self.stream if self.stream else sys.stdout
+        stream.flush()
+
+
+# args kept as they are, anything else may change after it was logged
+_FROZEN = (str, int, float, bool, bytes, type(None))
+
+
+class RecordSink:
+    '''
+    Keeps the typed records themselves for structured consumers. Only
+    args that are not plain values (e.g. the Game whose table is logged)
+    are formatted on arrival, so a record keeps the state at logging time.
+    '''
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen
+        self.records = []
+
+    def emit(self, record:LogRecord):
+        if any(not isinstance(arg, _FROZEN) for arg in record.args):
+            record.args = tuple(arg if isinstance(arg, _FROZEN) else format(arg) for arg in record.args)
+        self.records.append(record)
+        if self.maxlen and len(self.records) > self.maxlen:
+            del self.records[:len(self.records) - self.maxlen]
+
+    def flush(self):
+        pass
+
+
+class Logger:
+    def __init__(self, level=INFO, sinks=None):
+        self.level = level
+        self.sinks = [StreamSink()] if sinks is None else list(sinks)
+
+    def enabled(self, level=INFO):
+        return level >= self.level and bool(self.sinks)
+
+    def log(self, level, kind, msg, *args):
+        if level < self.level or not self.sinks:
+            return
+        record = LogRecord(level, kind, msg, args)
+        for sink in self.sinks:
+            sink.emit(record)
+
+    # the level checks are repeated here so filtered calls return right away
+    def debug(self, kind, msg, *args):
+        if DEBUG >= self.level:
+            self.log(DEBUG, kind, msg, *args)
+
+    def info(self, kind, msg, *args):
+        if INFO >= self.level:
+            self.log(INFO, kind, msg, *args)
+
+    def warning(self, kind, msg, *args):
+        if WARNING >= self.level:
+            self.log(WARNING, kind, msg, *args)
+
+    def divideline(self, level=INFO):
+        if level >= self.level:
+            self.log(level, KIND_DIVIDER, DIVIDER)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+
+def quiet_logger():
+    'For servers and simulations: every call returns after one comparison'
+    return Logger(level=QUIET, sinks=[])
+
+
+default_logger = Logger()
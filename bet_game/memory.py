@@ -0,0 +1,157 @@
+import gc
+import os
+import sys
+import tracemalloc
+import types
+from collections import Counter, namedtuple
+from .parser import get_arcaea_info, get_phigros_info
+from . import song
+
+Usage = namedtuple('Usage', ('objects', 'bytes'))
+
+# never followed: shared by everything, not owned by any subsystem
+_OPAQUE = (type, types.ModuleType, types.CodeType, types.FrameType)
+
+
+def _referents(obj):
+    if isinstance(obj, types.FunctionType):
+        # a closure owns its cells and defaults, not its module globals
+        refs = [obj.__defaults__, obj.__kwdefaults__, obj.__dict__]
+        if obj.__closure__:
+            refs.extend(cell.cell_contents for cell in obj.__closure__ if cell.cell_contents is not None)
+        return refs
+    if isinstance(obj, types.BuiltinFunctionType):
+        return (obj.__self__,)
+    return gc.get_referents(obj)
+
+
+def _walk(roots, seen):
+    'Objects reachable from roots and not in seen, adds them to seen'
+    found = []
+    stack = [root for root in roots if root is not None]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _OPAQUE):
+            continue
+        seen.add(id(obj))
+        found.append(obj)
+        stack.extend(_referents(obj))
+    return found
+
+
+def measure(subsystems:dict, exclude=(), boundary=()):
+    '''
+    {name: Usage} of objects reachable from each subsystem's roots.
+    Subsystems are walked in order and an object only counts for the
+    first one reaching it, objects reachable from exclude count nowhere.
+    Boundary objects (e.g. the owning Game) are neither counted nor followed.
+    '''
+    seen = {id(obj) for obj in boundary}
+    _walk(exclude, seen)
+    result = {}
+    for name, roots in subsystems.items():
+        objects = _walk(roots if isinstance(roots, (list, tuple)) else (roots,), seen)
+        result[name] = Usage(len(objects), sum(map(sys.getsizeof, objects)))
+    return result
+
+
+def process_roots():
+    'Process-wide objects shared by the tables: parsed catalogues, quest list cache, song completion'
+    return {
+        'catalogue': [info() for info in (get_arcaea_info, get_phigros_info) if info.cache_info().currsize],
+        'quest_cache': song._quest_list_cache,
+        'song_completion': song._song_completers,
+    }
+
+
+def process_usage():
+    return measure(process_roots())
+
+
+def total(usages):
+    'Usage summed over a {name: Usage}'
+    return Usage(sum(usage.objects for usage in usages.values()), sum(usage.bytes for usage in usages.values()))
+
+
+def count_instances(module_prefix='bet_game'):
+    '''
+    Live instances by class of the classes defined in module_prefix,
+    e.g. Player or RadixNode counts that keep growing point at a leak.
+    '''
+    counts = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        if cls.__module__.startswith(module_prefix):
+            counts[f'{cls.__module__}.{cls.__qualname__}'] += 1
+    return counts
+
+
+class AllocationTrace:
+    '''
+    tracemalloc snapshots around a phase, e.g.
+
+        with AllocationTrace() as trace:
+            game.evaluate_bet()
+        print(trace)
+
+    tracemalloc is started for the trace unless it already runs.
+    A garbage collection before each snapshot keeps cyclic garbage out of the diff.
+    '''
+    def __init__(self, frames=1, key_type='lineno', package_only=False):
+        self.frames = frames
+        self.key_type = key_type
+        self.package_only = package_only # only allocations made by bet_game code
+        self.before = None
+        self.after = None
+        self.__started = False
+
+    def start(self):
+        self.__started = not tracemalloc.is_tracing()
+        if self.__started:
+            tracemalloc.start(self.frames)
+        gc.collect()
+        self.before = tracemalloc.take_snapshot()
+        return self
+
+    def stop(self):
+        gc.collect()
+        self.after = tracemalloc.take_snapshot()
+        if self.__started:
+            tracemalloc.stop()
+            self.__started = False
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __filters(self):
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ]
+        if self.package_only:
+            filters.append(tracemalloc.Filter(True, os.path.join(os.path.dirname(__file__), '*')))
+        return filters
+
+    def diff(self):
+        'tracemalloc.StatisticDiff list, largest growth first'
+        if self.after is None:
+            raise RuntimeError('AllocationTrace has not been stopped')
+        filters = self.__filters()
+        return self.after.filter_traces(filters).compare_to(self.before.filter_traces(filters), self.key_type)
+
+    @property
+    def size_diff(self):
+        'Net bytes allocated during the trace'
+        return sum(stat.size_diff for stat in self.diff())
+
+    def top(self, n=10):
+        return [stat for stat in self.diff() if stat.size_diff or stat.count_diff][:n]
+
+    def __str__(self):
+        lines = [f'net {self.size_diff / 1024:+.1f} KiB']
+        lines.extend(str(stat) for stat in self.top())
+        return '\n'.join(lines)
@@ -0,0 +1,309 @@
+import threading
+from bisect import bisect_left
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .parser import get_arcaea_info, get_phigros_info
+from .song import quest_cache_info
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    '''
+    A metric family. labels(*values) returns the child of one label
+    combination, keep it around on hot paths: an update is then one
+    uncontended lock of that child and nothing else.
+    '''
+    TYPE = None
+    CHILD = None # class of the children, unless __init__ gets a child factory
+
+    def __init__(self, name, documentation, labelnames=(), child=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.__child = child if child is not None else self.CHILD
+        self.__children = {}
+        self.__lock = threading.Lock()
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}')
+        child = self.__children.get(values)
+        if child is None:
+            with self.__lock:
+                child = self.__children.setdefault(values, self.__child())
+        return child
+
+    def children(self):
+        return list(self.__children.items())
+
+    def samples(self):
+        for values, child in self.children():
+            yield self.name, _labels(self.labelnames, values), child.value
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+    CHILD = _CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in self.children():
+            yield self.name + '_total', _labels(self.labelnames, values), child.value
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+    CHILD = _GaugeChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, child=partial(_HistogramChild, self.buckets))
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in self.children():
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', _labels(self.labelnames, values, f'le="{_number(float(bound))}"'), cumulative
+            yield self.name + '_sum', _labels(self.labelnames, values), total
+            yield self.name + '_count', _labels(self.labelnames, values), cumulative
+
+
+class CallbackMetric:
+    'Samples computed at scrape time by func() -> [(label values, value)]'
+    def __init__(self, name, documentation, type, func, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.TYPE = type
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        suffix = '_total' if self.TYPE == 'counter' else ''
+        for values, value in self.func():
+            yield self.name + suffix, _labels(self.labelnames, values), value
+
+
+class Registry:
+    '''
+    Metric families by name. counter()/gauge()/histogram() return the
+    existing family of that name, so every table and host shares them.
+    '''
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def __register(self, cls, name, *args, **kwargs):
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = self.__metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'{name} is already registered as a {metric.TYPE}')
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.__register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.__register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.__register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def callback(self, name, documentation, type, func, labelnames=()):
+        'Register (or replace) a metric read from func() at scrape time'
+        with self.__lock:
+            metric = self.__metrics[name] = CallbackMetric(name, documentation, type, func, labelnames)
+            return metric
+
+    def get(self, name):
+        return self.__metrics.get(name)
+
+    def expose(self):
+        'Prometheus text exposition format'
+        with self.__lock:
+            metrics = sorted(self.__metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            family = metric.name + '_total' if metric.TYPE == 'counter' else metric.name
+            lines.append(f'# HELP {family} {metric.documentation}')
+            lines.append(f'# TYPE {family} {metric.TYPE}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# process-wide registry used by GameHost(metrics=True)
+registry = Registry()
+
+
+def _catalogue_cache(field):
+    def samples():
+        for catalogue, info in (('arcaea', get_arcaea_info), ('phigros', get_phigros_info)):
+            yield (catalogue,), getattr(info.cache_info(), field)
+    return samples
+
+def register_cache_metrics(registry:Registry):
+    'Hits and misses of the catalogue parsers and the quest list cache'
+    registry.callback('bet_game_catalogue_cache_hits', 'Song catalogue cache hits', 'counter', _catalogue_cache('hits'), ('catalogue',))
+    registry.callback('bet_game_catalogue_cache_misses', 'Song catalogue cache misses (catalogue parses)', 'counter', _catalogue_cache('misses'), ('catalogue',))
+    registry.callback('bet_game_quest_cache_hits', 'Quest list cache hits', 'counter', lambda: [((), quest_cache_info()['hits'])])
+    registry.callback('bet_game_quest_cache_misses', 'Quest list cache misses (quest lists built)', 'counter', lambda: [((), quest_cache_info()['misses'])])
+    registry.callback('bet_game_quest_cache_entries', 'Quest lists in the cache', 'gauge', lambda: [((), quest_cache_info()['size'])])
+
+
+class HostMetrics:
+    '''
+    The game metrics a GameHost updates: commands, command and phase
+    latencies, quests, cards, events, tables and players.
+    '''
+    def __init__(self, registry:Registry=registry):
+        self.registry = registry
+        self.commands = registry.counter('bet_game_commands', 'Table commands processed', ('command', 'outcome'))
+        self.command_seconds = registry.histogram('bet_game_command_seconds', 'Table command latency', ('command',))
+        self.phase_seconds = registry.histogram('bet_game_phase_seconds', 'Time spent in the bet and play phases', ('phase',))
+        self.quests = registry.counter('bet_game_quests_drawn', 'Quests played', ('difficulty',))
+        self.cards_bought = registry.counter('bet_game_cards_bought', 'Random cards bought')
+        self.cards_used = registry.counter('bet_game_cards_used', 'Random cards played', ('card',))
+        self.events = registry.counter('bet_game_events_fired', 'Random events fired', ('event',))
+        self.turns = registry.counter('bet_game_turns', 'Turns finished')
+        self.games = registry.counter('bet_game_games', 'Games finished')
+        self.tables = registry.gauge('bet_game_active_tables', 'Open tables')
+        self.players = registry.gauge('bet_game_active_players', 'Players enrolled at open tables')
+        register_cache_metrics(registry)
+        self.__commands = {} # (command, ok) -> (counter child, histogram child)
+
+    def command(self, name, seconds, ok=True):
+        children = self.__commands.get((name, ok))
+        if children is None:
+            children = self.__commands[(name, ok)] = (
+                self.commands.labels(name, 'ok' if ok else 'error'), self.command_seconds.labels(name)
+            )
+        children[0].inc()
+        children[1].observe(seconds)
+
+    def on_turn(self, result):
+        'Turn listener, see Game.add_turn_listener'
+        self.turns.inc()
+        if result.quest is not None:
+            self.quests.labels(result.difficulty or '').inc()
+        if result.event is not None:
+            self.events.labels(result.event).inc()
+        if result.card is not None:
+            self.cards_used.labels(result.card).inc()
+        bought = sum(1 for player in result.players if player.card_spent)
+        if bought:
+            self.cards_bought.inc(bought)
+
+    def on_finish(self, result):
+        self.games.inc()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(registry:Registry=registry, port=9464, host='127.0.0.1') -> ThreadingHTTPServer:
+    '''
+    Serve /metrics from a daemon thread, localhost only by default.
+    port=0 picks a free port (server.server_address). Stop with server.shutdown().
+    '''
+    handler = type('MetricsHandler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bet_game-metrics', daemon=True).start()
+    return server
@@ -1,10 +1,14 @@
 import os
 import json
 import re
+from functools import lru_cache
 
-from .utils import ParseError
+from .utils import ParseError, log
+from .logger import WARNING
 from .quest import ArcaeaQuestInfo, PhigrosQuestInfo
 
+# the catalogue is read-only after loading, every song manager shares one copy
+@lru_cache(maxsize=None)
 def get_arcaea_info():
     _song_info_file = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + '/song_info/arcaea_songlist'
     with open(_song_info_file, 'r', encoding='utf8') as f:
@@ -72,6 +76,7 @@ def set_arcaea_quest(level_weights:dict, songs:list, args:list):
     return quests
 
 # phigros
+@lru_cache(maxsize=None)
 def get_phigros_info():
     _song_info_file = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + '/song_info/phigros_songlist'
     with open(_song_info_file, 'r', encoding='utf8') as f:
@@ -116,7 +121,7 @@ def set_phigros_quest(level_weights:dict, songs:list, args:list):
             try:
                 level_weights[int(float(_arg1))] = max(float(_arg2), 0)
             except ValueError:
-                print(f'{_arg1} is not a valid level!')
+                log(f'{_arg1} is not a valid level!', WARNING)
         elif isinstance(_arg2, str):
             # ban song
             if _arg1 != "ban":
@@ -1,11 +1,25 @@
 from functools import cmp_to_key
 from math import floor
-from .utils import TrieNode, GameplayError
+from operator import attrgetter
+from .utils import RadixTree, GameplayError
+from .complete import Autocomplete
 
 class Player:
+    # everything a snapshot needs besides the id
+    STATE_FIELDS = (
+        'score', 'took_bet', 'bet_id', 'stake', 'betted', 'bet_reward',
+        'bought_card', 'card_spent', 'card_reward', 'card_reward_merged',
+        'played', 'playing_score', 'rank', 'cur_pt'
+    )
+
+    # the fields __str__ depends on besides the id
+    RENDER_FIELDS = ('score', 'betted', 'bet_reward', 'card_spent', 'card_reward', 'card_reward_merged', 'cur_pt')
+
     def __init__(self, id:str):
         self.id = id
         self.score = 0
+        self.__text_key = None
+        self.__text = None
         self.reset_round()
 
     def reset_round(self):
@@ -18,6 +32,7 @@ class Player:
         self.stake = None # This round's stake.
         self.betted = None # How many people betted on the player? (For deduct)
         self.bet_reward = None # Points that the player earned in this turn's bet.
+        self.bought_card = False # Did the player try to buy a random card this turn?
         self.card_spent = None # Points that the player spent on buying random cards.
         self.card_reward = None # Points that the player earned on card events.
         self.card_reward_merged = False # If card reward has been calculated. 
@@ -32,6 +47,14 @@ class Player:
         return self.score < other.score
 
     def __str__(self):
+        # rebuilt only after one of RENDER_FIELDS changed
+        key = _render_key(self)
+        if key != self.__text_key:
+            self.__text_key = key
+            self.__text = self.__render()
+        return self.__text
+
+    def __render(self):
         if self.card_reward_merged: # After bet eval + card award
             if self.bet_reward < 0:
                 return f'{self.id} ({self.score-self.bet_reward-self.card_reward}-{-self.bet_reward}+{self.card_reward}={self.score})'
@@ -52,13 +75,16 @@ class Player:
             return f'{self.id} ({self.score})'
         else: # Before take bet
             return f'{self.id} ({self.score})'
-    
+
+_render_key = attrgetter(*Player.RENDER_FIELDS)
+
 class PlayerManager:
     def __init__(self):
         self.betted_decrease = True
         self.bet_failed_decrease = True
         self.player_list = []
-        self.player_id_trie = TrieNode()
+        self.player_id_trie = RadixTree()
+        self.player_completer = Autocomplete() # ids ranked by score, see refresh_completions
 
         # set evaluate function
         self.reset_round()
@@ -92,15 +118,42 @@ class PlayerManager:
         if len(id) >= 15:
             raise GameplayError("Player id should be less than 15 character!")
         player = Player(id)
-        self.player_list.append(player)
         self.player_id_trie.insert(id, player)
+        self.player_list.append(player)
+        self.player_completer.set(id, player.score)
 
     def remove_player(self, id:str):
-        _, player_id = self.player_id_trie.delete(id) 
-        for i, player in enumerate(self.player_list):
-            if player.id == player_id:
-                del(self.player_list[i])
-                return
+        player = self.player_id_trie.delete(id)
+        self.player_list.remove(player)
+        self.player_completer.remove(player.id)
+
+    def refresh_completions(self):
+        'Rank the id completions by the current scores'
+        changed = [(player.id, player.score) for player in self.player_list if self.player_completer.weight(player.id) != player.score]
+        if len(changed) > 8:
+            self.player_completer.update(changed)
+        else:
+            for id, score in changed:
+                self.player_completer.set(id, score)
+
+    def complete(self, prefix:str, k=5):
+        return self.player_completer.complete(prefix, k)
+
+    # snapshot
+    def state(self):
+        return [[player.id] + [getattr(player, field) for field in Player.STATE_FIELDS] for player in self.player_list]
+
+    def load_state(self, state):
+        self.player_list = []
+        self.player_id_trie = RadixTree()
+        self.player_completer = Autocomplete()
+        for row in state:
+            player = Player(row[0])
+            for field, value in zip(Player.STATE_FIELDS, row[1:]):
+                setattr(player, field, value)
+            self.player_list.append(player)
+            self.player_id_trie.insert(player.id, player)
+        self.player_completer.update((player.id, player.score) for player in self.player_list)
 
     # default evaluate function
     def default_set_score(self, player:Player, score):
@@ -165,9 +218,9 @@ class PlayerManager:
 
 
     # buy card cost
-    def card_bought_deduct(self, deduct_list):
+    def card_bought_deduct(self, deduct_list, cost=None):
         if len(deduct_list):
-            half_score = floor(len(self.player_list)/2)
+            half_score = floor(len(self.player_list)/2) if cost is None else cost
             for player in deduct_list:
                 player.score -= half_score
                 player.card_spent = half_score
@@ -1,5 +1,6 @@
 from .utils import GameplayError
 import numpy as _np
+import random
 
 class QuestInfo:
     def __init__(
@@ -9,6 +10,10 @@ class QuestInfo:
     ):
         self.weight = weight
         self.description = description
+        self.song_id = ''
+        self.title = ''
+        self.level = None
+        self.difficulty = ''
 
     def __str__(self):
         return self.description
@@ -27,7 +32,7 @@ class ArcaeaQuestInfo(QuestInfo):
         level_name = str(int(level))
         if level - int(level) > 0:
             level_name += '+'
-        difficulty_full = {'pst':'Past', 'pre':'Present', 'ftr':'Future', 'byd':'Beyond'}
+        difficulty_full = {'pst':'Past', 'prs':'Present', 'ftr':'Future', 'byd':'Beyond'}
         difficulty_name = difficulty_full[song['difficulty']]
 
         song_name = song['name']
@@ -35,6 +40,10 @@ class ArcaeaQuestInfo(QuestInfo):
 
         self.weight = weight
         self.description = f'{song_name} ({artist_name}) [{difficulty_name} {level_name}]'
+        self.song_id = song['id']
+        self.title = song_name
+        self.level = level
+        self.difficulty = song['difficulty']
 
 
 class PhigrosQuestInfo(QuestInfo):
@@ -50,6 +59,10 @@ class PhigrosQuestInfo(QuestInfo):
         artist_name = song['artist']
         self.weight = weight
         self.description = f'{song_name} ({artist_name}) [{difficulty_name} {level_name}]'
+        self.song_id = song['id'] if song['id'] else song_name # phigros songlist has no ids
+        self.title = song_name
+        self.level = song['level']
+        self.difficulty = song['difficulty']
 
 
 class QuestPool:
@@ -58,31 +71,36 @@ class QuestPool:
             self.__quest_list = quest_list
         else:
             self.__quest_list = []
-        self.__p_cache = None
+        self.__cdf_cache = None
+
+    @property
+    def quest_list(self):
+        return self.__quest_list
 
     def set_quest_list(self, quest_list):
         self.__quest_list = quest_list
+        self.__cdf_cache = None
 
     def add_quest(self, quest:QuestInfo):
         self.__quest_list.append(quest)
-        self.__p_cache = None
+        self.__cdf_cache = None
 
     def remove_quest(self, quest:QuestInfo):
         self.__quest_list.remove(quest)
-        self.__p_cache = None
+        self.__cdf_cache = None
 
-    def draw_quest(self):
-        if not self.__p_cache is None:
-            p = self.__p_cache
+    def draw_quest(self, rng=random):
+        if not self.__cdf_cache is None:
+            cdf = self.__cdf_cache
         else:
-            weights = _np.array([q.weight for q in self.__quest_list])
             total_pool_size = len(self.__quest_list)
             if (total_pool_size == 0):
                 raise GameplayError("No Quest In The Quest Pool!")
-            total_weights = weights.sum()
-            p = weights / total_weights
-            self.__p_cache = p
-        indexes = _np.arange(0, len(p), dtype=_np.int_)
-        rolled = _np.random.choice(indexes, 1, replace=False, p=p).item()
-        current_quest = self.__quest_list[rolled]
+            cdf = _np.cumsum([q.weight for q in self.__quest_list])
+            if cdf[-1] <= 0:
+                raise GameplayError("All Quests In The Quest Pool Have Zero Weight!")
+            self.__cdf_cache = cdf
+        # one uniform draw per quest, so the result only depends on the rng counter
+        rolled = int(_np.searchsorted(cdf, rng.random() * cdf[-1], side='right'))
+        current_quest = self.__quest_list[min(rolled, len(cdf) - 1)]
         return current_quest
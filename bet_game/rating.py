@@ -0,0 +1,246 @@
+import itertools
+import random
+import threading
+from contextlib import closing
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, next, width):
+        self.key = key
+        self.next = next
+        self.width = width # positions skipped by next[level]
+
+
+class OrderedIndex:
+    '''
+    Indexable skip list of sortable keys.
+    insert(), remove(), rank() and key_at() are O(log n),
+    slice(start, n) is O(log n + n).
+    '''
+    MAX_LEVELS = 24
+
+    def __init__(self, seed=0):
+        self.__random = random.Random(seed) # only shapes the levels, any seed works
+        self.__tail = _Node((float('inf'),), [], [])
+        self.__head = _Node(None, [self.__tail] * self.MAX_LEVELS, [1] * self.MAX_LEVELS)
+        self.__size = 0
+        self.__levels = 1 # levels in use, the search skips the empty ones above
+
+    def __len__(self):
+        return self.__size
+
+    def __iter__(self):
+        node = self.__head.next[0]
+        while node is not self.__tail:
+            yield node.key
+            node = node.next[0]
+
+    def __level(self):
+        level = 1
+        while level < self.MAX_LEVELS and self.__random.getrandbits(1):
+            level += 1
+        return level
+
+    def insert(self, key):
+        height = self.__level()
+        if height > self.__levels:
+            for level in range(self.__levels, height):
+                self.__head.width[level] = self.__size + 1
+            self.__levels = height
+        chain = [None] * self.__levels
+        steps = [0] * self.__levels
+        node = self.__head
+        for level in range(self.__levels - 1, -1, -1):
+            while node.next[level].key <= key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new = _Node(key, [None] * height, [None] * height)
+        skipped = 0
+        for level in range(height):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - skipped
+            prev.width[level] = skipped + 1
+            skipped += steps[level]
+        for level in range(height, self.__levels):
+            chain[level].width[level] += 1
+        self.__size += 1
+
+    def remove(self, key):
+        chain = [None] * self.__levels
+        node = self.__head
+        for level in range(self.__levels - 1, -1, -1):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is self.__tail or target.key != key:
+            raise KeyError(key)
+        height = len(target.next)
+        for level in range(height):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(height, self.__levels):
+            chain[level].width[level] -= 1
+        self.__size -= 1
+
+    def rank(self, key):
+        '0-based position of key, KeyError if it is not in the index'
+        node = self.__head
+        position = 0
+        for level in range(self.__levels - 1, -1, -1):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is self.__tail or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def __node_at(self, index):
+        if not 0 <= index < self.__size:
+            raise IndexError('OrderedIndex index out of range')
+        node = self.__head
+        index += 1
+        for level in range(self.__levels - 1, -1, -1):
+            while node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def key_at(self, index):
+        return self.__node_at(index).key
+
+    def slice(self, start=0, n=10):
+        'Up to n keys from position start'
+        if start >= self.__size or n <= 0:
+            return []
+        node = self.__node_at(max(0, start))
+        keys = []
+        while node is not self.__tail and len(keys) < n:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    '''
+    Multiplayer Elo ratings across games, updated from every finished game.
+    Each player of a game of k players is rated against the average rating
+    of the other k - 1 players, so an update is O(k) rating arithmetic plus
+    O(k log n) index maintenance. Players are kept in an OrderedIndex by
+    (-rating, id) for O(log n) rank() and top().
+    '''
+    def __init__(self, initial=1500.0, k_factor=32.0, provisional_k=64.0, provisional_games=10):
+        self.initial = initial
+        self.k_factor = k_factor
+        self.provisional_k = provisional_k # K of the first provisional_games games of a player
+        self.provisional_games = provisional_games
+        self.__ratings = {}
+        self.__games = {}
+        self.__index = OrderedIndex()
+        self.__lock = threading.Lock()
+        self.games_rated = 0
+
+    def __len__(self):
+        return len(self.__ratings)
+
+    def rating(self, player_id):
+        return self.__ratings.get(player_id, self.initial)
+
+    def games(self, player_id):
+        return self.__games.get(player_id, 0)
+
+    def __rate(self, standings):
+        'New ratings of one game, standings ((id, score), ...) in any order'
+        k = len(standings)
+        if k < 2:
+            return {}
+        standings = sorted(standings, key=lambda item: -item[1])
+        ratings = [self.__ratings.get(id, self.initial) for id, _ in standings]
+        total = sum(ratings)
+        updated = {}
+        i = 0
+        while i < k:
+            # players with the same score share their places
+            j = i
+            while j + 1 < k and standings[j + 1][1] == standings[i][1]:
+                j += 1
+            actual = (k - 1 - (i + j) / 2) / (k - 1)
+            for p in range(i, j + 1):
+                id = standings[p][0]
+                rating = ratings[p]
+                opponents = (total - rating) / (k - 1)
+                expected = 1 / (1 + 10 ** ((opponents - rating) / 400))
+                k_factor = self.provisional_k if self.__games.get(id, 0) < self.provisional_games else self.k_factor
+                updated[id] = rating + k_factor * (actual - expected)
+            i = j + 1
+        return updated
+
+    def update(self, standings):
+        'Rate one finished game, returns {id: new rating}'
+        with self.__lock:
+            updated = self.__rate(standings)
+            for id, rating in updated.items():
+                old = self.__ratings.get(id)
+                if old is not None:
+                    self.__index.remove((-old, id))
+                self.__index.insert((-rating, id))
+                self.__ratings[id] = rating
+                self.__games[id] = self.__games.get(id, 0) + 1
+            if updated:
+                self.games_rated += 1
+            return updated
+
+    def on_game(self, result):
+        'Finish listener, see Game.add_finish_listener'
+        self.update(result.standings)
+
+    def attach(self, game):
+        game.add_finish_listener(self.on_game)
+        return game
+
+    def rank(self, player_id):
+        '1-based rank, None for players without a rated game'
+        with self.__lock:
+            rating = self.__ratings.get(player_id)
+            if rating is None:
+                return None
+            return self.__index.rank((-rating, player_id)) + 1
+
+    def top(self, n=10, start=0):
+        '[(id, rating)] of the ranks start + 1 to start + n'
+        with self.__lock:
+            return [(id, -rating) for rating, id in self.__index.slice(start, n)]
+
+    def rebuild(self, store, since=None):
+        '''
+        Reset and replay every game of a ResultStore in time order.
+        Ratings are computed first and the index is built once at the end.
+        '''
+        sql = (
+            'SELECT g.game_id, g.round, s.player, s.score FROM games g JOIN standings s USING (game_id, round) '
+            'WHERE g.time >= ? ORDER BY g.time, g.game_id, g.round, s.place'
+        )
+        with self.__lock:
+            self.__ratings = {}
+            self.__games = {}
+            self.games_rated = 0
+            with closing(store.connect()) as db:
+                rows = db.execute(sql, (since if since else 0,))
+                for _, game in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+                    updated = self.__rate([(row[2], row[3]) for row in game])
+                    self.__ratings.update(updated)
+                    for id in updated:
+                        self.__games[id] = self.__games.get(id, 0) + 1
+                    if updated:
+                        self.games_rated += 1
+            self.__index = OrderedIndex()
+            for key in sorted((-rating, id) for id, rating in self.__ratings.items()):
+                self.__index.insert(key)
+        return self
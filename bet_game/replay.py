@@ -0,0 +1,82 @@
+from .journal import read_journal
+from .logger import quiet_logger
+from .rules import RuleSet
+from .utils import GameplayError
+
+class ReplayResult:
+    __slots__ = ('rules', 'winner', 'standings', 'finished', 'errors')
+
+    def __init__(self, rules, winner, standings, finished, errors):
+        self.rules = rules
+        self.winner = winner
+        self.standings = standings # ((id, score), ...) best first
+        self.finished = finished
+        self.errors = errors # recorded commands the rule set made invalid
+
+    def __str__(self):
+        return f'[{self.rules}] winner: {self.winner} ' + ', '.join(f'{id} ({score})' for id, score in self.standings)
+
+
+class ReplayEngine:
+    '''
+    Re-runs recorded games (journal records) under other RuleSets.
+    Logging, journaling, card policies and song play counts are off: the
+    recorded commands, including card decisions, drive the game and the
+    counter-based RNG reproduces every event, quest and card draw. Snapshot
+    records are skipped, they hold results settled under the recorded rules.
+    '''
+    def __init__(self, game_factory=None):
+        if game_factory is None:
+            from .game import Game
+            game_factory = Game
+        self.game_factory = game_factory
+        self.__logger = quiet_logger()
+
+    @staticmethod
+    def load(path):
+        'Journal records of one game, load once and replay under many rule sets'
+        return [record for record in read_journal(path) if record[0] != 'snapshot']
+
+    def replay(self, records, rules:RuleSet=None) -> ReplayResult:
+        rules = rules if rules else RuleSet()
+        game = None
+        errors = 0
+        for op, args, kwargs in records:
+            if op == 'create':
+                # the recorded rules name is replaced by the rule set under test
+                kwargs = {key: value for key, value in kwargs.items() if key != 'rules'}
+                game = self.game_factory(*args, **kwargs, logger=self.__logger, rules=rules, record_plays=False)
+            elif op == 'snapshot':
+                continue
+            elif game is None:
+                raise GameplayError('Recorded game has no create record')
+            else:
+                try:
+                    getattr(game, op)(*args, **kwargs)
+                except GameplayError:
+                    # e.g. a card the player can no longer afford under a higher cost
+                    errors += 1
+        if game is None:
+            raise GameplayError('Recorded game has no create record')
+        standings = tuple((player.id, player.score) for player in game.standings.players)
+        return ReplayResult(rules, game.winner, standings, game.finished, errors)
+
+    def replay_many(self, games, rules:RuleSet=None):
+        'games: iterable of record lists (see load), yields one ReplayResult each'
+        for records in games:
+            yield self.replay(records, rules)
+
+    def compare(self, games, baseline:RuleSet, alternative:RuleSet):
+        '''
+        Replays every game under both rule sets.
+        Returns (changed, total), changed lists the pairs of results whose winner differs.
+        '''
+        changed = []
+        total = 0
+        for records in games:
+            a = self.replay(records, baseline)
+            b = self.replay(records, alternative)
+            total += 1
+            if a.winner != b.winner:
+                changed.append((a, b))
+        return changed, total
@@ -0,0 +1,57 @@
+import time
+
+class PlayerTurnResult:
+    # Player fields of a settled turn, plus the score at the start of the turn
+    FIELDS = (
+        'start_score', 'playing_score', 'rank', 'cur_pt', 'bet_id', 'stake', 'betted',
+        'bet_reward', 'card_spent', 'card_reward', 'score'
+    )
+    __slots__ = ('id',) + FIELDS
+
+    def __init__(self, player, start_score=None):
+        self.id = player.id
+        self.start_score = start_score
+        self.playing_score = player.playing_score
+        self.rank = player.rank
+        self.cur_pt = player.cur_pt
+        self.bet_id = player.bet_id
+        self.stake = player.stake
+        self.betted = player.betted
+        self.bet_reward = player.bet_reward
+        self.card_spent = player.card_spent
+        self.card_reward = player.card_reward
+        self.score = player.score
+
+
+class TurnResult:
+    __slots__ = (
+        'game_id', 'round', 'turn', 'time',
+        'quest', 'song_id', 'level', 'difficulty',
+        'event', 'card', 'card_user', 'players'
+    )
+
+    def __init__(self, game_id, round, turn, quest, event, card, card_user, players):
+        self.game_id = game_id
+        self.round = round
+        self.turn = turn
+        self.time = time.time()
+        self.quest = quest.description
+        self.song_id = getattr(quest, 'song_id', '')
+        self.level = getattr(quest, 'level', None)
+        self.difficulty = getattr(quest, 'difficulty', '')
+        self.event = event # event name, None without event
+        self.card = card # name of the used card, None if no card was used
+        self.card_user = card_user
+        self.players = players # [PlayerTurnResult]
+
+
+class GameResult:
+    __slots__ = ('game_id', 'round', 'time', 'turns', 'winner', 'standings')
+
+    def __init__(self, game_id, round, turns, winner, standings):
+        self.game_id = game_id
+        self.round = round
+        self.time = time.time()
+        self.turns = turns
+        self.winner = winner
+        self.standings = standings # ((id, score), ...) best first
@@ -0,0 +1,114 @@
+import random
+import zlib
+
+# draw purposes, every purpose gets an independent stream per turn
+PURPOSE_EVENT = 'event'
+PURPOSE_QUEST = 'quest'
+PURPOSE_CARD = 'card'
+PURPOSE_CARD_EFFECT = 'card_effect'
+
+_MASK32 = 0xFFFFFFFF
+_PHILOX_M0 = 0xD2511F53
+_PHILOX_M1 = 0xCD9E8D57
+_PHILOX_W0 = 0x9E3779B9
+_PHILOX_W1 = 0xBB67AE85
+
+
+def philox4x32(counter, key, rounds=10):
+    'Philox4x32 block function: (4 x uint32 counter, 2 x uint32 key) -> 4 x uint32'
+    c0, c1, c2, c3 = counter
+    k0, k1 = key
+    for _ in range(rounds):
+        p0 = _PHILOX_M0 * c0
+        p1 = _PHILOX_M1 * c2
+        c0, c1, c2, c3 = (
+            (p1 >> 32) ^ c1 ^ k0,
+            p1 & _MASK32,
+            (p0 >> 32) ^ c3 ^ k1,
+            p0 & _MASK32
+        )
+        k0 = (k0 + _PHILOX_W0) & _MASK32
+        k1 = (k1 + _PHILOX_W1) & _MASK32
+    return c0, c1, c2, c3
+
+
+def purpose_id(purpose:str):
+    return zlib.crc32(purpose.encode('utf8')) & _MASK32
+
+
+class DrawStream:
+    '''
+    Random numbers of one (round, turn, purpose).
+    Has the same random()/randint()/choice() interface as the random module,
+    so it can be passed anywhere the module was used before.
+    '''
+    def __init__(self, key, turn, round, purpose):
+        self.__key = key
+        self.__turn = turn & _MASK32
+        self.__round = round & _MASK32
+        self.__purpose = purpose_id(purpose)
+        self.__block = 0
+        self.__buffer = []
+
+    def next_uint32(self):
+        if not self.__buffer:
+            words = philox4x32((self.__block, self.__turn, self.__round, self.__purpose), self.__key)
+            self.__buffer = list(reversed(words))
+            self.__block += 1
+        return self.__buffer.pop()
+
+    def state(self):
+        'Position in the stream: [blocks generated, words left of the last block]'
+        return [self.__block, len(self.__buffer)]
+
+    def load_state(self, state):
+        block, buffered = state
+        self.__block = block
+        self.__buffer = []
+        if block and buffered:
+            words = philox4x32((block - 1, self.__turn, self.__round, self.__purpose), self.__key)
+            self.__buffer = list(reversed(words))[:buffered]
+
+    def getrandbits(self, k):
+        value = 0
+        bits = 0
+        while bits < k:
+            value = (value << 32) | self.next_uint32()
+            bits += 32
+        return value >> (bits - k)
+
+    def random(self):
+        a = self.next_uint32() >> 5
+        b = self.next_uint32() >> 6
+        return (a * 67108864.0 + b) * (1.0 / 9007199254740992.0)
+
+    def randbelow(self, n):
+        k = n.bit_length()
+        r = self.getrandbits(k)
+        while r >= n:
+            r = self.getrandbits(k)
+        return r
+
+    def randint(self, a, b):
+        return a + self.randbelow(b - a + 1)
+
+    def choice(self, seq):
+        if not len(seq):
+            raise IndexError('Cannot choose from an empty sequence')
+        return seq[self.randbelow(len(seq))]
+
+
+class CounterRNG:
+    '''
+    Counter-based generator keyed by the game seed.
+    The draws of any (round, turn, purpose) are recomputed directly by
+    stream(), without replaying the random calls before them.
+    '''
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.__key = (seed & _MASK32, (seed >> 32) & _MASK32)
+
+    def stream(self, turn, purpose, round=0) -> DrawStream:
+        return DrawStream(self.__key, turn, round, purpose)
@@ -0,0 +1,466 @@
+import asyncio
+import hashlib
+import ipaddress
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from bisect import bisect
+from multiprocessing.connection import Client, Listener
+from .game import Game
+from .host import GameHost
+from .logger import quiet_logger
+from .scoreboard import ScoreboardWriter
+from .utils import GameplayError
+
+# Game constructor arguments saved in the snapshot, the others are runtime options
+CONFIG_KEYS = frozenset(('game_type', 'turns', 'random_p', 'random_card', 'seed', 'game_id'))
+# read-only Game members a router client may ask for besides GameHost.COMMANDS
+QUERIES = frozenset(('standings', 'status', 'seed', 'game_id', 'complete_player', 'complete_song', 'memory_usage', 'view', 'render'))
+
+
+def _hash(key:str):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    '''
+    Consistent hashing: every node owns replicas points on a 64 bit ring
+    and a key belongs to the first point after its hash. Adding or removing
+    a node only moves the keys of the ring arcs that node gains or loses.
+    '''
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.__points = [] # sorted hashes
+        self.__owners = [] # node of each point
+        self.__nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def __contains__(self, node):
+        return node in self.__nodes
+
+    @property
+    def nodes(self):
+        return frozenset(self.__nodes)
+
+    def add(self, node:str):
+        if node in self.__nodes:
+            raise ValueError(f'Duplicate node: {node}')
+        self.__nodes.add(node)
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            index = bisect(self.__points, point)
+            self.__points.insert(index, point)
+            self.__owners.insert(index, node)
+
+    def remove(self, node:str):
+        self.__nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self.__points, self.__owners) if owner != node]
+        self.__points = [point for point, _ in kept]
+        self.__owners = [owner for _, owner in kept]
+
+    def node(self, key:str):
+        if not self.__points:
+            raise GameplayError('No worker available')
+        return self.__owners[bisect(self.__points, _hash(key)) % len(self.__points)]
+
+
+# worker side
+def _handle(tables:dict, game_class, scoreboard, message):
+    op = message[0]
+    if op == 'call':
+        _, table_id, command, args, kwargs = message
+        game = tables.get(table_id)
+        if game is None:
+            raise GameplayError(f'Invalid table id: {table_id}')
+        if command in GameHost.COMMANDS:
+            return getattr(game, command)(*args, **kwargs)
+        if command in QUERIES:
+            member = getattr(game, command)
+            return member(*args, **kwargs) if callable(member) else member
+        raise GameplayError(f'Invalid command: {command}')
+    if op == 'open':
+        _, table_id, kwargs = message
+        if table_id in tables:
+            raise GameplayError(f'Duplicate table id: {table_id}')
+        game = game_class(**{'logger': quiet_logger(), **kwargs})
+        if scoreboard is not None:
+            scoreboard.attach(game, table_id)
+        tables[table_id] = game
+        return None
+    if op == 'export':
+        # the table leaves this worker, see Router.migrate
+        if scoreboard is not None:
+            scoreboard.remove(message[1])
+        return tables.pop(message[1]).snapshot()
+    if op == 'import':
+        _, table_id, snapshot, kwargs = message
+        game = game_class.restore(snapshot, **{'logger': quiet_logger(), **kwargs})
+        if scoreboard is not None:
+            scoreboard.attach(game, table_id)
+        tables[table_id] = game
+        return None
+    if op == 'close':
+        tables.pop(message[1], None)
+        if scoreboard is not None:
+            scoreboard.remove(message[1])
+        return None
+    if op == 'ping':
+        return {
+            'pid': os.getpid(), 'tables': len(tables), 'time': time.time(),
+            'scoreboard': scoreboard.name if scoreboard is not None else None
+        }
+    raise GameplayError(f'Invalid worker request: {op}')
+
+
+def serve_connection(conn, game_class=Game, scoreboard=None):
+    '''
+    Answer router requests on one connection until 'stop' or EOF.
+    Requests are (request id, message) and are answered in order with
+    (request id, ok, result or exception).
+    With scoreboard (ScoreboardWriter kwargs) the standings of the tables
+    are published to a shared memory segment named in the ping answer.
+    '''
+    scoreboard = ScoreboardWriter(**scoreboard) if scoreboard is not None else None
+    try:
+        _serve(conn, game_class, scoreboard)
+    finally:
+        if scoreboard is not None:
+            scoreboard.close()
+
+
+def _serve(conn, game_class, scoreboard):
+    tables = {}
+    processed = 0
+    while True:
+        try:
+            request_id, message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'stop':
+            conn.send((request_id, True, None))
+            return
+        try:
+            result = (True, _handle(tables, game_class, scoreboard, message))
+            if message[0] == 'ping':
+                result[1]['processed'] = processed
+        except Exception as e:
+            result = (False, e)
+        processed += 1
+        try:
+            conn.send((request_id,) + result)
+        except Exception as e:
+            # an unpicklable result or exception
+            conn.send((request_id, False, GameplayError(f'{type(e).__name__}: {e}')))
+
+
+def _loopback(address):
+    'True for a (host, port) on this machine only, or a unix socket / named pipe path'
+    if not isinstance(address, tuple):
+        return True
+    host = address[0]
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve_worker(address, authkey=None, game_class=Game, scoreboard=None):
+    '''
+    Run a worker for routers on other machines, one router connection at a time.
+    Connections exchange pickles, so anyone who can connect can run code in
+    the worker: an authkey is required unless address is loopback only, and
+    the address should still be reachable from trusted hosts only.
+    '''
+    if not authkey and not _loopback(address):
+        raise GameplayError(f'serve_worker on {address} needs an authkey')
+    with Listener(address, authkey=authkey) as listener:
+        while True:
+            with listener.accept() as conn:
+                serve_connection(conn, game_class, scoreboard)
+
+
+# router side
+class WorkerLink:
+    '''
+    Pipelined requests to one worker. Requests are sent right away, a
+    reader thread resolves their futures, so many commands of many tables
+    are in flight at once while the worker answers them in order.
+    '''
+    def __init__(self, worker_id, conn, process=None):
+        self.id = worker_id
+        self.conn = conn
+        self.process = process
+        self.scoreboard = None # shared memory segment of the worker's standings
+        self.alive = True
+        self.__ids = itertools.count()
+        self.__pending = {} # request id -> future
+        self.__send_lock = threading.Lock()
+        self.__reader = threading.Thread(target=self.__read, name=f'bet_game-router-{worker_id}', daemon=True)
+        self.__reader.start()
+
+    def __read(self):
+        while True:
+            try:
+                request_id, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self.__pending.pop(request_id, None)
+            if future is not None:
+                future.get_loop().call_soon_threadsafe(_resolve, future, ok, result)
+        self.alive = False
+        error = GameplayError(f'Worker {self.id} is down')
+        for request_id in list(self.__pending):
+            future = self.__pending.pop(request_id, None)
+            if future is not None:
+                future.get_loop().call_soon_threadsafe(_resolve, future, False, error)
+
+    def request(self, message) -> asyncio.Future:
+        'Send message now, the returned future holds the answer'
+        future = asyncio.get_running_loop().create_future()
+        if not self.alive:
+            future.set_exception(GameplayError(f'Worker {self.id} is down'))
+            return future
+        request_id = next(self.__ids)
+        self.__pending[request_id] = future
+        try:
+            with self.__send_lock:
+                self.conn.send((request_id, message))
+        except (OSError, ValueError) as e:
+            self.__pending.pop(request_id, None)
+            self.alive = False
+            future.set_exception(GameplayError(f'Worker {self.id} is down: {e}'))
+        except Exception as e:
+            # nothing was written, e.g. an unpicklable argument
+            self.__pending.pop(request_id, None)
+            future.set_exception(GameplayError(f'Cannot send to worker {self.id}: {e}'))
+        return future
+
+    @property
+    def in_flight(self):
+        return len(self.__pending)
+
+    async def stop(self, timeout=5.0):
+        if self.alive:
+            try:
+                await asyncio.wait_for(self.request(('stop',)), timeout)
+            except (asyncio.TimeoutError, GameplayError):
+                pass
+        self.conn.close()
+        if self.process is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.process.join, timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+
+
+def _resolve(future:asyncio.Future, ok, result):
+    if future.done():
+        return
+    if ok:
+        future.set_result(result)
+    else:
+        future.set_exception(result)
+
+
+class Router:
+    '''
+    Spreads tables over worker processes by consistent hashing of the
+    table id and forwards their commands over pipes. Tables are
+    independent, so throughput grows with the number of cores.
+    Adding or removing a worker migrates the tables whose owner changed
+    through Game.snapshot()/restore(), their commands wait meanwhile.
+    Workers on other machines (serve_worker) join with add_worker(address=..., authkey=...).
+    Table kwargs, command arguments and results must be picklable.
+    '''
+    def __init__(self, workers=None, game_class=Game, replicas=64, start_method='spawn', scoreboard=None):
+        self.game_class = game_class
+        # True or ScoreboardWriter kwargs: every worker publishes its standings, see scoreboards
+        self.scoreboard = {} if scoreboard is True else scoreboard
+        self.__initial = workers if workers is not None else (os.cpu_count() or 1)
+        self.__context = multiprocessing.get_context(start_method)
+        self.__ring = HashRing(replicas=replicas)
+        self.__workers = {}
+        self.__tables = {} # table id -> (worker id, runtime kwargs)
+        self.__moving = {} # table id -> asyncio.Event set when the migration is done
+        self.__worker_ids = itertools.count()
+
+    async def start(self):
+        await asyncio.gather(*(self.add_worker(migrate=False) for _ in range(self.__initial)))
+        return self
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def workers(self):
+        return dict(self.__workers)
+
+    @property
+    def tables(self):
+        return {table_id: worker_id for table_id, (worker_id, _) in self.__tables.items()}
+
+    @property
+    def scoreboards(self):
+        '{worker id: shared memory name} for scoreboard.ScoreboardReader'
+        return {worker_id: link.scoreboard for worker_id, link in self.__workers.items() if link.scoreboard}
+
+    def worker_of(self, table_id) -> str:
+        if table_id not in self.__tables:
+            raise GameplayError(f'Invalid table id: {table_id}')
+        return self.__tables[table_id][0]
+
+    # workers
+    async def add_worker(self, worker_id=None, address=None, authkey=None, migrate=True) -> str:
+        '''
+        Start a local worker process, or connect to serve_worker(address)
+        on another machine, and move the tables it now owns onto it.
+        '''
+        if worker_id is None:
+            worker_id = f'w{next(self.__worker_ids)}'
+        if worker_id in self.__workers:
+            raise GameplayError(f'Duplicate worker id: {worker_id}')
+        loop = asyncio.get_running_loop()
+        if address is None:
+            conn, child = self.__context.Pipe()
+            process = self.__context.Process(
+                target=serve_connection, args=(child, self.game_class, self.scoreboard), name=f'bet_game-worker-{worker_id}', daemon=True
+            )
+            await loop.run_in_executor(None, process.start)
+            child.close()
+        else:
+            conn = await loop.run_in_executor(None, lambda: Client(address, authkey=authkey))
+            process = None
+        link = self.__workers[worker_id] = WorkerLink(worker_id, conn, process)
+        link.scoreboard = (await link.request(('ping',)))['scoreboard']
+        self.__ring.add(worker_id)
+        if migrate:
+            await self.rebalance()
+        return worker_id
+
+    async def remove_worker(self, worker_id) -> list:
+        '''
+        Move the tables of a worker to the others and stop it.
+        Returns the ids of the tables lost because the worker was down.
+        '''
+        link = self.__workers.get(worker_id)
+        if link is None:
+            raise GameplayError(f'Invalid worker id: {worker_id}')
+        if len(self.__ring) == 1 and any(owner == worker_id for owner, _ in self.__tables.values()):
+            raise GameplayError('Cannot remove the last worker while it holds tables')
+        self.__ring.remove(worker_id)
+        lost = await self.rebalance()
+        del self.__workers[worker_id]
+        await link.stop()
+        return lost
+
+    async def rebalance(self) -> list:
+        'Migrate every table to its owner on the ring, returns the tables lost on dead workers'
+        moves = [
+            (table_id, self.__ring.node(table_id)) for table_id, (worker_id, _) in self.__tables.items()
+            if table_id not in self.__moving and self.__ring.node(table_id) != worker_id
+        ]
+        results = await asyncio.gather(*(self.migrate(table_id, target) for table_id, target in moves), return_exceptions=True)
+        lost = []
+        for (table_id, _), result in zip(moves, results):
+            if isinstance(result, Exception):
+                lost.append(table_id)
+        return lost
+
+    async def migrate(self, table_id, target):
+        'Move one table to worker target, its commands wait until the move is done'
+        source, kwargs = self.__tables[table_id]
+        if source == target:
+            return
+        done = self.__moving[table_id] = asyncio.Event()
+        try:
+            # queued behind the commands already sent, so the snapshot includes them
+            try:
+                snapshot = await self.__workers[source].request(('export', table_id))
+            except GameplayError:
+                if not self.__workers[source].alive:
+                    del self.__tables[table_id]
+                raise
+            try:
+                await self.__workers[target].request(('import', table_id, snapshot, kwargs))
+            except GameplayError:
+                # put the table back where it was
+                try:
+                    await self.__workers[source].request(('import', table_id, snapshot, kwargs))
+                except GameplayError:
+                    del self.__tables[table_id]
+                raise
+            self.__tables[table_id] = (target, kwargs)
+        finally:
+            del self.__moving[table_id]
+            done.set()
+
+    async def health(self, timeout=1.0) -> dict:
+        '''
+        Ping every worker: {worker id: {alive, pid, tables, processed, in_flight, latency}}.
+        A worker that does not answer within timeout is reported dead.
+        '''
+        async def ping(link:WorkerLink):
+            start = time.perf_counter()
+            try:
+                info = await asyncio.wait_for(link.request(('ping',)), timeout)
+            except (asyncio.TimeoutError, GameplayError):
+                return {'alive': False, 'in_flight': link.in_flight}
+            return {**info, 'alive': True, 'in_flight': link.in_flight, 'latency': time.perf_counter() - start}
+        links = list(self.__workers.values())
+        return dict(zip((link.id for link in links), await asyncio.gather(*map(ping, links))))
+
+    # tables
+    async def open_table(self, table_id, **kwargs):
+        'Create a table on its owner worker, kwargs are Game arguments'
+        if table_id in self.__tables:
+            raise GameplayError(f'Duplicate table id: {table_id}')
+        worker_id = self.__ring.node(table_id)
+        self.__tables[table_id] = (worker_id, {key: value for key, value in kwargs.items() if key not in CONFIG_KEYS})
+        try:
+            await self.__workers[worker_id].request(('open', table_id, kwargs))
+        except Exception:
+            del self.__tables[table_id]
+            raise
+
+    async def close_table(self, table_id):
+        await self.__wait_moving(table_id)
+        worker_id = self.worker_of(table_id)
+        del self.__tables[table_id]
+        await self.__workers[worker_id].request(('close', table_id))
+
+    async def __wait_moving(self, table_id):
+        while table_id in self.__moving:
+            await self.__moving[table_id].wait()
+
+    async def submit(self, table_id, command, *args, **kwargs):
+        'Forward a command to the worker of the table and return its result'
+        if table_id in self.__moving:
+            await self.__wait_moving(table_id)
+        return await self.__workers[self.worker_of(table_id)].request(('call', table_id, command, args, kwargs))
+
+    async def dispatch(self, message:dict):
+        'message: {"table": id, "command": name, "args": [...], "kwargs": {...}}, as GameHost.dispatch'
+        return await self.submit(
+            message['table'],
+            message['command'],
+            *message.get('args', ()),
+            **message.get('kwargs', {})
+        )
+
+    async def close(self):
+        links = list(self.__workers.values())
+        self.__workers.clear()
+        self.__tables.clear()
+        for worker_id in list(self.__ring.nodes):
+            self.__ring.remove(worker_id)
+        await asyncio.gather(*(link.stop() for link in links))
@@ -0,0 +1,26 @@
+from math import floor
+
+class RuleSet:
+    '''
+    Tunable settlement rules. Like CardInstance, every rule is a function
+    that can be replaced in the constructor, e.g.
+    RuleSet('cap3', stake_cap=lambda stake, player_num: max(min(stake, 3), 1))
+    '''
+    def __init__(
+        self,
+        name='default',
+        stake_cap=0,
+        card_cost=0
+    ):
+        self.name = name
+        self.stake_cap = stake_cap if stake_cap else self.default_stake_cap
+        self.card_cost = card_cost if card_cost else self.default_card_cost
+
+    def default_stake_cap(self, stake, player_num):
+        return max(min(stake, player_num), 1)
+
+    def default_card_cost(self, player_num):
+        return floor(player_num/2)
+
+    def __str__(self):
+        return self.name
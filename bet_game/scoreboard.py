@@ -0,0 +1,222 @@
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+from .game import Game, Standing, PHASES
+from .utils import GameplayError
+
+MAGIC = b'BETS'
+LAYOUT_VERSION = 1
+_HEADER = struct.Struct('<4sIIII12x') # magic, layout version, slots, max players, id bytes
+_SEQ = struct.Struct('<Q')
+
+
+def _key(table_id, id_bytes):
+    'table id as stored in a slot'
+    return table_id.encode('utf8')[:id_bytes].decode('utf8', 'ignore')
+
+
+# before Python 3.13 every opened segment is registered for unlinking at exit
+_UNTRACKED_READERS = 'track' not in shared_memory.SharedMemory.__init__.__code__.co_varnames
+
+def _attach(name):
+    # readers must not unlink the writer's segment when they exit
+    if not _UNTRACKED_READERS:
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+ScoreboardEntry = namedtuple('ScoreboardEntry', ['table', 'version', 'status', 'phase', 'turns', 'turn', 'players', 'player_count'])
+
+
+class _Layout:
+    '''
+    Fixed layout of a scoreboard segment: a header, then slots of
+    seq, standings version, table id, status, turns left, turn, player count
+    followed by max_players (id, score) rows, best first.
+    '''
+    def __init__(self, slots, max_players, id_bytes):
+        self.slots = slots
+        self.max_players = max_players
+        self.id_bytes = id_bytes
+        self.head = struct.Struct(f'<QQ{id_bytes}siiiI')
+        self.player = struct.Struct(f'<{id_bytes}sq')
+        size = self.head.size + max_players * self.player.size
+        self.slot_size = (size + 7) & ~7 # seq stays 8-byte aligned
+        self.size = _HEADER.size + slots * self.slot_size
+
+    def offset(self, slot):
+        return _HEADER.size + slot * self.slot_size
+
+
+class ScoreboardWriter:
+    '''
+    Publishes table standings into a named shared memory segment that
+    any local process can read with ScoreboardReader, without asking the
+    game process. Each table owns one slot guarded by a seqlock: seq is
+    odd while the slot is written, readers retry until they see the same
+    even seq before and after their read. Only one process writes a segment.
+    Player ids are cut to id_bytes and only the best max_players are kept.
+    '''
+    def __init__(self, name=None, slots=256, max_players=64, id_bytes=32):
+        self.layout = _Layout(slots, max_players, id_bytes)
+        self.__shm = shared_memory.SharedMemory(name=name, create=True, size=self.layout.size)
+        self.name = self.__shm.name
+        self.__buf = self.__shm.buf
+        _HEADER.pack_into(self.__buf, 0, MAGIC, LAYOUT_VERSION, slots, max_players, id_bytes)
+        self.__slots = {} # table id -> slot
+        self.__free = list(range(slots - 1, -1, -1))
+        self.__games = {} # table id -> (game, listener)
+
+    def __encode(self, table_id):
+        return table_id.encode('utf8')[:self.layout.id_bytes]
+
+    def __write(self, slot, table_id, version, status, turns, turn, players):
+        layout = self.layout
+        buf = self.__buf
+        offset = layout.offset(slot)
+        seq = _SEQ.unpack_from(buf, offset)[0]
+        _SEQ.pack_into(buf, offset, seq + 1)
+        shown = players[:layout.max_players]
+        layout.head.pack_into(
+            buf, offset, seq + 1, version, self.__encode(table_id),
+            status, turns, turn, len(players)
+        )
+        row = offset + layout.head.size
+        for player in shown:
+            layout.player.pack_into(buf, row, self.__encode(player.id), player.score)
+            row += layout.player.size
+        _SEQ.pack_into(buf, offset, seq + 2)
+
+    def publish(self, table_id, standings):
+        'Write the StandingsSnapshot of a table into its slot'
+        slot = self.__slots.get(table_id)
+        if slot is None:
+            if not self.__free:
+                raise GameplayError(f'Scoreboard {self.name} is full')
+            slot = self.__slots[table_id] = self.__free.pop()
+        self.__write(slot, table_id, standings.version, standings.status, standings.turns, standings.turn, standings.players)
+
+    def attach(self, game:Game, table_id=None):
+        'Publish the standings of game now and on every change, under table_id (default game_id)'
+        table_id = table_id if table_id is not None else game.game_id
+        # claims the slot first, a full scoreboard leaves the game untouched
+        self.publish(table_id, game.standings)
+        listener = lambda standings: self.publish(table_id, standings)
+        game.add_standings_listener(listener)
+        self.__games[table_id] = (game, listener)
+        return game
+
+    def remove(self, table_id):
+        'Stop publishing a table and free its slot'
+        game, listener = self.__games.pop(table_id, (None, None))
+        if game is not None:
+            game.remove_listener(listener)
+        slot = self.__slots.pop(table_id, None)
+        if slot is not None:
+            self.__write(slot, '', 0, 0, 0, 0, ())
+            self.__free.append(slot)
+
+    @property
+    def tables(self):
+        return list(self.__slots)
+
+    def close(self, unlink=True):
+        for table_id in list(self.__games):
+            self.remove(table_id)
+        self.__buf = None
+        self.__shm.close()
+        if unlink:
+            if _UNTRACKED_READERS:
+                # a reader sharing our resource tracker may have unregistered the segment
+                resource_tracker.register(self.__shm._name, 'shared_memory')
+            self.__shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScoreboardReader:
+    '''
+    Reads a segment published by ScoreboardWriter. Every read decodes one
+    slot straight from the shared buffer and returns a consistent entry.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.__shm = _attach(name)
+        self.__buf = self.__shm.buf
+        magic, version, slots, max_players, id_bytes = _HEADER.unpack_from(self.__buf, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            raise GameplayError(f'{name} is not a version {LAYOUT_VERSION} scoreboard')
+        self.layout = _Layout(slots, max_players, id_bytes)
+        self.__slots = {} # table id -> slot, checked on every read
+
+    def __read(self, slot, spin=1000):
+        layout = self.layout
+        buf = self.__buf
+        offset = layout.offset(slot)
+        for attempt in range(spin):
+            seq = _SEQ.unpack_from(buf, offset)[0]
+            if seq & 1:
+                if attempt > 16:
+                    time.sleep(0)
+                continue
+            _, version, table_id, status, turns, turn, count = layout.head.unpack_from(buf, offset)
+            rows = []
+            row = offset + layout.head.size
+            for _ in range(min(count, layout.max_players)):
+                id, score = layout.player.unpack_from(buf, row)
+                rows.append((id, score))
+                row += layout.player.size
+            if _SEQ.unpack_from(buf, offset)[0] == seq:
+                table_id = table_id.rstrip(b'\0').decode('utf8', 'ignore')
+                players = tuple(Standing(id.rstrip(b'\0').decode('utf8', 'replace'), score) for id, score in rows)
+                return ScoreboardEntry(table_id, version, status, PHASES.get(status), turns, turn, players, count)
+        raise GameplayError(f'Scoreboard slot {slot} of {self.name} is busy')
+
+    def __scan(self):
+        self.__slots = {}
+        id_start = _SEQ.size * 2
+        end = id_start + self.layout.id_bytes
+        for slot in range(self.layout.slots):
+            offset = self.layout.offset(slot)
+            raw = bytes(self.__buf[offset + id_start:offset + end]).rstrip(b'\0')
+            if raw:
+                self.__slots[raw.decode('utf8', 'ignore')] = slot
+
+    def read(self, table_id) -> ScoreboardEntry:
+        'Standings of one table, None if it is not published'
+        key = _key(table_id, self.layout.id_bytes)
+        for rescan in (False, True):
+            if rescan:
+                self.__scan()
+            slot = self.__slots.get(key)
+            if slot is not None:
+                entry = self.__read(slot)
+                if entry.table == key:
+                    return entry
+        return None
+
+    def tables(self):
+        self.__scan()
+        return list(self.__slots)
+
+    def read_all(self):
+        'Entries of every published table'
+        entries = [self.__read(slot) for slot in range(self.layout.slots)]
+        return [entry for entry in entries if entry.table]
+
+    def close(self):
+        self.__buf = None
+        self.__shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
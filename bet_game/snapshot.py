@@ -0,0 +1,12 @@
+import json
+
+def dumps(snapshot:dict) -> bytes:
+    return json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+def loads(data) -> dict:
+    return json.loads(data)
+
+def restore(data, **kwargs):
+    'Game from dumps(game.snapshot()) bytes, kwargs are passed to Game.restore'
+    from .game import Game
+    return Game.restore(loads(data), **kwargs)
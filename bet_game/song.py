@@ -1,7 +1,39 @@
 from .parser import get_arcaea_info, set_arcaea_quest
 from .parser import get_phigros_info, set_phigros_quest
 from .utils import GameplayError
+from .complete import Autocomplete
 import copy
+import threading
+
+QUEST_CACHE_SIZE = 256
+_quest_list_cache = {}
+_quest_cache_hits = 0
+_quest_cache_misses = 0
+
+
+def quest_cache_info():
+    return {'hits': _quest_cache_hits, 'misses': _quest_cache_misses, 'size': len(_quest_list_cache)}
+
+def clear_quest_cache():
+    global _quest_cache_hits, _quest_cache_misses
+    _quest_list_cache.clear()
+    _quest_cache_hits = 0
+    _quest_cache_misses = 0
+
+# song title completion, one per catalogue and process, ranked by how often the songs were played
+SONG_COMPLETION_SIZE = 8
+_song_completers = {}
+_song_completers_lock = threading.Lock()
+
+
+def song_completer(catalogue:str, songs) -> Autocomplete:
+    with _song_completers_lock:
+        completer = _song_completers.get(catalogue)
+        if completer is None:
+            completer = Autocomplete(SONG_COMPLETION_SIZE, normalize=str.casefold)
+            completer.update((title, 0) for title in {song['name'] for song in songs})
+            _song_completers[catalogue] = completer
+        return completer
 
 class SongPackageManager:
     def __init__(self):
@@ -12,9 +44,9 @@ class SongPackageManager:
         self._packages_enabled = set()
         self._difficulties_enabled = set()
 
-        self._songs_cache = None
-        self._levels_cache = None
+        self._quest_args = [] # add_quest args since the last package/difficulty change
         self.set_quest_list = None
+        self._catalogue = None
 
     @property
     def available_packages(self):
@@ -26,23 +58,19 @@ class SongPackageManager:
 
     def enable_all_packages(self):
         self._packages_enabled = copy.deepcopy(self._packages)
-        self._levels_cache = None
-        self._songs_cache = None
+        self._quest_args = []
 
     def disable_all_packages(self):
         self._packages_enabled = set()
-        self._levels_cache = None
-        self._songs_cache = None
+        self._quest_args = []
 
     def enable_all_difficulties(self):
         self._difficulties_enabled = copy.deepcopy(self._difficulties)
-        self._levels_cache = None
-        self._songs_cache = None
+        self._quest_args = []
 
     def disable_all_difficulties(self):
         self._difficulties_enabled = set()
-        self._levels_cache = None
-        self._songs_cache = None
+        self._quest_args = []
 
     def enable(self, s:str):
         if s.lower() in self._packages:
@@ -51,8 +79,7 @@ class SongPackageManager:
             self._difficulties_enabled.add(s.lower())
         else:
             raise GameplayError(f'Invalid package or difficulty name {s} to enable')
-        self._levels_cache = None
-        self._songs_cache = None
+        self._quest_args = []
 
     def disable(self, s:str):
         if s.lower() in self._packages:
@@ -61,25 +88,68 @@ class SongPackageManager:
             self._difficulties_enabled.remove(s.lower())
         else:
             raise GameplayError(f'Invalid package or difficulty name {s} to disable')
-        self._levels_cache = None
-        self._songs_cache = None
+        self._quest_args = []
 
     def add_quest_list(self, args:list):
-        if not self._levels_cache is None:
-            # song cache and level cache are synchronous
-            songs = self._songs_cache
-            levels = self._levels_cache
-        else:
+        quest_args = self._quest_args + [tuple(args)]
+        quests = self.build_quest_list(self._packages_enabled, self._difficulties_enabled, quest_args)
+        self._quest_args = quest_args
+        return quests
+
+    def build_quest_list(self, packages, difficulties, quest_args):
+        '''
+        Quests of the given packages/difficulties after applying every add_quest
+        args in order (level weights accumulate between calls).
+        Tables with the same settings share the result through _quest_list_cache.
+        '''
+        global _quest_cache_hits, _quest_cache_misses
+        key = (type(self).__name__, frozenset(packages), frozenset(difficulties), tuple(tuple(args) for args in quest_args))
+        quests = _quest_list_cache.get(key)
+        if quests is None:
+            _quest_cache_misses += 1
             songs = []
             levels = {}
             for song in self._songs:
-                if song['package'] in self._packages_enabled and song['difficulty'] in self._difficulties_enabled:
+                if song['package'] in packages and song['difficulty'] in difficulties:
                     songs.append(song)
-                    if song['level'] not in levels.keys():
-                        levels[song['level']] = 1.0
-            self._levels_cache = levels
-            self._songs_cache = songs
-        return self.set_quest_list(levels, songs, args)
+                    if self._level_key(song) not in levels.keys():
+                        levels[self._level_key(song)] = 1.0
+            quests = []
+            for args in quest_args:
+                quests = self.set_quest_list(levels, songs, list(args))
+            if len(_quest_list_cache) >= QUEST_CACHE_SIZE:
+                del _quest_list_cache[next(iter(_quest_list_cache))]
+            _quest_list_cache[key] = quests
+        else:
+            _quest_cache_hits += 1
+        # the quest pool removes redrawn quests, every table needs its own list
+        return list(quests)
+
+    def _level_key(self, song):
+        return song['level']
+
+    # title completion
+    @property
+    def completer(self) -> Autocomplete:
+        return song_completer(self._catalogue, self._songs)
+
+    def complete(self, prefix:str, k=5):
+        'Song titles starting with prefix (any case), most played first'
+        return self.completer.complete(prefix, k)
+
+    def record_play(self, quest):
+        if quest.title:
+            self.completer.add(quest.title)
+
+    # snapshot
+    def state(self):
+        return [sorted(self._packages_enabled), sorted(self._difficulties_enabled), [list(args) for args in self._quest_args]]
+
+    def load_state(self, state):
+        packages, difficulties, quest_args = state
+        self._packages_enabled = set(packages)
+        self._difficulties_enabled = set(difficulties)
+        self._quest_args = [tuple(args) for args in quest_args]
 
 
 class ArcaeaSongPackageManager(SongPackageManager):
@@ -88,6 +158,7 @@ class ArcaeaSongPackageManager(SongPackageManager):
         # package names and difficulty names should be lower
         self._songs, self._packages, self._difficulties = get_arcaea_info()
         self.set_quest_list = set_arcaea_quest
+        self._catalogue = 'arcaea'
 
 
 class PhigrosSongPackageManager(SongPackageManager):
@@ -96,20 +167,8 @@ class PhigrosSongPackageManager(SongPackageManager):
         # package names and difficulty names should be lower
         self._songs, self._packages, self._difficulties = get_phigros_info()
         self.set_quest_list = set_phigros_quest
+        self._catalogue = 'phigros'
 
-    def add_quest_list(self, args:list):
-        if not self._levels_cache is None:
-            # song cache and level cache are synchronous
-            songs = self._songs_cache
-            levels = self._levels_cache
-        else:
-            songs = []
-            levels = {}
-            for song in self._songs:
-                if song['package'] in self._packages_enabled and song['difficulty'] in self._difficulties_enabled:
-                    songs.append(song)
-                    if int(song['level']) not in levels.keys():
-                        levels[int(song['level'])] = 1.0
-            self._levels_cache = levels
-            self._songs_cache = songs
-        return self.set_quest_list(levels, songs, args)
\ No newline at end of file
+    def _level_key(self, song):
+        # phigros weights are set per integer level
+        return int(song['level'])
@@ -0,0 +1,248 @@
+import threading
+from .result import TurnResult
+
+class Moments:
+    'Count, mean, variance, min and max in O(1) memory (Welford, merged with Chan et al.)'
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def merge(self, other:'Moments'):
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return self.variance ** 0.5
+
+
+class QuantileSketch:
+    '''
+    KLL-style quantile sketch. Level h holds items of weight 2^h, a full level
+    is sorted and every other item is promoted, so memory stays O(k log(n/k))
+    and quantiles have a rank error of about 1/k. Sketches merge level by level.
+    '''
+    __slots__ = ('k', 'count', 'levels', 'flip')
+
+    def __init__(self, k=128):
+        self.k = k
+        self.count = 0
+        self.levels = [[]]
+        self.flip = 0 # alternates which half is promoted, keeps the error unbiased
+
+    def __capacity(self, level):
+        # top level holds k items, every level below 2/3 of the one above
+        return max(2, int(self.k * (2 / 3) ** (len(self.levels) - 1 - level)))
+
+    def add(self, x):
+        self.levels[0].append(x)
+        self.count += 1
+        if len(self.levels[0]) >= self.__capacity(0):
+            self.__compress()
+
+    def __compress(self):
+        for level in range(len(self.levels)):
+            items = self.levels[level]
+            if len(items) < self.__capacity(level):
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            items.sort()
+            odd = len(items) & 1
+            kept = [items.pop()] if odd else []
+            self.levels[level + 1].extend(items[self.flip::2])
+            self.flip ^= 1
+            self.levels[level] = kept
+
+    def merge(self, other:'QuantileSketch'):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        self.__compress()
+        return self
+
+    def __weighted(self):
+        items = sorted((x, 1 << level) for level, items in enumerate(self.levels) for x in items)
+        return items, sum(weight for _, weight in items)
+
+    def quantile(self, q):
+        'Approximate q-quantile, None while empty'
+        items, total = self.__weighted()
+        if not items:
+            return None
+        target = q * total
+        seen = 0
+        for x, weight in items:
+            seen += weight
+            if seen >= target:
+                return x
+        return items[-1][0]
+
+    def quantiles(self, qs):
+        return [self.quantile(q) for q in qs]
+
+    def rank(self, x):
+        'Approximate fraction of the added values below x'
+        items, total = self.__weighted()
+        if not total:
+            return 0.0
+        return sum(weight for value, weight in items if value < x) / total
+
+    def __len__(self):
+        return sum(len(items) for items in self.levels)
+
+
+class Summary:
+    'Moments and a quantile sketch of one value stream'
+    __slots__ = ('moments', 'sketch')
+
+    def __init__(self, k=128):
+        self.moments = Moments()
+        self.sketch = QuantileSketch(k)
+
+    def add(self, x):
+        self.moments.add(x)
+        self.sketch.add(x)
+
+    def merge(self, other:'Summary'):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    @property
+    def mean(self):
+        return self.moments.mean
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+
+class StatsAggregator:
+    '''
+    Live statistics of settled turns, fed by Game turn listeners.
+    Keeps a Summary of playing scores per chart (song_id, difficulty),
+    per player and per (player, level), plus counters of bets on the
+    leader at the start of the turn. Nothing is rescanned: every turn
+    result is folded in once, and aggregators of parallel workers merge().
+    '''
+    def __init__(self, k=128):
+        self.k = k
+        self.turns = 0
+        self.charts = {} # (song_id, difficulty) -> Summary
+        self.players = {} # player id -> Summary
+        self.player_levels = {} # (player id, level) -> Summary
+        self.leader_bets = 0
+        self.leader_bets_won = 0
+        self.bets = 0
+        self.bets_won = 0
+        self.__lock = threading.Lock()
+
+    def __summary(self, table, key):
+        summary = table.get(key)
+        if summary is None:
+            summary = table[key] = Summary(self.k)
+        return summary
+
+    def on_turn(self, result:TurnResult):
+        with self.__lock:
+            self.turns += 1
+            chart = self.__summary(self.charts, (result.song_id, result.difficulty))
+            starts = [player.start_score for player in result.players if player.start_score is not None]
+            top = max(starts) if starts else None
+            leaders = {player.id for player in result.players if top is not None and player.start_score == top}
+            for player in result.players:
+                if player.playing_score is not None:
+                    chart.add(player.playing_score)
+                    self.__summary(self.players, player.id).add(player.playing_score)
+                    self.__summary(self.player_levels, (player.id, result.level)).add(player.playing_score)
+                if player.bet_id:
+                    won = bool(player.bet_reward and player.bet_reward > 0)
+                    self.bets += 1
+                    self.bets_won += won
+                    if player.bet_id in leaders:
+                        self.leader_bets += 1
+                        self.leader_bets_won += won
+
+    def attach(self, game):
+        game.add_turn_listener(self.on_turn)
+        return game
+
+    def merge(self, other:'StatsAggregator'):
+        with self.__lock:
+            self.turns += other.turns
+            self.leader_bets += other.leader_bets
+            self.leader_bets_won += other.leader_bets_won
+            self.bets += other.bets
+            self.bets_won += other.bets_won
+            for table, others in ((self.charts, other.charts), (self.players, other.players), (self.player_levels, other.player_levels)):
+                for key, summary in others.items():
+                    self.__summary(table, key).merge(summary)
+        return self
+
+    # queries
+    def chart(self, song_id, difficulty) -> Summary:
+        return self.charts.get((song_id, difficulty))
+
+    def player(self, player_id) -> Summary:
+        return self.players.get(player_id)
+
+    def player_level(self, player_id, level) -> Summary:
+        return self.player_levels.get((player_id, level))
+
+    def percentiles(self, player_id, level=None, qs=(0.25, 0.5, 0.75, 0.9)):
+        summary = self.player(player_id) if level is None else self.player_level(player_id, level)
+        return summary.sketch.quantiles(qs) if summary else None
+
+    @property
+    def leader_bet_win_rate(self):
+        return self.leader_bets_won / self.leader_bets if self.leader_bets else None
+
+    @property
+    def bet_win_rate(self):
+        return self.bets_won / self.bets if self.bets else None
+
+    def __getstate__(self):
+        # the lock cannot be pickled, aggregators are shipped between processes to merge
+        state = self.__dict__.copy()
+        del state['_StatsAggregator__lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
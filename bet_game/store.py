@@ -0,0 +1,248 @@
+import queue
+import sqlite3
+import threading
+from contextlib import closing
+from .logger import default_logger, KIND_MESSAGE
+from .result import PlayerTurnResult, TurnResult, GameResult
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS turns (
+    game_id TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    turn INTEGER NOT NULL,
+    time REAL NOT NULL,
+    quest TEXT,
+    song_id TEXT,
+    level REAL,
+    difficulty TEXT,
+    event TEXT,
+    card TEXT,
+    card_user TEXT,
+    PRIMARY KEY (game_id, round, turn)
+);
+CREATE TABLE IF NOT EXISTS turn_players (
+    game_id TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    turn INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    start_score INTEGER,
+    playing_score INTEGER,
+    rank INTEGER,
+    cur_pt INTEGER,
+    bet_id TEXT,
+    stake INTEGER,
+    betted INTEGER,
+    bet_reward INTEGER,
+    card_spent INTEGER,
+    card_reward INTEGER,
+    score INTEGER,
+    PRIMARY KEY (game_id, round, turn, player)
+);
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    time REAL NOT NULL,
+    turns INTEGER,
+    winner TEXT,
+    PRIMARY KEY (game_id, round)
+);
+CREATE TABLE IF NOT EXISTS standings (
+    game_id TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    place INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    score INTEGER,
+    PRIMARY KEY (game_id, round, place)
+);
+CREATE INDEX IF NOT EXISTS turn_players_player ON turn_players (player);
+CREATE INDEX IF NOT EXISTS turns_song ON turns (song_id, difficulty);
+CREATE INDEX IF NOT EXISTS turns_time ON turns (time);
+CREATE INDEX IF NOT EXISTS games_time ON games (time);
+CREATE INDEX IF NOT EXISTS standings_player ON standings (player);
+'''
+
+_TURN_SQL = 'INSERT OR REPLACE INTO turns VALUES (?,?,?,?,?,?,?,?,?,?,?)'
+_TURN_PLAYER_SQL = 'INSERT OR REPLACE INTO turn_players VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'
+_GAME_SQL = 'INSERT OR REPLACE INTO games VALUES (?,?,?,?,?)'
+_STANDING_SQL = 'INSERT OR REPLACE INTO standings VALUES (?,?,?,?,?)'
+
+_CLOSE = object()
+
+
+class ResultStore:
+    '''
+    Durable turn and game results in SQLite.
+    Settlement only puts the result objects into a queue, a background writer
+    owns the connection and writes them in batches of up to batch_size
+    results per transaction, or whatever arrived within flush_interval seconds.
+    '''
+    def __init__(self, path, batch_size=256, flush_interval=0.2):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.batches = 0
+        self.error = None # first write error since the last flush()/close(), which raise it
+        self.failed = 0 # results skipped because they could not be written
+        self.__queue = queue.Queue()
+        self.__closed = False
+        db = self.connect()
+        db.executescript(SCHEMA)
+        db.close()
+        self.__writer = threading.Thread(target=self.__run_writer, daemon=True)
+        self.__writer.start()
+
+    def connect(self) -> sqlite3.Connection:
+        'A new connection for reading, WAL lets it read while the writer commits'
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    # producers
+    def submit_turn(self, result:TurnResult):
+        self.__queue.put(result)
+
+    def submit_game(self, result:GameResult):
+        self.__queue.put(result)
+
+    def attach(self, game):
+        'Record every turn and the final standings of game'
+        game.add_turn_listener(self.submit_turn)
+        game.add_finish_listener(self.submit_game)
+        return game
+
+    def detach(self, game):
+        game.remove_listener(self.submit_turn)
+        game.remove_listener(self.submit_game)
+
+    def flush(self):
+        'Block until every submitted result is handled, raise the first write error since the last flush'
+        self.__queue.join()
+        self.__raise_error()
+
+    def close(self):
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__queue.put(_CLOSE)
+        self.__writer.join()
+        self.__raise_error()
+
+    def __raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # writer
+    def __run_writer(self):
+        db = self.connect()
+        try:
+            while True:
+                batch = [self.__queue.get()]
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(self.__queue.get(timeout=self.flush_interval))
+                except queue.Empty:
+                    pass
+                stop = _CLOSE in batch
+                if stop:
+                    batch = [result for result in batch if result is not _CLOSE]
+                try:
+                    if batch:
+                        self.__write_batch(db, batch)
+                finally:
+                    for _ in range(len(batch) + stop):
+                        self.__queue.task_done()
+                if stop:
+                    return
+        finally:
+            db.close()
+
+    def __write_batch(self, db, batch):
+        if len(batch) > 1:
+            try:
+                self.__write(db, batch)
+                return
+            except Exception:
+                pass
+        # the transaction rolled back, write the results one by one to skip only the bad ones
+        for result in batch:
+            try:
+                self.__write(db, [result])
+            except Exception as e:
+                # e.g. an int sqlite cannot store
+                self.failed += 1
+                if self.error is None:
+                    self.error = e
+                default_logger.warning(KIND_MESSAGE, 'Result of game {} not stored: {!r}', result.game_id, e)
+
+    def __write(self, db, batch):
+        turns = []
+        turn_players = []
+        games = []
+        standings = []
+        for result in batch:
+            if isinstance(result, TurnResult):
+                key = (result.game_id, result.round, result.turn)
+                turns.append(key + (
+                    result.time, result.quest, result.song_id, result.level, result.difficulty,
+                    result.event, result.card, result.card_user
+                ))
+                for player in result.players:
+                    turn_players.append(key + (player.id,) + tuple(getattr(player, field) for field in PlayerTurnResult.FIELDS))
+            else:
+                games.append((result.game_id, result.round, result.time, result.turns, result.winner))
+                for place, (id, score) in enumerate(result.standings):
+                    standings.append((result.game_id, result.round, place + 1, id, score))
+        with db:
+            if turns:
+                db.executemany(_TURN_SQL, turns)
+                db.executemany(_TURN_PLAYER_SQL, turn_players)
+            if games:
+                db.executemany(_GAME_SQL, games)
+                db.executemany(_STANDING_SQL, standings)
+        self.written += len(batch)
+        self.batches += 1
+
+    # queries
+    def player_history(self, player_id, limit=None):
+        'Rows of turn_players joined with their turn, oldest first'
+        sql = (
+            'SELECT t.game_id, t.round, t.turn, t.time, t.song_id, t.difficulty, p.start_score, p.rank, p.bet_id, p.stake, p.score '
+            'FROM turn_players p JOIN turns t USING (game_id, round, turn) '
+            'WHERE p.player = ? ORDER BY t.time'
+        )
+        args = (player_id,)
+        if limit:
+            sql += ' LIMIT ?'
+            args += (limit,)
+        with closing(self.connect()) as db:
+            return db.execute(sql, args).fetchall()
+
+    def song_turns(self, song_id, difficulty=None):
+        sql = 'SELECT game_id, round, turn, time, event, card FROM turns WHERE song_id = ?'
+        args = (song_id,)
+        if difficulty:
+            sql += ' AND difficulty = ?'
+            args += (difficulty,)
+        with closing(self.connect()) as db:
+            return db.execute(sql + ' ORDER BY time', args).fetchall()
+
+    def games(self, since=None, until=None):
+        'Finished games as (game_id, round, time, turns, winner), oldest first'
+        sql = 'SELECT game_id, round, time, turns, winner FROM games WHERE time >= ? AND time < ? ORDER BY time'
+        with closing(self.connect()) as db:
+            return db.execute(sql, (since if since else 0, until if until else float('inf'))).fetchall()
+
+    def game_standings(self, game_id, round=0):
+        'Final ((id, score), ...) of a game, best first'
+        sql = 'SELECT player, score FROM standings WHERE game_id = ? AND round = ? ORDER BY place'
+        with closing(self.connect()) as db:
+            return tuple(db.execute(sql, (game_id, round)).fetchall())
@@ -0,0 +1,104 @@
+import time
+from math import ceil
+
+class TimerHandle:
+    __slots__ = ('expires', 'callback', 'args', 'slot', 'cancelled')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires # absolute tick
+        self.callback = callback
+        self.args = args
+        self.slot = None # the set the handle currently lives in
+        self.cancelled = False
+
+
+class TimerWheel:
+    '''
+    Hierarchical timer wheel. Level 0 has one slot per tick, every upper level
+    covers wheel_size times the span of the level below and is cascaded down
+    when the lower level wraps around. schedule() and cancel() are O(1) and
+    advance() only touches the slots of the elapsed ticks.
+    '''
+    def __init__(self, tick=0.1, wheel_size=64, levels=4, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.__bits = (wheel_size - 1).bit_length()
+        self.__size = 1 << self.__bits
+        self.__mask = self.__size - 1
+        self.__levels = levels
+        self.__wheels = [[set() for _ in range(self.__size)] for _ in range(levels)]
+        self.__start = clock()
+        self.__current = 0
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def __place(self, handle:TimerHandle):
+        delta = handle.expires - self.__current
+        if delta <= 0:
+            # due on the current tick, cascades run before level 0 fires
+            handle.expires = self.__current
+            slot = self.__wheels[0][self.__current & self.__mask]
+            slot.add(handle)
+            handle.slot = slot
+            return
+        level = 0
+        while level < self.__levels - 1 and delta >= (1 << (self.__bits * (level + 1))):
+            level += 1
+        slot = self.__wheels[level][(handle.expires >> (self.__bits * level)) & self.__mask]
+        slot.add(handle)
+        handle.slot = slot
+
+    def schedule(self, delay, callback, *args) -> TimerHandle:
+        'Call callback(*args) after delay seconds, rounded up to whole ticks'
+        handle = TimerHandle(self.__current + max(1, ceil(delay / self.tick)), callback, args)
+        self.__place(handle)
+        self.__count += 1
+        return handle
+
+    def cancel(self, handle:TimerHandle):
+        if handle.slot is not None:
+            handle.slot.discard(handle)
+            handle.slot = None
+            self.__count -= 1
+        handle.cancelled = True
+
+    def __cascade(self, level):
+        index = (self.__current >> (self.__bits * level)) & self.__mask
+        wheel = self.__wheels[level]
+        handles = wheel[index]
+        wheel[index] = set()
+        for handle in handles:
+            self.__place(handle)
+
+    def advance(self, now=None):
+        'Move the wheel to the clock time now and fire everything due. Returns the number fired'
+        if now is None:
+            now = self.clock()
+        target = int((now - self.__start) / self.tick)
+        fired = 0
+        while self.__current < target:
+            self.__current += 1
+            # cascade upper levels whose lower level just wrapped around
+            level = 1
+            while level < self.__levels and not (self.__current & ((1 << (self.__bits * level)) - 1)):
+                self.__cascade(level)
+                level += 1
+
+            wheel = self.__wheels[0]
+            index = self.__current & self.__mask
+            handles = wheel[index]
+            if not handles:
+                continue
+            wheel[index] = set()
+            for handle in handles:
+                if handle.expires > self.__current:
+                    # beyond the span of the top level, wait for another lap
+                    self.__place(handle)
+                    continue
+                handle.slot = None
+                self.__count -= 1
+                fired += 1
+                handle.callback(*handle.args)
+        return fired
@@ -0,0 +1,163 @@
+import threading
+import time
+
+class Histogram:
+    '''
+    Durations in ns on a log scale, 4 buckets per power of two (at most
+    ~19% relative error). Recording is a dict increment and histograms
+    of several tables merge by adding their buckets.
+    '''
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+    SUB_BITS = 2
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    @classmethod
+    def bucket(cls, ns):
+        if ns < (1 << cls.SUB_BITS):
+            return max(ns, 0)
+        exponent = ns.bit_length() - 1
+        sub = (ns >> (exponent - cls.SUB_BITS)) & ((1 << cls.SUB_BITS) - 1)
+        return ((exponent - cls.SUB_BITS + 1) << cls.SUB_BITS) + sub
+
+    @classmethod
+    def bucket_bounds(cls, index):
+        'Smallest and largest ns of a bucket'
+        if index < (1 << cls.SUB_BITS):
+            return index, index
+        exponent = (index >> cls.SUB_BITS) + cls.SUB_BITS - 1
+        sub = index & ((1 << cls.SUB_BITS) - 1)
+        width = 1 << (exponent - cls.SUB_BITS)
+        low = (1 << exponent) + sub * width
+        return low, low + width - 1
+
+    def record(self, ns):
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+        if self.max is None or ns > self.max:
+            self.max = ns
+        index = self.bucket(ns)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other:'Histogram'):
+        if not other.count:
+            return self
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        'Approximate q-quantile in ns (bucket midpoint), None while empty'
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                low, high = self.bucket_bounds(index)
+                return min(max((low + high) // 2, self.min), self.max)
+        return self.max
+
+
+class PhaseTimings:
+    '''
+    Wall and CPU time histograms by name: Game commands ('bet', 'evaluate_bet'...),
+    card hooks ('card.<card>.<hook>'), event effects ('event.<event>') and
+    'render' (Game.__str__). CPU time is the calling thread's time.
+    Every record is also added to parent, by default the process-wide
+    process_timings, which is the only place that takes a lock.
+    '''
+    def __init__(self, parent=None, lock=False):
+        self.parent = parent
+        self.wall = {}
+        self.cpu = {}
+        self.__lock = threading.Lock() if lock else None
+
+    def record(self, name, wall_ns, cpu_ns):
+        if self.__lock is None:
+            self.__record(name, wall_ns, cpu_ns)
+        else:
+            with self.__lock:
+                self.__record(name, wall_ns, cpu_ns)
+        if self.parent is not None:
+            self.parent.record(name, wall_ns, cpu_ns)
+
+    def __record(self, name, wall_ns, cpu_ns):
+        wall = self.wall.get(name)
+        if wall is None:
+            wall = self.wall[name] = Histogram()
+            self.cpu[name] = Histogram()
+        wall.record(wall_ns)
+        self.cpu[name].record(cpu_ns)
+
+    def call(self, name, func, *args, **kwargs):
+        wall = time.perf_counter_ns()
+        cpu = time.thread_time_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(name, time.perf_counter_ns() - wall, time.thread_time_ns() - cpu)
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            return self.call(name, func, *args, **kwargs)
+        return timed
+
+    def merge(self, other:'PhaseTimings'):
+        for name, wall in other.wall.items():
+            if name not in self.wall:
+                self.wall[name] = Histogram()
+                self.cpu[name] = Histogram()
+            self.wall[name].merge(wall)
+            self.cpu[name].merge(other.cpu[name])
+        return self
+
+    def reset(self):
+        self.wall = {}
+        self.cpu = {}
+
+    def summary(self):
+        '{name: {count, wall/cpu mean, p50, p99, max}} in seconds'
+        result = {}
+        for name in sorted(self.wall):
+            wall = self.wall[name]
+            cpu = self.cpu[name]
+            result[name] = {
+                'count': wall.count,
+                'wall_mean': wall.mean / 1e9,
+                'wall_p50': wall.quantile(0.5) / 1e9,
+                'wall_p99': wall.quantile(0.99) / 1e9,
+                'wall_max': wall.max / 1e9,
+                'cpu_mean': cpu.mean / 1e9,
+                'cpu_p99': cpu.quantile(0.99) / 1e9,
+            }
+        return result
+
+    def __str__(self):
+        lines = [f'{"name":48} {"count":>8} {"wall mean":>10} {"p50":>10} {"p99":>10} {"cpu mean":>10}']
+        for name, row in self.summary().items():
+            lines.append(
+                f'{name:48} {row["count"]:8} {row["wall_mean"]*1e6:8.1f}us {row["wall_p50"]*1e6:8.1f}us '
+                f'{row["wall_p99"]*1e6:8.1f}us {row["cpu_mean"]*1e6:8.1f}us'
+            )
+        return '\n'.join(lines)
+
+
+# every table with timings enabled also records here
+process_timings = PhaseTimings(lock=True)
@@ -1,76 +1,176 @@
+from .logger import default_logger, INFO, KIND_MESSAGE
+
 class GameplayError(Exception):
     pass
 
 class ParseError(Exception):
     pass
 
-class TrieNode:
-    def __init__(self):
-        self.player = None
+class RadixNode:
+    __slots__ = ('label', 'player', 'children', 'count')
+
+    def __init__(self, label='', player=None):
+        self.label = label # edge from the parent, children are keyed by its first character
+        self.player = player
         self.children = {}
+        self.count = 0 # players in this subtree, this node included
 
-    def find(self, id:str):
-        if id == "":
-            if self.player:
-                return self.player
-            else:
-                if len(self.children) == 0:
-                    raise GameplayError('Invalid Player ID!')
-                elif len(self.children) > 1:
-                    raise GameplayError('Duplicate Player ID in blurry search!')
-                else:
-                    return list(self.children.values())[0].find(id)
-        else:
-            if id[0] not in self.children.keys():
-                raise GameplayError("Invalid Player ID!")
-            child = self.children[id[0]]
-            return child.find(id[1:])
 
-    def delete(self, id:str):
-        if id == "":
-            if self.player:
-                player_id = self.player.id
-                self.player = None
-            else:
-                if len(self.children) == 0:
+class RadixTree:
+    '''
+    Compressed trie of player ids. Chains of single children are merged into
+    one edge, so every inner node without a player branches. insert, find
+    and delete are iterative and O(len(id)), delete merges the nodes it
+    leaves behind so the tree does not grow under join/leave churn.
+    '''
+    def __init__(self):
+        self.root = RadixNode()
+
+    def __len__(self):
+        return self.root.count
+
+    def __locate(self, id:str):
+        'Nodes from the root to the node id ends in, at its end or inside its edge'
+        node = self.root
+        path = [node]
+        i = 0
+        n = len(id)
+        while i < n:
+            child = node.children.get(id[i])
+            if child is None:
+                raise GameplayError('Invalid Player ID!')
+            label = child.label
+            end = i + len(label)
+            if end <= n:
+                if not id.startswith(label, i):
                     raise GameplayError('Invalid Player ID!')
-                elif len(self.children) > 1:
-                    raise GameplayError('Duplicate Player ID in blurry search!')
-                else:
-                    node_del, player_id = list(self.children.values())[0].delete(id)
-                    if node_del:
-                        del(list(self.children.values())[0])
-        else:
-            if id[0] not in self.children.keys():
-                raise GameplayError("Invalid Player ID!")
-            child = self.children[id[0]]
-            node_del, player_id = child.delete(id[1:])
-            if node_del:
-                del(self.children[id[0]])
+            elif not label.startswith(id[i:]):
+                raise GameplayError('Invalid Player ID!')
+            node = child
+            path.append(node)
+            i = end
+        return path
 
-        if self.player is None and len(self.children) == 0:
-            return True, player_id
-        return False, player_id
+    def __resolve(self, id:str):
+        'Path to the player id stands for: an exact id, or a prefix of a single id'
+        path = self.__locate(id)
+        node = path[-1]
+        if node.player is None and len(node.children) == 1:
+            # only the root can have a single child without a player
+            node = next(iter(node.children.values()))
+            path.append(node)
+        if node.player is None:
+            if not node.children:
+                raise GameplayError('Invalid Player ID!')
+            raise GameplayError('Duplicate Player ID in blurry search!')
+        return path
+
+    def prefix_node(self, prefix:str):
+        'Root of the subtree of all ids starting with prefix, None without any'
+        try:
+            return self.__locate(prefix)[-1]
+        except GameplayError:
+            return None
+
+    def find(self, id:str):
+        # exact ids are the common case, look them up without building the path
+        node = self.root
+        i = 0
+        n = len(id)
+        while i < n:
+            node = node.children.get(id[i])
+            if node is None or not id.startswith(node.label, i):
+                break
+            i += len(node.label)
+        else:
+            if node.player is not None:
+                return node.player
+        return self.__resolve(id)[-1].player
 
     def insert(self, id:str, player):
-        if id == "":
-            if self.player:
-                raise GameplayError("Duplicate Player id!")
-            else:
-                self.player = player
-            return
+        node = self.root
+        path = [node]
+        i = 0
+        n = len(id)
+        while i < n:
+            child = node.children.get(id[i])
+            if child is None:
+                child = RadixNode(id[i:], player)
+                node.children[id[i]] = child
+                path.append(child)
+                break
+            label = child.label
+            j = 0
+            while j < len(label) and i + j < n and label[j] == id[i + j]:
+                j += 1
+            if j < len(label):
+                # split the edge where id leaves it
+                middle = RadixNode(label[:j])
+                middle.count = child.count
+                child.label = label[j:]
+                middle.children[child.label[0]] = child
+                node.children[id[i]] = middle
+                child = middle
+            node = child
+            path.append(node)
+            i += j
         else:
-            if id[0] not in self.children.keys():
-                self.children[id[0]] = TrieNode()
-            child = self.children[id[0]]
-            child.insert(id[1:], player)
+            if node.player is not None:
+                raise GameplayError("Duplicate Player id!")
+            node.player = player
+        for node in path:
+            node.count += 1
+
+    def delete(self, id:str):
+        'Removes the player id stands for (same resolution as find) and returns it'
+        path = self.__resolve(id)
+        node = path[-1]
+        player = node.player
+        node.player = None
+        for step in path:
+            step.count -= 1
+        if node is self.root:
+            return player
+        parent = path[-2]
+        if not node.children:
+            del parent.children[node.label[0]]
+            if parent is not self.root and parent.player is None and len(parent.children) == 1:
+                self.__merge(path[-3], parent)
+        elif len(node.children) == 1:
+            self.__merge(parent, node)
+        return player
+
+    @staticmethod
+    def __merge(parent:RadixNode, node:RadixNode):
+        'Replace node, which has no player and one child, by that child'
+        child = next(iter(node.children.values()))
+        child.label = node.label + child.label
+        parent.children[node.label[0]] = child
+
+    def players(self, node:RadixNode=None):
+        'Every player in the subtree of node (the whole tree by default)'
+        stack = [node if node else self.root]
+        while stack:
+            node = stack.pop()
+            if node.player is not None:
+                yield node.player
+            stack.extend(node.children.values())
+
+    def node_count(self):
+        count = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children.values())
+        return count
 
 
-def log(s:str):
-    print(s)
+def log(s:str, level=INFO):
+    default_logger.log(level, KIND_MESSAGE, s)
 
 def divideline():
-    log('=============================')
+    default_logger.divideline()
 
 '''
 def check_ndarray(value):
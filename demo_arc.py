@@ -65,6 +65,8 @@ game.bet('p3', None)
 game.bet('p4', 'p1', 3)
 
 game.show_card()
+if game.card_pending:
+    game.decide_card(input('Use card? [Y/N] ').lower() == 'y')
 
 game.play('p1', 0)
 # replay